@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.models import Group
-from .models import User, School, Class, Session, Lesson, Progress
+from .models import User, School, Class, Session, Lesson, Progress, InteractionEvent, LessonRollup, SessionRollup, ClassRollup, LessonPackage
 
 admin.site.register(User)
 admin.site.register(School)
@@ -8,3 +8,8 @@ admin.site.register(Class)
 admin.site.register(Session)
 admin.site.register(Lesson)
 admin.site.register(Progress)
+admin.site.register(InteractionEvent)
+admin.site.register(LessonRollup)
+admin.site.register(SessionRollup)
+admin.site.register(ClassRollup)
+admin.site.register(LessonPackage)
@@ -1,3 +1,4 @@
+import atexit
 from django.apps import AppConfig
 
 class LmsConfig(AppConfig):
@@ -8,6 +9,14 @@ class LmsConfig(AppConfig):
         # Avoid import errors by importing models here
         from django.contrib.auth.models import Group
         from django.db.models.signals import post_migrate
+        from . import signals  # noqa: F401 (registers the cache invalidation receivers)
+        from .ingest import event_buffer
+        from .session_state import session_states
+
+        # Write-behind session state and buffered events still pending when the worker exits
+        # (the event buffer's flush timer is a daemon thread and would die with them)
+        atexit.register(session_states.flush_pending)
+        atexit.register(event_buffer.flush)
 
         # Create groups and roles after migrations are complete
         def create_roles(sender, **kwargs):
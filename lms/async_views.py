@@ -0,0 +1,67 @@
+from asgiref.sync import sync_to_async
+from rest_framework import exceptions, status
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+
+class AsyncAPIView(APIView):
+    """
+    APIView for ``async def`` handlers, dispatched on the event loop the way
+    adrf does it: DRF's request, parsers, content negotiation, renderers,
+    throttling and exception handler all apply. Authenticators with an
+    ``aauthenticate()`` coroutine are awaited, others run in a thread;
+    permission and throttle checks must not query the database.
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        # APIView.dispatch(), awaiting the handler
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await self.ainitial(request, *args, **kwargs)
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+            response = await handler(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    async def ainitial(self, request, *args, **kwargs):
+        # APIView.initial(), awaiting authentication
+        self.format_kwarg = self.get_format_suffix(**kwargs)
+        request.accepted_renderer, request.accepted_media_type = self.perform_content_negotiation(request)
+        request.version, request.versioning_scheme = self.determine_version(request, *args, **kwargs)
+        await self.aperform_authentication(request)
+        self.check_permissions(request)
+        self.check_throttles(request)
+
+    async def aperform_authentication(self, request):
+        # Request._authenticate(), so request.user is set before any handler touches it
+        for authenticator in request.authenticators:
+            try:
+                if hasattr(authenticator, 'aauthenticate'):
+                    user_auth_tuple = await authenticator.aauthenticate(request)
+                else:
+                    user_auth_tuple = await sync_to_async(authenticator.authenticate)(request)
+            except exceptions.APIException:
+                request._not_authenticated()
+                raise
+            if user_auth_tuple is not None:
+                request._authenticator = authenticator
+                request.user, request.auth = user_auth_tuple
+                return
+        request._not_authenticated()
+
+    async def options(self, request, *args, **kwargs):
+        # Django requires every handler of an async view to be async
+        if self.metadata_class is None:
+            return self.http_method_not_allowed(request, *args, **kwargs)
+        return Response(self.metadata_class().determine_metadata(request, self), status=status.HTTP_200_OK)
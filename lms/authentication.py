@@ -0,0 +1,93 @@
+from collections import namedtuple
+from django.conf import settings
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication, get_authorization_header
+from .caching import LRUTTLCache
+from .models import User
+
+# Compact, immutable view of an authenticated user kept in the token cache
+Principal = namedtuple('Principal', ['user_id', 'school_id', 'nickname', 'is_staff', 'role', 'role_mask'])
+
+# Token key -> Principal, shared by every request handled by this process
+token_cache = LRUTTLCache(
+    maxsize=getattr(settings, 'LMS_TOKEN_CACHE_SIZE', 4096),
+    ttl=getattr(settings, 'LMS_TOKEN_CACHE_TTL', 60),
+)
+
+def build_principal(user):
+    return Principal(user.pk, user.school_id, user.nickname, user.is_staff, user.role, user.role_mask)
+
+
+def user_from_principal(principal):
+    """
+    Rebuild a User without touching the database. Unloaded fields are deferred,
+    so they are fetched on access and a save() only writes the loaded columns.
+    """
+    loaded = {
+        'id': principal.user_id,
+        'school_id': principal.school_id,
+        'nickname': principal.nickname,
+        'is_staff': principal.is_staff,
+        'is_active': True,
+        'role': principal.role,
+        'role_mask': principal.role_mask,
+    }
+    # from_db expects the values in concrete field order
+    field_names = [f.attname for f in User._meta.concrete_fields if f.attname in loaded]
+    user = User.from_db('default', field_names, [loaded[name] for name in field_names])
+    user.principal = principal
+    return user
+
+
+def invalidate_token(key):
+    token_cache.delete(key)
+
+
+def invalidate_user(user_id):
+    token_cache.delete_where(lambda principal: principal.user_id == user_id)
+
+
+def cache_token(key, token):
+    # Principal of a token loaded from the database, remembered for later requests
+    if token is None:
+        raise exceptions.AuthenticationFailed('Invalid token.')
+    if not token.user.is_active:
+        raise exceptions.AuthenticationFailed('User inactive or deleted.')
+    principal = build_principal(token.user)
+    token_cache.set(key, principal)
+    return principal
+
+
+# Token authentication that resolves repeat tokens from an in-process LRU+TTL cache
+class CachedTokenAuthentication(TokenAuthentication):
+    def authenticate_credentials(self, key):
+        principal = token_cache.get(key)
+        if principal is None:
+            principal = cache_token(key, self.get_model().objects.select_related('user').filter(key=key).first())
+
+        user = user_from_principal(principal)
+        # Unsaved token instance for request.auth; it is never written back
+        return (user, self.get_model()(key=key, user=user))
+
+    async def aauthenticate(self, request):
+        """
+        authenticate() for async views (lms.async_views): the same header
+        checks and errors, with a cache miss awaited instead of blocking.
+        """
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) == 1:
+            raise exceptions.AuthenticationFailed('Invalid token header. No credentials provided.')
+        if len(auth) > 2:
+            raise exceptions.AuthenticationFailed('Invalid token header. Token string should not contain spaces.')
+        try:
+            key = auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed('Invalid token header. Token string should not contain invalid characters.')
+
+        principal = token_cache.get(key)
+        if principal is None:
+            principal = cache_token(key, await self.get_model().objects.select_related('user').filter(key=key).afirst())
+        user = user_from_principal(principal)
+        return (user, self.get_model()(key=key, user=user))
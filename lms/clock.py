@@ -0,0 +1,89 @@
+# Clock synchronization between the server and headsets, NTP style.
+#
+# After a client sends {"action": "time_sync"} its consumer pings it:
+#
+#   server -> {"action": "ping", "id", "t0"}            t0: server time when sent
+#   client -> {"action": "pong", "id", "t0", "t1", "t2"} t1/t2: client time at receipt/reply
+#   server -> {"action": "clock", "offset", "rtt"}       t3: server time at receipt
+#
+# rtt = (t3 - t0) - (t2 - t1) and offset = ((t1 - t0) + (t2 - t3)) / 2, the
+# client clock minus the server clock. All times are Unix milliseconds. The
+# sample with the lowest round trip is the least disturbed by queueing, so it
+# gives the offset; the worst recent round trip decides how far ahead control
+# broadcasts are scheduled ("execute_at", server time).
+import time
+from collections import deque
+from django.conf import settings
+
+# Seconds between the pings of the initial burst
+BURST_SPACING = 0.05
+
+
+def now_ms():
+    return time.time() * 1000
+
+
+class ClockEstimate:
+    """
+    Offset and round-trip time of one connection, from its latest ping/pong samples.
+    """
+
+    def __init__(self, window):
+        self.samples = deque(maxlen=window)  # (rtt, offset)
+
+    def add(self, t0, t1, t2, t3):
+        rtt = (t3 - t0) - (t2 - t1)
+        if rtt < 0 or t2 < t1:
+            raise ValueError("Inconsistent timestamps")
+        self.samples.append((rtt, ((t1 - t0) + (t2 - t3)) / 2))
+
+    @property
+    def offset(self):
+        return min(self.samples)[1] if self.samples else None
+
+    @property
+    def rtt(self):
+        return min(self.samples)[0] if self.samples else None
+
+    @property
+    def worst_rtt(self):
+        return max(self.samples)[0] if self.samples else None
+
+
+class ClockRegistry:
+    """
+    Worst recent round trip of every synchronized connection, per session.
+    Each worker process keeps its own, so with several workers a broadcast is
+    scheduled from the connections of the worker that sends it.
+    """
+
+    def __init__(self):
+        self._sessions = {}  # session id -> {channel name: worst rtt}
+
+    def update(self, session_id, channel_name, worst_rtt):
+        self._sessions.setdefault(session_id, {})[channel_name] = worst_rtt
+
+    def discard(self, session_id, channel_name):
+        channels = self._sessions.get(session_id)
+        if channels is None:
+            return
+        channels.pop(channel_name, None)
+        if not channels:
+            del self._sessions[session_id]
+
+    def worst_rtt(self, session_id):
+        return max(self._sessions.get(session_id, {}).values(), default=0)
+
+    def execute_at(self, session_id):
+        """
+        Server time at which every headset of the session should apply a
+        control action: the worst round trip plus a margin, capped.
+        """
+        lead = self.worst_rtt(session_id) + getattr(settings, 'LMS_CONTROL_LEAD_MARGIN', 50)
+        return round(now_ms() + min(lead, getattr(settings, 'LMS_CONTROL_LEAD_MAX', 1000)))
+
+    def clear(self):
+        self._sessions.clear()
+
+
+clock_registry = ClockRegistry()
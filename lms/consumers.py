@@ -1,11 +1,51 @@
+import asyncio
+import itertools
 import json
 import logging
+import uuid
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+from .clock import BURST_SPACING, ClockEstimate, clock_registry, now_ms
+from .ingest import build_events, event_buffer
 from .models import Session
-from asgiref.sync import sync_to_async
+from . import outbound, protocol
+from .protocol import encode_frame
+from .presence import presence_registry
+from .registry import peer_registry
+from .session_state import session_states
 
 logger = logging.getLogger(__name__)
 
+# Queued in place of a ping frame; the writer stamps and encodes it when it goes out
+PING = object()
+
+
+async def broadcast_control(channel_layer, session_id, state, message, status):
+    """
+    Send a control change to the session group, with the state so other
+    workers can catch up. Headsets act on it at the returned execute_at
+    (server time), so playback starts together however long each delivery took.
+    """
+    execute_at = clock_registry.execute_at(session_id)
+    snapshot = state.snapshot()
+    await channel_layer.group_send(
+        f'session_{session_id}',
+        {
+            "type": "session_control",
+            "state": snapshot,
+            "text": encode_frame({
+                "action": "session_control",
+                "message": message,
+                "status": status,
+                "seq": snapshot["seq"],
+                "execute_at": execute_at,
+            }),
+        }
+    )
+    return execute_at
+
+
 class SessionConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.session_id = self.scope['url_route']['kwargs']['session_id']
@@ -13,22 +53,221 @@ class SessionConsumer(AsyncWebsocketConsumer):
         
         # Logging connection attempt
         logger.info(f"Client attempting to connect to session {self.session_id}")
+
+        try:
+            state = await session_states.get(self.session_id)
+        except Session.DoesNotExist:
+            logger.info(f"Rejected connection to unknown session {self.session_id}")
+            await self.close(code=4404)
+            return
         
+        # Signaling address; anonymous clients can't take over an id that is a user's or in use
+        peer_id = self.get_peer_id()
+        if peer_id is None:
+            logger.info(f"Rejected peer id claimed by an anonymous client in session {self.session_id}")
+            await self.close(code=4409)
+            return
+
+        # Headsets may opt in to the binary subprotocol; JSON stays the default
+        self.binary = protocol.SUBPROTOCOL in self.scope.get('subprotocols', [])
+
+        # Latest telemetry sample of each kind (pose, gaze, interaction) from this client
+        self.telemetry = {}
+
+        # Viewport streaming: our pose/gaze samples not yet forwarded to viewers, and, when
+        # watching, the latest samples per student waiting for the next batch
+        self.viewport_group = f'session_{self.session_id}_viewers'
+        self.viewport_outbox = {}
+        self.viewport_forward_task = None
+        self.viewport_filter = None  # Peer ids to watch, None for everyone
+        self.viewport_interval = None  # Seconds between batches while subscribed
+        self.viewport_pending = {}
+        self.viewport_flush_task = None
+        self.viewport_viewers = set()  # Channels of the session's sockets watching, on any worker
+
+        # Clock offset and round trip, measured once the client asks for time sync
+        self.clock = ClockEstimate(getattr(settings, 'LMS_CLOCK_SYNC_WINDOW', 16))
+        self.pings = {}  # ping id -> t0 of sent pings awaiting a pong
+        self.ping_ids = itertools.count(1)
+        self.clock_task = None
+
         # Add the client to the session group
         await self.channel_layer.group_add(self.group_name, self.channel_name)
-        await self.accept()
+        await self.accept(subprotocol=protocol.SUBPROTOCOL if self.binary else None)
+
+        # Everything we send goes through a bounded queue drained by a writer task
+        self.send_queue = outbound.SendQueue(
+            getattr(settings, 'LMS_SEND_QUEUE_LIMIT', 256), getattr(settings, 'LMS_SEND_QUEUE_EPHEMERAL', 32)
+        )
+        self.writer_task = asyncio.ensure_future(self.write_frames())
+        self.closing = False
+
+        # Current state right away, so late joiners don't wait for the next control broadcast
+        await self.send_frame(encode_frame({"action": "session_state", **state.snapshot()}))
+
+        # Trickle-ICE candidates waiting to be sent as one batch, per target peer
+        self.ice_buffers = {}
+        self.ice_flush_tasks = {}
+
+        # Register as a signaling peer and announce ourselves to the rest of the session
+        self.peer_id = peer_id
+        peer_registry.register(self.session_id, self.peer_id, self.channel_name)
+        await self.send_frame(encode_frame({
+            "action": "peer_id",
+            "peer_id": self.peer_id,
+            "peers": [peer for peer in peer_registry.peers(self.session_id) if peer != self.peer_id],
+        }))
+        await self.channel_layer.group_send(
+            self.group_name,
+            {
+                "type": "peer_joined",
+                "peer_id": self.peer_id,
+                "channel": self.channel_name,
+                # Users may take over their own id from another socket, anonymous clients may not
+                "anonymous": not self.peer_id.isdigit(),
+                "text": encode_frame({"action": "peer_joined", "peer_id": self.peer_id}),
+            }
+        )
+
+        await self.join_presence(state)
 
-        logger.info(f"Client connected to session {self.session_id}")
+        logger.info(f"Client connected to session {self.session_id} as peer {self.peer_id}")
 
     async def disconnect(self, close_code):
         await self.channel_layer.group_discard(self.group_name, self.channel_name)
+        if getattr(self, 'presence', None) is not None:
+            await self.leave_presence()
+            if not presence_registry.count(self.session_id):
+                # Last socket of the session on this worker: write its state and drop it
+                await session_states.evict(self.session_id)
+        if getattr(self, 'writer_task', None) is not None:
+            self.writer_task.cancel()
+        if getattr(self, 'clock_task', None) is not None:
+            self.clock_task.cancel()
+        for task in (getattr(self, 'viewport_forward_task', None), getattr(self, 'viewport_flush_task', None)):
+            if task is not None:
+                task.cancel()
+        if getattr(self, 'viewport_interval', None) is not None:
+            await self.channel_layer.group_discard(self.viewport_group, self.channel_name)
+        clock_registry.discard(self.session_id, self.channel_name)
+        if getattr(self, 'peer_id', None) is not None:
+            # Deliver candidates still waiting in the coalescing window
+            for target in list(self.ice_buffers):
+                await self.flush_ice_candidates(target)
+            peer_registry.unregister(self.session_id, self.peer_id, self.channel_name)
+            await self.channel_layer.group_send(
+                self.group_name,
+                {
+                    "type": "peer_left",
+                    "peer_id": self.peer_id,
+                    "channel": self.channel_name,
+                    "text": encode_frame({"action": "peer_left", "peer_id": self.peer_id}),
+                }
+            )
         logger.info(f"Client disconnected from session {self.session_id}")
 
-    async def receive(self, text_data):
-        # Parse the incoming data
-        data = json.loads(text_data)
+    async def join_presence(self, state):
+        """
+        Enter the session's presence index and tell its teachers. The session's
+        own teacher gets the full roster once, then only join/leave deltas.
+        Deltas carry no count: they may come from other workers, whose local
+        count says nothing about the session, so clients keep their own.
+        """
+        user = self.scope.get('user')
+        authenticated = user is not None and user.is_authenticated
+        self.presence = presence_registry.join(
+            self.session_id, self.peer_id, self.channel_name,
+            user_id=user.pk if authenticated else None,
+            role=(user.role or None) if authenticated else None,
+            binary=self.binary,
+            send_queue=self.send_queue,
+        )
+        self.teachers_group = f'session_{self.session_id}_teachers'
+        self.is_teacher = authenticated and user.pk == state.teacher_id
+        await self.channel_layer.group_send(
+            self.teachers_group,
+            {
+                "type": "presence_delta",
+                "text": encode_frame({
+                    "action": "presence",
+                    "op": "join",
+                    "peer": self.presence.as_dict(),
+                }),
+            }
+        )
+        if self.is_teacher:
+            await self.channel_layer.group_add(self.teachers_group, self.channel_name)
+            await self.send_frame(encode_frame({
+                "action": "presence_roster",
+                "peers": presence_registry.roster(self.session_id),
+                "count": presence_registry.count(self.session_id),
+            }))
+
+        timeout = getattr(settings, 'LMS_PRESENCE_TIMEOUT', None)
+        self.idle_task = asyncio.ensure_future(self.evict_when_idle(timeout)) if timeout else None
+
+    async def leave_presence(self):
+        if self.idle_task is not None and self.idle_task is not asyncio.current_task():
+            self.idle_task.cancel()
+        if self.is_teacher:
+            await self.channel_layer.group_discard(self.teachers_group, self.channel_name)
+        if not presence_registry.leave(self.session_id, self.peer_id, self.channel_name):
+            return  # Already gone, or replaced by a reconnect
+        await self.channel_layer.group_send(
+            self.teachers_group,
+            {
+                "type": "presence_delta",
+                "text": encode_frame({
+                    "action": "presence",
+                    "op": "leave",
+                    "peer_id": self.peer_id,
+                }),
+            }
+        )
+
+    async def evict_when_idle(self, timeout):
+        # Close the socket once nothing, not even a heartbeat, arrived for `timeout` seconds
+        while self.presence.idle_for() < timeout:
+            await asyncio.sleep(timeout - self.presence.idle_for())
+        logger.info(f"Evicting idle peer {self.peer_id} from session {self.session_id}")
+        # The server's disconnect may come late on a half-open connection
+        await self.leave_presence()
+        await self.close(code=4408)
+
+    def get_peer_id(self):
+        """
+        Authenticated users are addressed by user id; anonymous clients may pick
+        an id with ?peer=<id>, otherwise one is generated. None when an anonymous
+        client asks for a numeric id (reserved for users) or one already registered.
+        """
+        user = self.scope.get('user')
+        if user is not None and user.is_authenticated:
+            return str(user.pk)
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        if query.get('peer'):
+            peer_id = query['peer'][0]
+            if peer_id.isdigit() or peer_registry.lookup(self.session_id, peer_id) is not None:
+                return None
+            return peer_id
+        return uuid.uuid4().hex[:12]
+
+    async def receive(self, text_data=None, bytes_data=None):
+        # Any frame counts as a sign of life
+        self.presence.touch()
+
+        # Parse the incoming data: JSON text frames, or binary frames on the binary subprotocol
+        try:
+            if bytes_data is not None:
+                data = protocol.unpack(bytes_data)
+            else:
+                data = json.loads(text_data)
+                if not isinstance(data, dict):
+                    raise ValueError("expected a JSON object")
+        except ValueError as exc:
+            await self.send_frame(encode_frame({"message": f"Malformed frame: {exc}", "status": "error"}))
+            return
         action = data.get("action")
-        logger.info(f"Received action: {action} with data: {data}")
+        logger.debug(f"Received action: {action} with data: {data}")
         
         # Handling various actions based on the WebRTC communication or session control
         if action == "start":
@@ -37,124 +276,420 @@ class SessionConsumer(AsyncWebsocketConsumer):
             response = await self.pause_session()
         elif action == "stop":
             response = await self.stop_session()
-        elif action in ["offer", "answer", "ice_candidate"]:
+        elif action in ["ice_candidate", "end_of_candidates"]:
+            response = await self.queue_ice_candidate(action, data)
+        elif action in ["offer", "answer"]:
             response = await self.handle_webrtc_signaling(action, data)
+        elif action == "events":
+            response = await self.ingest_events(data)
+        elif action in ["pose", "gaze", "interaction"]:
+            response = await self.handle_telemetry(action, data)
+        elif action == "viewport_subscribe":
+            response = await self.subscribe_viewport(data)
+        elif action == "viewport_unsubscribe":
+            response = await self.unsubscribe_viewport()
+        elif action == "heartbeat":
+            response = {"action": "heartbeat", "status": "success"}
+        elif action == "time_sync":
+            response = await self.start_time_sync()
+        elif action == "pong":
+            response = await self.handle_pong(data)
         else:
             response = {"message": "Invalid action", "status": "error"}
 
-        # Send the response back to the client
-        await self.send(text_data=json.dumps(response))
+        # Send the response back to the client (telemetry is not acknowledged)
+        if response is not None:
+            # Only the latest heartbeat/clock reply matters
+            key = response["action"] if response.get("action") in ("heartbeat", "clock") else None
+            await self.send_frame(encode_frame(response), key=key)
 
-    async def start_session(self):
-        session = await self.get_session()
-        session.is_active = True
-        session.is_paused = False
-        await self.update_session(session)
+    async def send_frame(self, text, key=None):
+        """
+        Queue an encoded JSON frame (or PING) for the writer task. Frames with a
+        key are ephemeral: a newer one with the same key replaces it while
+        queued, and they may be dropped; the rest are delivered in order or the
+        slow client is disconnected (see lms/outbound.py).
+        """
+        if self.closing:
+            return
+        if not self.send_queue.put(text, key):
+            self.closing = True
+            outbound.stats['slow_disconnects'] += 1
+            logger.warning(f"Disconnecting slow peer {getattr(self, 'peer_id', None)} from session {self.session_id}: "
+                           f"{len(self.send_queue)} frames queued")
+            await self.close(code=4429)
+
+    async def write_frames(self):
+        # Writer task: frames go out one at a time, wrapped for binary-subprotocol clients
+        while True:
+            text = await self.send_queue.get()
+            if text is PING:
+                text = self.stamp_ping()
+            if self.binary:
+                await self.send(bytes_data=protocol.wrap_json(text))
+            else:
+                await self.send(text_data=text)
+
+    async def ingest_events(self, data):
+        """
+        Queue a batch of interaction events for bulk insertion. When the buffer
+        is full the client is told to retry later instead of being queued.
+        """
+        state = await session_states.get(self.session_id)
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            return {"action": "events", "message": "Authentication required", "status": "error"}
+        if user.school_id != state.school_id:
+            return {"action": "events", "message": "Session not found or unauthorized", "status": "error"}
+        try:
+            events = build_events(data.get("events"), self.session_id, state.school_id, user.pk)
+        except ValueError as exc:
+            return {"action": "events", "message": str(exc), "status": "error"}
 
-        # Log the start of the session
-        logger.info(f"Session {self.session_id} started")
+        retry_after = event_buffer.add(events)
+        if retry_after is not None:
+            return {"action": "events", "status": "retry", "retry_after": retry_after}
+        return {"action": "events", "status": "accepted", "count": len(events)}
 
-        # Broadcast to group that the session has started
+    async def handle_telemetry(self, action, data):
+        """
+        Keep the latest pose/gaze/interaction sample reported by this client.
+        Pose and gaze also go to teachers watching the session, at most
+        LMS_VIEWPORT_RATE times a second: samples arriving in between replace
+        the one waiting to be forwarded. With nobody watching nothing is sent.
+        """
+        self.telemetry[action] = data
+        if action in ("pose", "gaze") and self.viewport_viewers:
+            self.viewport_outbox[action] = {key: value for key, value in data.items() if key != "action"}
+            if self.viewport_forward_task is None:
+                self.viewport_forward_task = asyncio.ensure_future(self.forward_viewport_later())
+        return None
+
+    async def forward_viewport_later(self):
+        await asyncio.sleep(1 / getattr(settings, 'LMS_VIEWPORT_RATE', 10))
+        self.viewport_forward_task = None
+        samples, self.viewport_outbox = self.viewport_outbox, {}
+        if not self.viewport_viewers:
+            return  # The last viewer left while we waited
         await self.channel_layer.group_send(
-            self.group_name,
-            {
-                "type": "session_control",
-                "message": "Session has started",
-                "status": "started",
-            }
+            self.viewport_group,
+            {"type": "viewport_sample", "peer_id": self.peer_id, "samples": samples}
         )
-        return {"message": "Session has started", "status": "started"}
 
-    async def pause_session(self):
-        session = await self.get_session()
-        session.is_paused = True
-        await self.update_session(session)
+    async def subscribe_viewport(self, data):
+        """
+        Start (or change) watching the students' viewports: every tick one
+        "viewport" frame carries the latest samples of the students that moved.
+        Optional "students" limits it to those peer ids and "rate" (Hz) lowers the tick rate.
+        """
+        if not self.is_teacher:
+            return {"action": "viewport_subscribe", "message": "Only the session's teacher can watch viewports", "status": "error"}
+        students = data.get("students")
+        if students is not None and not isinstance(students, list):
+            return {"action": "viewport_subscribe", "message": "students must be a list of peer ids", "status": "error"}
+        max_rate = getattr(settings, 'LMS_VIEWPORT_RATE', 10)
+        try:
+            rate = min(float(data.get("rate", max_rate)), max_rate)
+        except (TypeError, ValueError):
+            rate = 0
+        if rate <= 0:
+            return {"action": "viewport_subscribe", "message": "rate must be a positive number", "status": "error"}
+
+        self.viewport_filter = None if students is None else {str(student) for student in students}
+        if self.viewport_interval is None:
+            await self.channel_layer.group_add(self.viewport_group, self.channel_name)
+            await self.announce_viewer(True)
+        self.viewport_interval = 1 / rate
+        return {"action": "viewport_subscribe", "rate": rate, "status": "success"}
 
-        # Log the pause of the session
-        logger.info(f"Session {self.session_id} paused")
+    async def unsubscribe_viewport(self):
+        if self.viewport_interval is not None:
+            await self.channel_layer.group_discard(self.viewport_group, self.channel_name)
+            await self.announce_viewer(False)
+        if self.viewport_flush_task is not None:
+            self.viewport_flush_task.cancel()
+            self.viewport_flush_task = None
+        self.viewport_interval = None
+        self.viewport_pending = {}
+        return {"action": "viewport_unsubscribe", "status": "success"}
 
-        # Notify group about the pause
+    async def announce_viewer(self, watching):
+        # Headsets only forward samples while somebody watches; peers joining later learn it from peer_introduced
         await self.channel_layer.group_send(
             self.group_name,
-            {
-                "type": "session_control",
-                "message": "Session is paused",
-                "status": "paused",
-            }
+            {"type": "viewport_viewer", "channel": self.channel_name, "watching": watching}
         )
-        return {"message": "Session is paused", "status": "paused"}
+
+    async def viewport_viewer(self, event):
+        """
+        A socket of the session started or stopped watching viewports.
+        """
+        if event["watching"]:
+            self.viewport_viewers.add(event["channel"])
+        else:
+            self.viewport_viewers.discard(event["channel"])
+
+    async def viewport_sample(self, event):
+        """
+        A student's latest pose/gaze; kept until our next tick, replacing older samples.
+        """
+        if self.viewport_interval is None:
+            return
+        if self.viewport_filter is not None and event["peer_id"] not in self.viewport_filter:
+            return
+        self.viewport_pending.setdefault(event["peer_id"], {}).update(event["samples"])
+        if self.viewport_flush_task is None:
+            self.viewport_flush_task = asyncio.ensure_future(self.flush_viewport_later())
+
+    async def flush_viewport_later(self):
+        await asyncio.sleep(self.viewport_interval)
+        if self.viewport_interval is None:
+            # Unsubscribed while we slept
+            self.viewport_flush_task = None
+            return
+        if self.send_queue.pending("viewport"):
+            # The last batch hasn't gone out yet; keep collecting for the next tick
+            self.viewport_flush_task = asyncio.ensure_future(self.flush_viewport_later())
+            return
+        self.viewport_flush_task = None
+        students, self.viewport_pending = self.viewport_pending, {}
+        if students:
+            await self.send_frame(encode_frame({"action": "viewport", "students": students}), key="viewport")
+
+    async def start_time_sync(self):
+        """
+        Ping the client LMS_CLOCK_SYNC_SAMPLES times in quick succession, then
+        every LMS_CLOCK_SYNC_INTERVAL seconds while it stays connected.
+        """
+        if self.clock_task is not None:
+            self.clock_task.cancel()
+        self.clock_task = asyncio.ensure_future(self.ping_loop())
+        return None
+
+    async def ping_loop(self):
+        for _ in range(getattr(settings, 'LMS_CLOCK_SYNC_SAMPLES', 8)):
+            await self.send_ping()
+            await asyncio.sleep(BURST_SPACING)
+        interval = getattr(settings, 'LMS_CLOCK_SYNC_INTERVAL', 5.0)
+        while interval:
+            await asyncio.sleep(interval)
+            await self.send_ping()
+
+    async def send_ping(self):
+        # A ping still queued is replaced, so only pings that go out get an id and a t0
+        await self.send_frame(PING, key="ping")
+
+    def stamp_ping(self):
+        # Called by the writer right before sending, so time spent in the queue doesn't count as round trip
+        ping_id = next(self.ping_ids)
+        if len(self.pings) >= self.clock.samples.maxlen:
+            # Forget the oldest unanswered ping
+            self.pings.pop(next(iter(self.pings)))
+        self.pings[ping_id] = t0 = now_ms()
+        return encode_frame({"action": "ping", "id": ping_id, "t0": t0})
+
+    async def handle_pong(self, data):
+        """
+        Add a clock sample from the client's answer to one of our pings and
+        tell it the current estimate.
+        """
+        t3 = now_ms()
+        ping_id = data.get("id")
+        # Ids are ints we handed out; anything else (lists, dicts, bools) can't be one
+        t0 = self.pings.pop(ping_id, None) if type(ping_id) is int else None
+        if t0 is None:
+            return {"action": "pong", "message": "Unknown ping id", "status": "error"}
+        try:
+            self.clock.add(t0, float(data["t1"]), float(data["t2"]), t3)
+        except (KeyError, TypeError, ValueError):
+            return {"action": "pong", "message": "pong needs consistent t1 and t2", "status": "error"}
+
+        clock_registry.update(self.session_id, self.channel_name, self.clock.worst_rtt)
+        return {"action": "clock", "offset": round(self.clock.offset, 3), "rtt": round(self.clock.rtt, 3)}
+
+    async def start_session(self):
+        return await self.control_session("start", "Session has started", "started")
+
+    async def pause_session(self):
+        state = await session_states.get(self.session_id)
+        if not state.is_active:
+            return {"message": "Session is not active", "status": "error"}
+        return await self.control_session("pause", "Session is paused", "paused")
 
     async def stop_session(self):
-        session = await self.get_session()
-        session.is_active = False
-        session.is_paused = False
-        await self.update_session(session)
+        return await self.control_session("stop", "Session has stopped", "stopped")
 
-        # Log the stop of the session
-        logger.info(f"Session {self.session_id} stopped")
+    async def control_session(self, action, message, status):
+        """
+        Apply a control action to the in-memory session state (persisted in the
+        background) and broadcast the new state to the session group.
+        """
+        state = await session_states.apply(self.session_id, action)
 
-        # Notify group that the session has stopped
-        await self.channel_layer.group_send(
-            self.group_name,
-            {
-                "type": "session_control",
-                "message": "Session has stopped",
-                "status": "stopped",
-            }
-        )
-        return {"message": "Session has stopped", "status": "stopped"}
+        # Log the state change
+        logger.info(f"Session {self.session_id} {status}")
+
+        execute_at = await broadcast_control(self.channel_layer, self.session_id, state, message, status)
+        return {"message": message, "status": status, "execute_at": execute_at}
 
     async def handle_webrtc_signaling(self, action, data):
         """
         Handle WebRTC signaling actions (offer, answer, ICE candidates)
-        and relay them to other clients in the session.
+        and relay them to the peer named in "target".
         """
         logger.info(f"Handling WebRTC signaling: {action} with data: {data}")
 
-        # Relay the offer, answer, or ICE candidate to all peers in the group
-        await self.channel_layer.group_send(
-            self.group_name,
+        target = data.get("target")
+        if target is None:
+            return {"message": f"{action} must name a target peer", "status": "error"}
+
+        channel = peer_registry.lookup(self.session_id, str(target))
+        if channel is None:
+            return {"message": f"Unknown peer {target}", "status": "error"}
+
+        if action == "answer":
+            # Candidates gathered before the answer must not arrive after it
+            await self.flush_ice_candidates(str(target))
+
+        # Relay the offer or answer to the addressed peer only
+        payload = {key: value for key, value in data.items() if key not in ("type", "target")}
+        payload.update({"action": action, "from": self.peer_id})
+        await self.channel_layer.send(channel, {"type": "webrtc_signal", "text": encode_frame(payload)})
+
+        return {"message": f"{action} relayed", "status": "success"}
+
+    async def queue_ice_candidate(self, action, data):
+        """
+        Buffer trickle-ICE candidates per target peer and send them as a single
+        ice_candidates batch once the coalescing window closes, the buffer is
+        full, or the client signals the end of candidates.
+        """
+        target = data.get("target")
+        if target is None:
+            return {"message": f"{action} must name a target peer", "status": "error"}
+        target = str(target)
+        if peer_registry.lookup(self.session_id, target) is None:
+            return {"message": f"Unknown peer {target}", "status": "error"}
+
+        # A null/empty candidate is the WebRTC end-of-candidates marker
+        candidate = {key: value for key, value in data.items() if key not in ("action", "target")}
+        if action == "end_of_candidates" or not candidate.get("candidate"):
+            await self.flush_ice_candidates(target, end=True)
+            return {"message": "end_of_candidates relayed", "status": "success"}
+
+        buffer = self.ice_buffers.setdefault(target, [])
+        buffer.append(candidate)
+        if len(buffer) >= getattr(settings, 'LMS_ICE_COALESCE_MAX', 10):
+            await self.flush_ice_candidates(target)
+        elif target not in self.ice_flush_tasks:
+            self.ice_flush_tasks[target] = asyncio.ensure_future(self.flush_ice_candidates_later(target))
+        return {"message": f"{action} queued", "status": "success"}
+
+    async def flush_ice_candidates_later(self, target):
+        await asyncio.sleep(getattr(settings, 'LMS_ICE_COALESCE_WINDOW', 0.03))
+        self.ice_flush_tasks.pop(target, None)
+        await self.flush_ice_candidates(target)
+
+    async def flush_ice_candidates(self, target, end=False):
+        task = self.ice_flush_tasks.pop(target, None)
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+
+        candidates = self.ice_buffers.pop(target, [])
+        channel = peer_registry.lookup(self.session_id, target)
+        if channel is None or (not candidates and not end):
+            return
+
+        await self.channel_layer.send(
+            channel,
             {
                 "type": "webrtc_signal",
-                "action": action,
-                **data  # Unpack the offer/answer/candidate data
+                "text": encode_frame({
+                    "action": "ice_candidates",
+                    "from": self.peer_id,
+                    "candidates": candidates,
+                    "end": end,
+                }),
             }
         )
 
-        return {"message": f"{action} relayed", "status": "success"}
-
     async def webrtc_signal(self, event):
         """
         Relay WebRTC signaling data to the connected client.
         This handles offer, answer, and ICE candidates.
         """
-        logger.info(f"Relaying WebRTC signal: {event}")
+        # The sender already encoded the frame
+        await self.send_frame(event["text"])
 
-        # Send the WebRTC signaling message to the client
-        await self.send(text_data=json.dumps({
-            "action": event["action"],
-            **event  # Send the relayed offer/answer/candidate
-        }))
+    async def session_notification(self, event):
+        """
+        Notification sent by Session.notify_students() when a session starts.
+        """
+        await self.send_frame(event["text"])
 
-    async def session_control(self, event):
+    async def peer_joined(self, event):
         """
-        Send session control updates to the client (e.g., session started, paused, or stopped).
+        Register a peer announced to the session group, tell our client about
+        it, and introduce ourselves so the newcomer's worker learns about us.
+        An anonymous newcomer whose id is held by a socket on another worker
+        is not registered; the holder turns it away.
         """
-        await self.send(text_data=json.dumps({
-            "message": event["message"],
-            "status": event["status"],
-        }))
+        holder = peer_registry.lookup(self.session_id, event["peer_id"])
+        if event.get("anonymous") and holder not in (None, event["channel"]):
+            if event["peer_id"] == self.peer_id:
+                await self.channel_layer.send(event["channel"], {"type": "peer_rejected"})
+            return
+        peer_registry.register(self.session_id, event["peer_id"], event["channel"])
+        if event["channel"] == self.channel_name:
+            return
+
+        await self.send_frame(event["text"])
+        await self.channel_layer.send(
+            event["channel"],
+            {
+                "type": "peer_introduced",
+                "peer_id": self.peer_id,
+                "channel": self.channel_name,
+                "watching": self.viewport_interval is not None,
+            }
+        )
 
-    @sync_to_async
-    def get_session(self):
+    async def peer_rejected(self, event):
         """
-        Retrieve the session from the database.
+        Our anonymous id was already taken by a socket on another worker.
         """
-        return Session.objects.get(id=self.session_id)
+        logger.info(f"Rejected peer id {self.peer_id} already in use in session {self.session_id}")
+        await self.close(code=4409)
 
-    @sync_to_async
-    def update_session(self, session):
+    async def peer_introduced(self, event):
         """
-        Save updates to the session in the database.
+        An existing peer answered our announcement.
+        """
+        known = peer_registry.lookup(self.session_id, event["peer_id"]) == event["channel"]
+        peer_registry.register(self.session_id, event["peer_id"], event["channel"])
+        if event.get("watching"):
+            self.viewport_viewers.add(event["channel"])
+        if not known:
+            # Connected to another worker, so it was missing from our initial peer list
+            await self.send_frame(encode_frame({"action": "peer_joined", "peer_id": event["peer_id"]}))
+
+    async def presence_delta(self, event):
+        """
+        A peer joined or left the session; sent to the session's teachers only.
+        """
+        await self.send_frame(event["text"])
+
+    async def peer_left(self, event):
+        # A socket turned away for a taken id leaves the holder in place
+        holder = peer_registry.lookup(self.session_id, event["peer_id"])
+        peer_registry.unregister(self.session_id, event["peer_id"], event["channel"])
+        self.viewport_viewers.discard(event["channel"])
+        if holder in (None, event["channel"]) and event["channel"] != self.channel_name:
+            await self.send_frame(event["text"])
+
+    async def session_control(self, event):
+        """
+        Send session control updates to the client (e.g., session started, paused, or stopped).
         """
-        session.save()
+        session_states.observe(self.session_id, event["state"])
+        await self.send_frame(event["text"])
@@ -1,16 +1,167 @@
 # dpvr_control.py
+#
+# Sends playback commands to DPVR headsets. A backend does the talking to one
+# device: ``await backend.send(device_id, action, payload)`` returns the
+# device's acknowledgement (a dict) or raises DeviceError. DPVRController fans
+# a command out to many devices at once, with a timeout per attempt, a bound on
+# the number of commands in flight, and retries with jittered backoff.
+#
+# SimulatedBackend stands in for the DPVR SDK in tests and benchmarks. There is
+# no default backend: until LMS_DPVR_BACKEND names one, commands are refused.
+import asyncio
+import random
+import time
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+ACTIONS = ('start', 'pause', 'stop')
+
+
+class DeviceError(Exception):
+    """
+    A device refused or failed a command. Retried unless ``retryable`` is False.
+    """
+
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class SimulatedBackend:
+    """
+    In-process fake headsets. Each command takes a random latency in
+    ``latency`` (seconds); with ``failure_rate`` the device answers with an
+    error and with ``drop_rate`` it never answers. ``offline`` devices always fail.
+    """
+
+    def __init__(self, latency=(0.005, 0.03), failure_rate=0.0, drop_rate=0.0, offline=(), seed=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.drop_rate = drop_rate
+        self.offline = set(offline)
+        self.random = random.Random(seed)
+        self.received = []  # (device id, action) of every delivered command
+
+    async def send(self, device_id, action, payload):
+        if device_id in self.offline:
+            raise DeviceError('Device is offline', retryable=False)
+        await asyncio.sleep(self.random.uniform(*self.latency))
+        roll = self.random.random()
+        if roll < self.drop_rate:
+            await asyncio.Event().wait()  # Never answers; the caller's timeout fires
+        if roll < self.drop_rate + self.failure_rate:
+            raise DeviceError('Device busy')
+        self.received.append((device_id, action))
+        return {'device': device_id, 'action': action, 'state': action}
+
+
 class DPVRController:
-    def __init__(self):
-        # Initialize DPVR SDK session
-        pass
-
-    def control_devices(self, action):
-        if action == "start":
-            # Code to activate content display on VR devices
-            pass
-        elif action == "pause":
-            # Code to pause content on VR devices
-            pass
-        elif action == "stop":
-            # Code to stop content on VR devices
-            pass
+    """
+    Arguments left out are read from the LMS_DPVR_* settings on each dispatch;
+    the backend defaults to an instance of LMS_DPVR_BACKEND, or None when that is unset.
+    """
+
+    def __init__(self, backend=None, concurrency=None, timeout=None, retries=None, backoff=None):
+        self._backend = backend
+        self._concurrency = concurrency
+        self._timeout = timeout
+        self._retries = retries
+        self._backoff = backoff
+        self._loaded = None  # (LMS_DPVR_BACKEND, instance of it)
+
+    @property
+    def backend(self):
+        if self._backend is not None:
+            return self._backend
+        path = getattr(settings, 'LMS_DPVR_BACKEND', None)
+        if not path:
+            return None
+        if self._loaded is None or self._loaded[0] != path:
+            self._loaded = (path, import_string(path)())
+        return self._loaded[1]
+
+    @backend.setter
+    def backend(self, backend):
+        self._backend = backend
+
+    @property
+    def concurrency(self):
+        return self._concurrency or getattr(settings, 'LMS_DPVR_CONCURRENCY', 32)
+
+    @property
+    def timeout(self):
+        return self._timeout or getattr(settings, 'LMS_DPVR_TIMEOUT', 2.0)
+
+    @property
+    def retries(self):
+        return self._retries if self._retries is not None else getattr(settings, 'LMS_DPVR_RETRIES', 2)
+
+    @property
+    def backoff(self):
+        return self._backoff if self._backoff is not None else getattr(settings, 'LMS_DPVR_BACKOFF', 0.1)
+
+    async def dispatch(self, device_ids, action, payload=None):
+        """
+        Send a command to every device concurrently and collect one result per
+        device: ``{"device", "status": "ok"|"timeout"|"error", "attempts",
+        "latency_ms", "ack"|"error"}``, in the order of ``device_ids``.
+        """
+        if action not in ACTIONS:
+            raise ValueError(f"Unknown device action {action!r}")
+        if self.backend is None:
+            raise ImproperlyConfigured("No DPVR backend configured (LMS_DPVR_BACKEND)")
+        semaphore = asyncio.Semaphore(self.concurrency)
+        start = time.perf_counter()
+        results = await asyncio.gather(*(
+            self._send(semaphore, device_id, action, payload or {}) for device_id in device_ids
+        ))
+        return {
+            'action': action,
+            'acknowledged': sum(result['status'] == 'ok' for result in results),
+            'failed': sum(result['status'] != 'ok' for result in results),
+            'elapsed_ms': round((time.perf_counter() - start) * 1000, 1),
+            'results': results,
+        }
+
+    async def _send(self, semaphore, device_id, action, payload):
+        start = time.perf_counter()
+        attempt = 0
+        while True:
+            attempt += 1
+            # The slot is released while backing off, so waits don't hold up other devices
+            async with semaphore:
+                try:
+                    ack = await asyncio.wait_for(self.backend.send(device_id, action, payload), self.timeout)
+                    result = {'status': 'ok', 'ack': ack}
+                    retryable = False
+                except asyncio.TimeoutError:
+                    result = {'status': 'timeout', 'error': f'No acknowledgement within {self.timeout}s'}
+                    retryable = True
+                except DeviceError as exc:
+                    result = {'status': 'error', 'error': str(exc)}
+                    retryable = exc.retryable
+                except Exception as exc:
+                    # A backend bug or a dropped connection fails this device, not the whole dispatch;
+                    # only network errors are worth another attempt
+                    result = {'status': 'error', 'error': f'{type(exc).__name__}: {exc}'}
+                    retryable = isinstance(exc, OSError)
+            if not retryable or attempt > self.retries:
+                break
+            # Full jitter, so devices that failed together don't retry together
+            await asyncio.sleep(random.uniform(0, self.backoff * 2 ** (attempt - 1)))
+
+        return {
+            'device': device_id,
+            'attempts': attempt,
+            'latency_ms': round((time.perf_counter() - start) * 1000, 1),
+            **result,
+        }
+
+    def control_devices(self, action, device_ids):
+        # Synchronous entry point for code outside the event loop
+        return async_to_sync(self.dispatch)(device_ids, action)
+
+
+dpvr_controller = DPVRController()
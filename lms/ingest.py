@@ -0,0 +1,155 @@
+import logging
+import threading
+import time
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import InteractionEvent
+
+logger = logging.getLogger(__name__)
+
+
+class EventBuffer:
+    """
+    Bounded in-process buffer for InteractionEvent rows. Producers (the
+    WebSocket "events" action and the REST batch endpoint) only append under a
+    lock; rows are written with bulk_create once LMS_EVENT_FLUSH_SIZE are
+    pending or LMS_EVENT_FLUSH_INTERVAL seconds have passed, on a background
+    thread so the event loop never waits on the database.
+
+    When pending plus in-flight rows would exceed LMS_EVENT_BUFFER_SIZE, add()
+    refuses the whole batch and returns a retry-after hint in seconds.
+    """
+
+    def __init__(self, autoflush=True):
+        self.autoflush = autoflush
+        self._pending = []
+        self._in_flight = 0
+        self._first_pending_at = None
+        self._timer = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self.stats = {'accepted': 0, 'rejected': 0, 'written': 0, 'flushes': 0}
+
+    @property
+    def max_size(self):
+        return getattr(settings, 'LMS_EVENT_BUFFER_SIZE', 20000)
+
+    @property
+    def flush_size(self):
+        return getattr(settings, 'LMS_EVENT_FLUSH_SIZE', 1000)
+
+    @property
+    def flush_interval(self):
+        return getattr(settings, 'LMS_EVENT_FLUSH_INTERVAL', 1.0)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, events):
+        """
+        Queue unsaved InteractionEvent instances. Returns None when accepted,
+        or the number of seconds the producer should wait before retrying.
+        """
+        with self._lock:
+            if len(self._pending) + self._in_flight + len(events) > self.max_size:
+                self.stats['rejected'] += len(events)
+                return self.flush_interval
+            if not self._pending:
+                self._first_pending_at = time.monotonic()
+            self._pending.extend(events)
+            self.stats['accepted'] += len(events)
+            due = len(self._pending) >= self.flush_size
+
+        if self.autoflush:
+            self._schedule(0 if due else self.flush_interval)
+        return None
+
+    def should_flush(self):
+        with self._lock:
+            if not self._pending:
+                return False
+            return (len(self._pending) >= self.flush_size
+                    or time.monotonic() - self._first_pending_at >= self.flush_interval)
+
+    def flush(self):
+        """
+        Write everything pending in bulk. Returns the number of rows written.
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+                self._in_flight = len(batch)
+                self._first_pending_at = None
+            if not batch:
+                return 0
+            try:
+                InteractionEvent.objects.bulk_create(batch, batch_size=500)
+            except DatabaseError:
+                logger.exception(f"Dropped {len(batch)} interaction events that could not be written")
+                return 0
+            finally:
+                with self._lock:
+                    self._in_flight = 0
+            self.stats['written'] += len(batch)
+            self.stats['flushes'] += 1
+            return len(batch)
+
+    def _schedule(self, delay):
+        with self._lock:
+            timer = self._timer
+            if timer is not None and timer.is_alive():
+                if delay > 0:
+                    return
+                # Size threshold reached: replace the interval timer with an immediate flush
+                timer.cancel()
+            self._timer = threading.Timer(delay, self._timed_flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _timed_flush(self):
+        with self._lock:
+            if self._timer is threading.current_thread():
+                self._timer = None
+        try:
+            self.flush()
+        finally:
+            # The timer thread owns its own connection
+            close_old_connections()
+        if self._pending:
+            self._schedule(self.flush_interval)
+
+
+def build_events(raw_events, session_id, school_id, student_id):
+    """
+    Validate raw event dicts ({"kind", "occurred_at"?, "data"?}) into unsaved
+    InteractionEvent instances. Raises ValueError on malformed input.
+    """
+    if not isinstance(raw_events, list):
+        raise ValueError("events must be a list")
+
+    received_at = timezone.now()
+    events = []
+    for raw in raw_events:
+        if not isinstance(raw, dict) or not isinstance(raw.get('kind'), str) or not raw['kind']:
+            raise ValueError("each event needs a kind")
+        if len(raw['kind']) > 20:
+            raise ValueError("event kind longer than 20 characters")
+        occurred_at = raw.get('occurred_at')
+        if occurred_at is not None:
+            if not isinstance(occurred_at, str) or parse_datetime(occurred_at) is None:
+                raise ValueError("occurred_at must be an ISO 8601 datetime")
+            occurred_at = parse_datetime(occurred_at)
+        events.append(InteractionEvent(
+            school_id=school_id,
+            session_id=session_id,
+            student_id=student_id,
+            kind=raw['kind'],
+            data=raw.get('data'),
+            occurred_at=occurred_at or received_at,
+        ))
+    return events
+
+
+event_buffer = EventBuffer()
@@ -0,0 +1,330 @@
+import asyncio
+import logging
+import random
+import string
+import struct
+import time
+
+import msgpack
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+logger = logging.getLogger(__name__)
+
+# Every frame on the broker socket is a 4-byte big-endian length followed by a msgpack list
+FRAME_HEADER = struct.Struct('!I')
+
+
+async def read_frame(reader):
+    header = await reader.readexactly(FRAME_HEADER.size)
+    (length,) = FRAME_HEADER.unpack(header)
+    return msgpack.unpackb(await reader.readexactly(length), raw=False)
+
+
+def pack_frame(*items):
+    body = msgpack.packb(list(items), use_bin_type=True)
+    return FRAME_HEADER.pack(len(body)) + body
+
+
+def channel_owner(channel):
+    # Process-specific channels are "<client prefix>!<local id>"; the prefix routes them
+    return channel.split('!', 1)[0] if '!' in channel else None
+
+
+class LayerBroker:
+    """
+    Local message broker for UnixSocketChannelLayer. It keeps group membership
+    and routes messages to the worker process that owns each channel. Message
+    bodies stay msgpack-encoded end to end, so a group_send is packed once by
+    the sender and forwarded as one batched frame per worker process.
+    """
+
+    def __init__(self, path, group_expiry=86400, buffer_limit=4 * 1024 * 1024):
+        self.path = path
+        self.group_expiry = group_expiry
+        # Bytes queued for one worker beyond which messages to it are dropped: a worker that
+        # stopped reading must not grow the broker's memory without bound
+        self.buffer_limit = buffer_limit
+        self.listeners = {}  # client prefix -> StreamWriter
+        self.clients = set()  # handler tasks of every open worker connection
+        self.groups = {}  # group -> {channel: added_at}
+        self.dropped = 0
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_unix_server(self.handle_client, path=self.path)
+        logger.info(f"Channel layer broker listening on {self.path}")
+        return self.server
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        for task in list(self.clients):
+            task.cancel()
+        await asyncio.gather(*self.clients, return_exceptions=True)
+
+    async def handle_client(self, reader, writer):
+        prefix = None
+        task = asyncio.current_task()
+        self.clients.add(task)
+        try:
+            while True:
+                frame = await read_frame(reader)
+                op = frame[0]
+                if op == 'send':
+                    self.route(frame[1], [frame[1]], frame[2])
+                elif op == 'group_send':
+                    self.fan_out(frame[1], frame[2])
+                elif op == 'group_add':
+                    self.groups.setdefault(frame[1], {})[frame[2]] = time.time()
+                elif op == 'group_discard':
+                    members = self.groups.get(frame[1])
+                    if members is not None:
+                        members.pop(frame[2], None)
+                        if not members:
+                            del self.groups[frame[1]]
+                elif op == 'listen':
+                    prefix = frame[1]
+                    self.listeners[prefix] = writer
+                elif op == 'flush':
+                    self.groups.clear()
+                else:
+                    logger.warning(f"Broker received unknown operation {op!r}")
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.clients.discard(task)
+            if prefix is not None and self.listeners.get(prefix) is writer:
+                # The worker went away: forget it and every group membership it held
+                del self.listeners[prefix]
+                self.drop_owner(prefix)
+            writer.close()
+
+    def route(self, owner_channel, channels, body):
+        self.forward(channel_owner(owner_channel), channels, body)
+
+    def forward(self, owner, channels, body):
+        writer = self.listeners.get(owner)
+        if writer is None:
+            return
+        if writer.transport.get_write_buffer_size() > self.buffer_limit:
+            # Channel layers deliver at most once; a full client loses messages like a full channel
+            self.dropped += 1
+            logger.warning(f"Dropped message for {owner}: {writer.transport.get_write_buffer_size()} bytes unsent")
+            return
+        writer.write(pack_frame('deliver', channels, body))
+
+    def fan_out(self, group, body):
+        members = self.groups.get(group)
+        if not members:
+            return
+
+        # Prune expired memberships, then batch the remaining channels per owning process
+        cutoff = time.time() - self.group_expiry
+        batches = {}
+        for channel, added_at in list(members.items()):
+            if added_at < cutoff:
+                del members[channel]
+                continue
+            batches.setdefault(channel_owner(channel), []).append(channel)
+
+        for owner, channels in batches.items():
+            self.forward(owner, channels, body)
+
+    def drop_owner(self, prefix):
+        for group in list(self.groups):
+            members = self.groups[group]
+            for channel in [c for c in members if channel_owner(c) == prefix]:
+                del members[channel]
+            if not members:
+                del self.groups[group]
+
+
+class BrokerConnection:
+    # One connection per event loop, like channels_redis does for its pools
+    def __init__(self, layer, loop, reader, writer):
+        self.layer = layer
+        self.loop = loop
+        self.reader = reader
+        self.writer = writer
+        self.listening = False
+        self.reader_task = None
+
+    async def write(self, *items):
+        self.writer.write(pack_frame(*items))
+        await self.writer.drain()
+
+    async def listen(self):
+        # Ask the broker to route this process's channels over this connection
+        if not self.listening:
+            self.listening = True
+            self.reader_task = asyncio.ensure_future(self.read_loop())
+            await self.write('listen', self.layer.client_prefix)
+
+    async def read_loop(self):
+        try:
+            while True:
+                frame = await read_frame(self.reader)
+                if frame[0] == 'deliver':
+                    self.layer.deliver(frame[1], msgpack.unpackb(frame[2], raw=False))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            logger.warning("Lost connection to the channel layer broker")
+            # The next operation on this loop reconnects; receivers already waiting need
+            # the listen and group memberships sent again, which nothing else would do
+            if self.layer.connections.get(self.loop) is self:
+                del self.layer.connections[self.loop]
+                self.layer.reconnect_task = asyncio.ensure_future(self.layer.reconnect())
+
+    def close(self):
+        if self.loop.is_closed():
+            # Nothing can run on a closed loop any more; release the socket directly
+            sock = self.writer.get_extra_info('socket')
+            if sock is not None:
+                sock.close()
+            return
+        if self.reader_task is not None:
+            self.reader_task.cancel()
+        self.writer.close()
+
+
+class UnixSocketChannelLayer(BaseChannelLayer):
+    """
+    Channel layer for several ASGI worker processes on one host. Workers talk to
+    a LayerBroker (``manage.py runbroker``) over a Unix domain socket; messages
+    for channels owned by the current process never leave it.
+
+    Only process-specific channels (from new_channel(), as used by consumers)
+    can be received from.
+    """
+
+    extensions = ['groups', 'flush']
+
+    def __init__(self, path, expiry=60, group_expiry=86400, capacity=100, channel_capacity=None):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity)
+        self.path = path
+        self.group_expiry = group_expiry  # Enforced by the broker; read by runbroker from the same CONFIG
+        self.client_prefix = 'specific.' + ''.join(random.choices(string.ascii_letters, k=12))
+        self.channels = {}  # local channel -> asyncio.Queue of (expires_at, message)
+        self.connections = {}  # event loop -> BrokerConnection
+        self.memberships = {}  # group -> local channels in it, re-sent after a reconnect
+        self.reconnect_task = None
+
+    async def connection(self):
+        loop = asyncio.get_running_loop()
+        # Connections opened by short-lived loops (async_to_sync) are dropped once their loop is gone
+        for stale in [other for other in self.connections if other.is_closed()]:
+            self.connections.pop(stale).close()
+
+        conn = self.connections.get(loop)
+        if conn is None:
+            reader, writer = await asyncio.open_unix_connection(self.path)
+            conn = self.connections[loop] = BrokerConnection(self, loop, reader, writer)
+        return conn
+
+    async def reconnect(self, delay=0.1, max_delay=5.0):
+        while True:
+            try:
+                conn = await self.connection()
+                await conn.listen()
+                for group, channels in list(self.memberships.items()):
+                    for channel in list(channels):
+                        await conn.write('group_add', group, channel)
+                logger.info(f"Reconnected to the channel layer broker, {len(self.memberships)} group(s) restored")
+                return
+            except (ConnectionError, OSError):
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, max_delay)
+
+    def is_local(self, channel):
+        return channel.startswith(self.client_prefix + '!')
+
+    def queue(self, channel):
+        queue = self.channels.get(channel)
+        if queue is None:
+            queue = self.channels[channel] = asyncio.Queue(maxsize=self.get_capacity(channel))
+        return queue
+
+    def deliver(self, channels, message, strict=False):
+        # Batched fan-out from the broker: one decoded message, copied per local channel
+        expires_at = time.time() + self.expiry
+        for channel in channels:
+            try:
+                self.queue(channel).put_nowait((expires_at, dict(message)))
+            except asyncio.QueueFull:
+                if strict:
+                    raise ChannelFull(channel)
+                logger.debug(f"Dropped message for full channel {channel}")
+
+    # Channel layer API
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), "message is not a dict"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        assert "__asgi_channel__" not in message
+
+        if self.is_local(channel):
+            self.deliver([channel], message, strict=True)
+            return
+        conn = await self.connection()
+        await conn.write('send', channel, msgpack.packb(message, use_bin_type=True))
+
+    async def receive(self, channel):
+        assert self.valid_channel_name(channel)
+        if not self.is_local(channel):
+            raise ValueError(f"{self.__class__.__name__} can only receive on channels from new_channel()")
+
+        conn = await self.connection()
+        await conn.listen()
+        queue = self.queue(channel)
+        while True:
+            expires_at, message = await queue.get()
+            if expires_at >= time.time():
+                return message
+
+    async def new_channel(self, prefix='specific.'):
+        return f"{self.client_prefix}!{''.join(random.choices(string.ascii_letters, k=12))}"
+
+    async def flush(self):
+        self.channels = {}
+        self.memberships = {}
+        conn = await self.connection()
+        await conn.write('flush')
+
+    async def close(self):
+        if self.reconnect_task is not None:
+            self.reconnect_task.cancel()
+            self.reconnect_task = None
+        for conn in self.connections.values():
+            conn.close()
+        self.connections = {}
+
+    # Groups extension
+
+    async def group_add(self, group, channel):
+        assert self.valid_group_name(group), "Group name not valid"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        conn = await self.connection()
+        if self.is_local(channel):
+            # Make sure the broker routes our channels here before the first fan-out
+            await conn.listen()
+            self.memberships.setdefault(group, set()).add(channel)
+        await conn.write('group_add', group, channel)
+
+    async def group_discard(self, group, channel):
+        assert self.valid_group_name(group), "Group name not valid"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        channels = self.memberships.get(group)
+        if channels is not None:
+            channels.discard(channel)
+            if not channels:
+                del self.memberships[group]
+        conn = await self.connection()
+        await conn.write('group_discard', group, channel)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "Message is not a dict"
+        assert self.valid_group_name(group), "Group name not valid"
+        # Packed once here; the broker forwards the bytes untouched
+        conn = await self.connection()
+        await conn.write('group_send', group, msgpack.packb(message, use_bin_type=True))
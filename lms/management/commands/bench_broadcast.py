@@ -0,0 +1,65 @@
+import asyncio
+import json
+import time
+from channels.layers import InMemoryChannelLayer
+from django.core.management.base import BaseCommand
+from lms.protocol import encode_frame
+
+
+def control_payload(n):
+    return {"action": "session_control", "message": "Session has started", "status": "started", "seq": n}
+
+
+async def broadcast(layer, channels, broadcasts, encode_once):
+    """
+    Push broadcasts through the channel layer to every member and build the
+    socket frame the way the handler would. Returns CPU seconds per broadcast.
+    """
+    sent = []
+    start = time.process_time()
+    for n in range(broadcasts):
+        if encode_once:
+            # Sender serializes once; handlers forward event["text"]
+            await layer.group_send('bench', {"type": "session_control", "text": encode_frame(control_payload(n))})
+            for channel in channels:
+                sent.append((await layer.receive(channel))["text"])
+        else:
+            # Previous behaviour: every recipient json.dumps the event fields
+            await layer.group_send('bench', {"type": "session_control", **control_payload(n)})
+            for channel in channels:
+                event = await layer.receive(channel)
+                sent.append(json.dumps({key: value for key, value in event.items() if key != "type"}))
+        sent.clear()
+    return (time.process_time() - start) / broadcasts
+
+
+class Command(BaseCommand):
+    help = "Measure CPU per group broadcast against group size, per-recipient json.dumps vs encode-once."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1,10,30,60,120')
+        parser.add_argument('--broadcasts', type=int, default=300)
+        parser.add_argument('--json', action='store_true')
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        results = asyncio.run(self.run(sizes, options['broadcasts']))
+        if options['json']:
+            self.stdout.write(json.dumps(results))
+            return
+        self.stdout.write(f"{'group':>6} {'per-recipient us':>18} {'encode-once us':>16}")
+        for row in results:
+            self.stdout.write(f"{row['group_size']:>6} {row['per_recipient_us']:>18} {row['encode_once_us']:>16}")
+
+    async def run(self, sizes, broadcasts):
+        results = []
+        for size in sizes:
+            row = {'group_size': size}
+            for key, encode_once in (('per_recipient_us', False), ('encode_once_us', True)):
+                layer = InMemoryChannelLayer()
+                channels = [await layer.new_channel() for _ in range(size)]
+                for channel in channels:
+                    await layer.group_add('bench', channel)
+                row[key] = round(await broadcast(layer, channels, broadcasts, encode_once) * 1e6, 1)
+            results.append(row)
+        return results
@@ -0,0 +1,69 @@
+import asyncio
+import json
+import os
+import tempfile
+import time
+from channels.layers import InMemoryChannelLayer
+from django.core.management.base import BaseCommand
+from lms.layers import LayerBroker, UnixSocketChannelLayer
+
+
+async def bench_layer(layer, messages, group_size):
+    results = {}
+
+    # Point-to-point: send + receive on a single channel
+    channel = await layer.new_channel()
+    start = time.perf_counter()
+    for i in range(messages):
+        await layer.send(channel, {'type': 'bench', 'n': i})
+        await layer.receive(channel)
+    results['send_receive_per_sec'] = round(messages / (time.perf_counter() - start))
+
+    # Group fan-out: every broadcast is received by group_size channels
+    members = [await layer.new_channel() for _ in range(group_size)]
+    for member in members:
+        await layer.group_add('bench', member)
+    broadcasts = max(1, messages // group_size)
+    start = time.perf_counter()
+    for i in range(broadcasts):
+        await layer.group_send('bench', {'type': 'bench', 'n': i})
+        for member in members:
+            await layer.receive(member)
+    elapsed = time.perf_counter() - start
+    results['group_send_per_sec'] = round(broadcasts / elapsed)
+    results['deliveries_per_sec'] = round(broadcasts * group_size / elapsed)
+    return results
+
+
+class Command(BaseCommand):
+    help = "Compare InMemoryChannelLayer with UnixSocketChannelLayer (broker run in-process)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=5000)
+        parser.add_argument('--group-size', type=int, default=30)
+        parser.add_argument('--json', action='store_true', help="Print machine-readable results.")
+
+    def handle(self, *args, **options):
+        results = asyncio.run(self.run(options['messages'], options['group_size']))
+        if options['json']:
+            self.stdout.write(json.dumps(results))
+            return
+        for name, metrics in results.items():
+            self.stdout.write(name)
+            for metric, value in metrics.items():
+                self.stdout.write(f"  {metric:<24} {value}")
+
+    async def run(self, messages, group_size):
+        results = {'in_memory': await bench_layer(InMemoryChannelLayer(capacity=group_size + 1), messages, group_size)}
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'broker.sock')
+            broker = LayerBroker(path)
+            await broker.start()
+            layer = UnixSocketChannelLayer(path, capacity=group_size + 1)
+            try:
+                results['unix_socket'] = await bench_layer(layer, messages, group_size)
+            finally:
+                await layer.close()
+                await broker.close()
+        return results
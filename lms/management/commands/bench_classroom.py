@@ -0,0 +1,259 @@
+import asyncio
+import json
+import statistics
+import time
+import tracemalloc
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand
+from lms import outbound
+from lms.models import School, Session, User
+from lms.routing import websocket_urlpatterns
+from lms.session_state import session_states
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def summarize(latencies, messages, seconds):
+    return {
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 3) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 3) if latencies else None,
+        'messages': messages,
+        'messages_per_sec': round(messages / seconds) if seconds else None,
+    }
+
+
+class Client:
+    """
+    One simulated device on the session socket. A reader task drains every
+    frame as it arrives and records what the benchmark waits for.
+    """
+
+    def __init__(self, application, session_id, peer, user=None):
+        self.peer = peer
+        self.communicator = WebsocketCommunicator(application, f'/ws/session/{session_id}/?peer={peer}')
+        if user is not None:
+            self.communicator.scope['user'] = user  # Authenticated peers are addressed by user id
+        self.received = 0
+        self.peers_joined = 0
+        self.control_arrivals = []  # perf_counter() at the arrival of each control broadcast
+        self.late = 0  # control frames that arrived after their execute_at
+        self.signal_latencies = []  # seconds from the sender's timestamp to arrival
+        self.signals = 0
+        self.viewport_frames = 0
+        self.viewport_samples = 0  # Student entries across viewport frames
+        self.changed = asyncio.Event()
+        self.reader = None
+
+    async def connect(self):
+        connected, _ = await self.communicator.connect()
+        if not connected:
+            raise RuntimeError(f"{self.peer} could not connect")
+        self.reader = asyncio.ensure_future(self.read())
+
+    async def read(self):
+        while True:
+            frame = json.loads(await self.communicator.receive_from(timeout=3600))
+            now = time.perf_counter()
+            self.received += 1
+            action = frame.get('action')
+            if action == 'peer_joined':
+                self.peers_joined += 1
+            elif action == 'session_control':
+                self.control_arrivals.append(now)
+                self.late += time.time() * 1000 > frame['execute_at']
+            elif action in ('offer', 'answer'):
+                self.signal_latencies.append(now - frame['sent'])
+                self.signals += 1
+            elif action == 'viewport':
+                self.viewport_frames += 1
+                self.viewport_samples += len(frame['students'])
+            elif action == 'ice_candidates':
+                self.signal_latencies.extend(now - candidate['sent'] for candidate in frame['candidates'])
+                self.signals += len(frame['candidates'])
+            self.changed.set()
+
+    async def send(self, message):
+        await self.communicator.send_to(text_data=json.dumps(message))
+
+    async def close(self):
+        if self.reader is not None:
+            self.reader.cancel()
+            await asyncio.gather(self.reader, return_exceptions=True)
+        await self.communicator.disconnect()
+
+
+async def wait_for(clients, condition, timeout):
+    # Wait until condition(client) holds for every client
+    deadline = time.perf_counter() + timeout
+    for client in clients:
+        while not condition(client):
+            client.changed.clear()
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                raise TimeoutError(f"{client.peer} did not receive the expected frames in {timeout}s")
+            try:
+                await asyncio.wait_for(client.changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+
+class Command(BaseCommand):
+    help = ("Simulate a classroom on the session WebSocket: a teacher and N headsets. Measures connection "
+            "memory, start/pause/stop fan-out latency and a WebRTC signaling storm.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--headsets', type=int, default=30)
+        parser.add_argument('--rounds', type=int, default=20, help="start/pause/stop cycles driven by the teacher.")
+        parser.add_argument('--candidates', type=int, default=8, help="ICE candidates per side and headset.")
+        parser.add_argument('--pose-hz', type=int, default=72, help="Pose samples per second and headset.")
+        parser.add_argument('--stream-seconds', type=float, default=2.0)
+        parser.add_argument('--timeout', type=float, default=30.0)
+        parser.add_argument('--json', action='store_true')
+
+    def handle(self, *args, **options):
+        school = School.objects.create(name='bench')
+        try:
+            teacher = User.objects.create(username='bench-teacher', nickname='bench-teacher', pin='0000', school=school)
+            session = Session.objects.create(title='bench', teacher=teacher, school=school)
+            results = asyncio.run(self.run(session.pk, teacher, options))
+        finally:
+            session_states.clear()
+            school.delete()
+
+        if options['json']:
+            self.stdout.write(json.dumps(results))
+            return
+        self.stdout.write(f"{results['headsets']} headsets + teacher over {results['channel_layer']}")
+        self.stdout.write(f"  connect: {results['connect']['seconds']}s, "
+                          f"{results['connect']['memory_per_connection_kb']} KiB per connection")
+        for phase in ('control', 'signaling'):
+            row = results[phase]
+            self.stdout.write(f"  {phase:<9}: p50 {row['p50_ms']} ms, p99 {row['p99_ms']} ms, "
+                              f"{row['messages']} frames, {row['messages_per_sec']} frames/s")
+        self.stdout.write(f"  {results['control']['late']} control frames arrived after their execute_at")
+        viewport = results['viewport']
+        self.stdout.write(f"  viewport : {viewport['pose_samples']} pose samples -> {viewport['teacher_frames']} frames "
+                          f"to the teacher ({viewport['teacher_frames_per_sec']}/s, "
+                          f"{viewport['students_per_frame']} students per frame)")
+        self.stdout.write(f"  send queues: {results['send_queues']}")
+
+    async def run(self, session_id, teacher_user, options):
+        application = URLRouter(websocket_urlpatterns)
+        headset_count, timeout = options['headsets'], options['timeout']
+
+        # Connect everyone, measuring what the connections keep alive
+        tracemalloc.start()
+        baseline = tracemalloc.take_snapshot()
+        start = time.perf_counter()
+        teacher = Client(application, session_id, str(teacher_user.pk), user=teacher_user)
+        await teacher.connect()
+        headsets = [Client(application, session_id, f'headset{i}') for i in range(headset_count)]
+        for headset in headsets:
+            await headset.connect()
+        await wait_for([teacher], lambda client: client.peers_joined >= headset_count, timeout)
+        connect_seconds = time.perf_counter() - start
+        grown = sum(stat.size_diff for stat in tracemalloc.take_snapshot().compare_to(baseline, 'filename'))
+        tracemalloc.stop()
+
+        clients = [teacher, *headsets]
+        results = {
+            'headsets': headset_count,
+            'channel_layer': type(get_channel_layer()).__name__,
+            'connect': {
+                'seconds': round(connect_seconds, 3),
+                'memory_per_connection_kb': round(grown / len(clients) / 1024, 1),
+            },
+        }
+
+        try:
+            results['control'] = await self.control_storm(session_id, teacher, headsets, options['rounds'], timeout)
+            results['signaling'] = await self.signaling_storm(teacher, headsets, options['candidates'], timeout)
+            results['viewport'] = await self.viewport_stream(teacher, headsets, options['pose_hz'], options['stream_seconds'])
+            results['send_queues'] = dict(outbound.stats)
+        finally:
+            for client in clients:
+                await client.close()
+            await session_states.flush_all()
+        return results
+
+    async def control_storm(self, session_id, teacher, headsets, rounds, timeout):
+        """
+        The teacher sends start/pause/stop; each broadcast must reach every
+        headset before the next one is sent. Latency is per delivery.
+        """
+        received_before = sum(client.received for client in headsets)
+        latencies = []
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for action in ('start', 'pause', 'stop'):
+                count = len(headsets[0].control_arrivals) + 1
+                sent = time.perf_counter()
+                await teacher.send({'action': action})
+                await wait_for(headsets, lambda client: len(client.control_arrivals) >= count, timeout)
+                latencies.extend(client.control_arrivals[count - 1] - sent for client in headsets)
+        elapsed = time.perf_counter() - start
+        return {
+            **summarize(latencies, sum(client.received for client in headsets) - received_before, elapsed),
+            'late': sum(client.late for client in headsets),
+        }
+
+    async def signaling_storm(self, teacher, headsets, candidates, timeout):
+        """
+        Every headset offers to the teacher, the teacher answers every headset,
+        and both sides trickle ICE candidates, all at once.
+        """
+        clients = [teacher, *headsets]
+        received_before = sum(client.received for client in clients)
+        signals_before = {client.peer: client.signals for client in clients}
+        start = time.perf_counter()
+
+        async def negotiate(headset):
+            await headset.send({'action': 'offer', 'target': teacher.peer, 'sdp': 'v=0', 'sent': time.perf_counter()})
+            await teacher.send({'action': 'answer', 'target': headset.peer, 'sdp': 'v=0', 'sent': time.perf_counter()})
+            for n in range(candidates):
+                candidate = {'candidate': f'candidate:{n} 1 udp 2122260223 10.0.0.{n} 5000{n} typ host'}
+                await headset.send({'action': 'ice_candidate', 'target': teacher.peer, **candidate, 'sent': time.perf_counter()})
+                await teacher.send({'action': 'ice_candidate', 'target': headset.peer, **candidate, 'sent': time.perf_counter()})
+            await headset.send({'action': 'end_of_candidates', 'target': teacher.peer, 'sent': time.perf_counter()})
+            await teacher.send({'action': 'end_of_candidates', 'target': headset.peer, 'sent': time.perf_counter()})
+
+        await asyncio.gather(*(negotiate(headset) for headset in headsets))
+        per_headset = 1 + candidates  # offer or answer, plus candidates
+        await wait_for([teacher], lambda client: client.signals - signals_before[teacher.peer] >= per_headset * len(headsets), timeout)
+        await wait_for(headsets, lambda client: client.signals - signals_before[client.peer] >= per_headset, timeout)
+        elapsed = time.perf_counter() - start
+
+        latencies = [latency for client in clients for latency in client.signal_latencies]
+        return summarize(latencies, sum(client.received for client in clients) - received_before, elapsed)
+
+    async def viewport_stream(self, teacher, headsets, pose_hz, seconds):
+        """
+        The teacher watches every viewport while the headsets report their pose
+        at frame rate; counts what reaches the teacher after downsampling.
+        """
+        await teacher.send({'action': 'viewport_subscribe'})
+        await asyncio.sleep(0.05)
+        frames_before = teacher.viewport_frames
+        samples = 0
+        start = time.perf_counter()
+        for tick in range(int(pose_hz * seconds)):
+            pose = {'action': 'pose', 't': tick, 'position': [0.0, 1.6, 0.0], 'orientation': [0.0, 0.0, 0.0, 1.0]}
+            await asyncio.gather(*(headset.send(pose) for headset in headsets))
+            samples += len(headsets)
+            await asyncio.sleep(max(0.0, start + (tick + 1) / pose_hz - time.perf_counter()))
+        await asyncio.sleep(0.3)  # Last tick
+        frames = teacher.viewport_frames - frames_before
+        return {
+            'pose_samples': samples,
+            'teacher_frames': frames,
+            'teacher_frames_per_sec': round(frames / seconds, 1),
+            'students_per_frame': round(teacher.viewport_samples / frames, 1) if frames else None,
+        }
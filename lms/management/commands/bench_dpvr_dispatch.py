@@ -0,0 +1,47 @@
+import asyncio
+import json
+from django.core.management.base import BaseCommand
+from lms.dpvr_control import DPVRController, SimulatedBackend
+
+
+class Command(BaseCommand):
+    help = ("Dispatch a command to simulated headsets, one at a time and concurrently, "
+            "with transient failures and dropped acknowledgements.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--devices', default='30,200', help="Comma-separated numbers of headsets.")
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--latency-ms', type=float, default=20.0, help="Upper bound of the simulated command latency.")
+        parser.add_argument('--failure-rate', type=float, default=0.05)
+        parser.add_argument('--drop-rate', type=float, default=0.01)
+        parser.add_argument('--timeout', type=float, default=0.25)
+        parser.add_argument('--json', action='store_true')
+
+    def handle(self, *args, **options):
+        results = []
+        for count in [int(count) for count in options['devices'].split(',')]:
+            for mode, concurrency in (('sequential', 1), ('concurrent', options['concurrency'])):
+                backend = SimulatedBackend(
+                    latency=(options['latency_ms'] / 4000, options['latency_ms'] / 1000),
+                    failure_rate=options['failure_rate'], drop_rate=options['drop_rate'], seed=count,
+                )
+                controller = DPVRController(backend, concurrency=concurrency, timeout=options['timeout'], retries=2, backoff=0.02)
+                outcome = asyncio.run(controller.dispatch([f'headset-{i}' for i in range(count)], 'start'))
+                latencies = sorted(result['latency_ms'] for result in outcome['results'])
+                results.append({
+                    'devices': count,
+                    'mode': mode,
+                    'elapsed_ms': outcome['elapsed_ms'],
+                    'acknowledged': outcome['acknowledged'],
+                    'failed': outcome['failed'],
+                    'retried': sum(result['attempts'] > 1 for result in outcome['results']),
+                    'p99_device_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+                })
+
+        if options['json']:
+            self.stdout.write(json.dumps(results))
+            return
+        self.stdout.write(f"{'devices':>7} {'mode':>10} {'elapsed ms':>10} {'acked':>6} {'failed':>6} {'retried':>7} {'p99 ms':>8}")
+        for row in results:
+            self.stdout.write(f"{row['devices']:>7} {row['mode']:>10} {row['elapsed_ms']:>10} {row['acknowledged']:>6} "
+                              f"{row['failed']:>6} {row['retried']:>7} {row['p99_device_ms']:>8}")
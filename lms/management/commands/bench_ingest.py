@@ -0,0 +1,68 @@
+import json
+import time
+from django.core.management.base import BaseCommand
+from lms.ingest import EventBuffer, build_events
+from lms.models import InteractionEvent, School, Session, User
+
+
+class Command(BaseCommand):
+    help = ("Simulate headsets streaming interaction events and compare one INSERT per event "
+            "with the buffered bulk_create path. Rows are written in autocommit mode, like "
+            "production, and deleted afterwards.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--headsets', type=int, default=30)
+        parser.add_argument('--rate', type=int, default=30, help="Events per second per headset.")
+        parser.add_argument('--seconds', type=int, default=10, help="Simulated stream duration.")
+        parser.add_argument('--batch-ms', type=int, default=100, help="How often a headset sends its events.")
+        parser.add_argument('--json', action='store_true')
+
+    def handle(self, *args, **options):
+        school = School.objects.create(name='bench')
+        try:
+            results = self.run(options, school)
+        finally:
+            # Cascades to the bench session and its events
+            school.delete()
+
+        if options['json']:
+            self.stdout.write(json.dumps(results))
+            return
+        self.stdout.write(f"{results['events']} events from {options['headsets']} headsets "
+                          f"({results['required_per_sec']} events/s needed)")
+        for mode in ('per_row', 'buffered'):
+            self.stdout.write(f"  {mode:<9} {results[mode]['events_per_sec']:>9} events/s "
+                              f"{results[mode]['seconds']:>8}s")
+
+    def run(self, options, school):
+        teacher = User.objects.create(username='bench-teacher', nickname='bench-teacher', pin='0000', school=school)
+        session = Session.objects.create(title='bench', teacher=teacher, school=school)
+
+        # Each headset sends rate * batch_ms / 1000 events per message
+        per_message = max(1, options['rate'] * options['batch_ms'] // 1000)
+        messages = options['seconds'] * 1000 // options['batch_ms'] * options['headsets']
+        raw = [{'kind': 'gaze', 'data': {'x': 0.1, 'y': 0.2}} for _ in range(per_message)]
+        total = messages * per_message
+        results = {'events': total, 'required_per_sec': options['headsets'] * options['rate']}
+
+        start = time.perf_counter()
+        for _ in range(messages):
+            for event in build_events(raw, session.pk, school.pk, teacher.pk):
+                event.save()
+        results['per_row'] = self.summary(total, time.perf_counter() - start)
+
+        buffer = EventBuffer(autoflush=False)
+        start = time.perf_counter()
+        for _ in range(messages):
+            buffer.add(build_events(raw, session.pk, school.pk, teacher.pk))
+            if buffer.should_flush():
+                buffer.flush()
+        buffer.flush()
+        results['buffered'] = self.summary(total, time.perf_counter() - start)
+        results['buffered']['flushes'] = buffer.stats['flushes']
+
+        assert InteractionEvent.objects.filter(session=session).count() == 2 * total
+        return results
+
+    def summary(self, events, seconds):
+        return {'seconds': round(seconds, 3), 'events_per_sec': round(events / seconds)}
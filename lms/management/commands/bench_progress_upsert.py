@@ -0,0 +1,71 @@
+import json
+import time
+from django.core.management.base import BaseCommand
+from lms.models import Lesson, Progress, School, Session, User
+from lms.progress import bulk_upsert_progress
+
+
+class Command(BaseCommand):
+    help = ("Compare per-row update_or_create with bulk_upsert_progress for a class finishing a quiz. "
+            "Works on throwaway rows that are deleted afterwards.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', type=int, default=30)
+        parser.add_argument('--lessons', type=int, default=10)
+        parser.add_argument('--json', action='store_true')
+
+    def handle(self, *args, **options):
+        school = School.objects.create(name='bench')
+        try:
+            results = self.run(school, options['students'], options['lessons'])
+        finally:
+            # Cascades to the bench users, session, lessons and progress
+            school.delete()
+
+        if options['json']:
+            self.stdout.write(json.dumps(results))
+            return
+        self.stdout.write(f"{results['records']} records per pass (insert pass, then update pass)")
+        for mode in ('per_row', 'bulk'):
+            self.stdout.write(f"  {mode:<8} {results[mode]['records_per_sec']:>9} records/s {results[mode]['seconds']:>8}s")
+
+    def run(self, school, students, lessons):
+        teacher = User.objects.create(username='bench-teacher', nickname='bench-teacher', pin='0000', school=school)
+        session = Session.objects.create(title='bench', teacher=teacher, school=school)
+        users = [
+            User.objects.create(username=f'bench-{i}', nickname=f'bench-{i}', pin='0000', school=school)
+            for i in range(students)
+        ]
+        lesson_rows = [
+            Lesson.objects.create(title=f'bench {i}', content='', school=school, session=session)
+            for i in range(lessons)
+        ]
+
+        def items(score):
+            return [
+                {'student': user.pk, 'lesson': lesson.pk, 'score': score, 'completed': True,
+                 'progress_data': {'cmi.core.lesson_status': 'passed'}}
+                for user in users for lesson in lesson_rows
+            ]
+
+        results = {'records': students * lessons}
+
+        start = time.perf_counter()
+        for score in (50, 80):
+            for item in items(score):
+                Progress.objects.update_or_create(
+                    student_id=item['student'], lesson_id=item['lesson'],
+                    defaults={'school': school, 'score': item['score'], 'completed': item['completed'],
+                              'progress_data': item['progress_data']},
+                )
+        results['per_row'] = self.summary(2 * results['records'], time.perf_counter() - start)
+
+        Progress.objects.filter(school=school).delete()
+        start = time.perf_counter()
+        for score in (50, 80):
+            bulk_upsert_progress(items(score), school.pk, session.pk)
+        results['bulk'] = self.summary(2 * results['records'], time.perf_counter() - start)
+        return results
+
+    def summary(self, records, seconds):
+        return {'seconds': round(seconds, 3), 'records_per_sec': round(records / seconds)}
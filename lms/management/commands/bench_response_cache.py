@@ -0,0 +1,112 @@
+import json
+import time
+from django.conf import settings
+from django.contrib.auth.models import Group
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+from lms.models import Class, Lesson, Progress, School, Session, User
+from lms.response_cache import reset_stats, response_cache, stats
+from lms.views import AdminUserListView
+
+UNCACHED = {**settings.CACHES, 'responses': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+
+class Command(BaseCommand):
+    help = ("Poll the class list, progress list and admin user list for a school's headsets with and "
+            "without the response cache, optionally with a roster write every few reads. "
+            "Works on throwaway rows that are deleted afterwards.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', type=int, default=30)
+        parser.add_argument('--classes', type=int, default=6)
+        parser.add_argument('--lessons', type=int, default=10)
+        parser.add_argument('--rounds', type=int, default=10, help="Polls of every endpoint by every student.")
+        parser.add_argument('--write-every', type=int, default=100, help="Reads between writes in the last run.")
+        parser.add_argument('--json', action='store_true')
+
+    def handle(self, *args, **options):
+        school = School.objects.create(name='bench')
+        try:
+            with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+                results = self.run(school, options)
+        finally:
+            # Cascades to the bench users, classes, session, lessons and progress
+            school.delete()
+            response_cache().clear()
+
+        if options['json']:
+            self.stdout.write(json.dumps(results))
+            return
+        self.stdout.write(f"{'mode':>14} {'req/s':>8} {'ms/req':>7} {'hits':>6} {'misses':>6}")
+        for row in results:
+            self.stdout.write(f"{row['mode']:>14} {row['requests_per_sec']:>8} {row['ms_per_request']:>7} "
+                              f"{row['hits']:>6} {row['misses']:>6}")
+
+    def run(self, school, options):
+        teacher = User.objects.create(username='bench-teacher', nickname='bench-teacher', pin='0000', school=school)
+        admin = User.objects.create(username='bench-admin', nickname='bench-admin', pin='0000', school=school)
+        admin.groups.add(Group.objects.get_or_create(name='Admin')[0])
+        students = [
+            User.objects.create(username=f'bench-{i}', nickname=f'bench-{i}', pin='0000', school=school)
+            for i in range(options['students'])
+        ]
+        classes = [
+            Class.objects.create(school=school, name=f'bench {i}', teacher=teacher) for i in range(options['classes'])
+        ]
+        for school_class in classes:
+            school_class.students.add(*students)
+        session = Session.objects.create(title='bench', teacher=teacher, school=school)
+        lessons = [
+            Lesson.objects.create(title=f'bench {i}', content='', school=school, session=session)
+            for i in range(options['lessons'])
+        ]
+        Progress.objects.bulk_create([
+            Progress(school=school, student=student, lesson=lesson, score=80, progress_data={'cmi': {}})
+            for student in students for lesson in lessons
+        ])
+
+        clients = []
+        for student in students:
+            client = APIClient()
+            client.force_authenticate(user=student)
+            clients.append(client)
+        factory, admin_view = APIRequestFactory(), AdminUserListView.as_view()
+
+        def admin_get():
+            request = factory.get('/users/')
+            force_authenticate(request, user=admin)
+            return admin_view(request)
+
+        def poll(write_every=None):
+            reset_stats()
+            reads = 0
+            start = time.perf_counter()
+            for _ in range(options['rounds']):
+                for client in clients:
+                    client.get(reverse('classes'))
+                    client.get(reverse('progress'))
+                    admin_get()
+                    reads += 3
+                    if write_every and reads % write_every < 3:
+                        # A teacher renames a class: every class list of the school misses once
+                        classes[0].name = f'bench {reads}'
+                        classes[0].save()
+            return reads, time.perf_counter() - start
+
+        results = []
+        with override_settings(CACHES=UNCACHED):
+            results.append(self.summary('uncached', *poll()))
+        response_cache().clear()
+        results.append(self.summary('cached', *poll()))
+        response_cache().clear()
+        results.append(self.summary(f'write/{options["write_every"]}', *poll(options['write_every'])))
+        return results
+
+    def summary(self, mode, reads, seconds):
+        return {
+            'mode': mode, 'requests': reads, 'seconds': round(seconds, 3),
+            'requests_per_sec': round(reads / seconds), 'ms_per_request': round(1000 * seconds / reads, 2),
+            'hits': stats['hits'], 'misses': stats['misses'],
+        }
@@ -0,0 +1,120 @@
+import asyncio
+import json
+import time
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import Group
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, override_settings
+from django.urls import include, path
+from rest_framework.authtoken.models import Token
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from lms.models import School, Session, User
+from lms.permissions import IsTeacher
+from lms.session_state import session_states
+
+
+# The previous synchronous control view, kept here as the baseline: under ASGI Django runs
+# it in the shared sync thread, and the state write and notify_students() block that thread
+# on async_to_sync
+class SyncControlView(APIView):
+    permission_classes = [IsAuthenticated, IsTeacher]
+    action = None
+
+    def post(self, request):
+        session = Session.objects.get(id=request.data.get('session_id'), teacher=request.user, school_id=request.user.school_id)
+        async_to_sync(session_states.apply_now)(session, self.action)
+        if self.action == 'start':
+            session.notify_students()
+        return Response({'message': f'Session {self.action}'})
+
+
+# Served through the real ASGI handler by AsyncClient, with this module as ROOT_URLCONF
+urlpatterns = [
+    path('', include('lms.urls')),
+    *[
+        path(f'bench/sync/{action}/', SyncControlView.as_view(action=action), name=f'bench-sync-{action}')
+        for action in ('start', 'pause', 'stop')
+    ],
+]
+
+URLS = {
+    'async': {action: f'/api/session/{action}/' for action in ('start', 'pause', 'stop')},
+    'sync': {action: f'/bench/sync/{action}/' for action in ('start', 'pause', 'stop')},
+}
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class Command(BaseCommand):
+    help = "Request throughput of the session control views under concurrent teachers, async views vs the sync baseline."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--teachers', default='1,10,50', help="Comma-separated numbers of concurrent teachers.")
+        parser.add_argument('--cycles', type=int, default=10, help="start/pause/stop cycles per teacher.")
+        parser.add_argument('--json', action='store_true')
+
+    def handle(self, *args, **options):
+        counts = [int(count) for count in options['teachers'].split(',')]
+        school = School.objects.create(name='bench')
+        try:
+            teachers = []
+            teacher_group = Group.objects.get_or_create(name='Teacher')[0]
+            for i in range(max(counts)):
+                user = User.objects.create(
+                    username=f'bench-teacher-{i}', nickname=f'bench-teacher-{i}', pin='0000', school=school
+                )
+                user.groups.add(teacher_group)
+                session = Session.objects.create(title=f'bench {i}', teacher=user, school=school)
+                teachers.append((Token.objects.create(user=user).key, session.pk))
+
+            results = []
+            # AsyncClient requests go to the "testserver" host
+            with override_settings(ROOT_URLCONF=__name__, ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+                for count in counts:
+                    for mode in ('sync', 'async'):
+                        results.append(asyncio.run(self.run(mode, teachers[:count], options['cycles'])))
+        finally:
+            session_states.clear()
+            school.delete()
+
+        if options['json']:
+            self.stdout.write(json.dumps(results))
+            return
+        self.stdout.write(f"{'teachers':>8} {'mode':>6} {'requests/s':>11} {'p50 ms':>8} {'p99 ms':>8}")
+        for row in results:
+            self.stdout.write(f"{row['teachers']:>8} {row['mode']:>6} {row['requests_per_sec']:>11} "
+                              f"{row['p50_ms']:>8} {row['p99_ms']:>8}")
+
+    async def run(self, mode, teachers, cycles):
+        latencies = []
+
+        async def teach(key, session_id):
+            client = AsyncClient()
+            headers = {'Authorization': f'Token {key}'}
+            for _ in range(cycles):
+                for action in ('start', 'pause', 'stop'):
+                    sent = time.perf_counter()
+                    response = await client.post(
+                        URLS[mode][action], {'session_id': session_id}, content_type='application/json', headers=headers
+                    )
+                    latencies.append(time.perf_counter() - sent)
+                    if response.status_code != 200:
+                        raise RuntimeError(f"{mode} {action} returned {response.status_code}")
+
+        start = time.perf_counter()
+        await asyncio.gather(*(teach(key, session_id) for key, session_id in teachers))
+        elapsed = time.perf_counter() - start
+        return {
+            'mode': mode,
+            'teachers': len(teachers),
+            'requests': len(latencies),
+            'requests_per_sec': round(len(latencies) / elapsed),
+            'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        }
@@ -0,0 +1,57 @@
+import asyncio
+import json
+import time
+from channels.layers import InMemoryChannelLayer
+from django.core.management.base import BaseCommand
+
+
+async def negotiate(layer, channels, signals_per_peer, addressed):
+    """
+    Teacher (channels[0]) negotiates with every headset: each side sends an
+    offer or answer plus its ICE candidates. Returns deliveries and seconds.
+    """
+    teacher, headsets = channels[0], channels[1:]
+    delivered = 0
+    start = time.perf_counter()
+    for headset in headsets:
+        for sender, target in ((teacher, headset), (headset, teacher)):
+            for n in range(signals_per_peer):
+                message = {'type': 'webrtc_signal', 'action': 'ice_candidate', 'candidate': f'candidate:{n}'}
+                if addressed:
+                    await layer.send(target, message)
+                    recipients = [target]
+                else:
+                    await layer.group_send('session_bench', message)
+                    recipients = channels
+                for recipient in recipients:
+                    await layer.receive(recipient)
+                delivered += len(recipients)
+    return delivered, time.perf_counter() - start
+
+
+class Command(BaseCommand):
+    help = "Compare WebRTC signaling message counts: group broadcast vs peer-addressed sends."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--headsets', type=int, default=30)
+        parser.add_argument('--signals', type=int, default=12, help="Offer/answer + ICE candidates per side.")
+        parser.add_argument('--json', action='store_true')
+
+    def handle(self, *args, **options):
+        results = asyncio.run(self.run(options['headsets'], options['signals']))
+        if options['json']:
+            self.stdout.write(json.dumps(results))
+            return
+        for mode, metrics in results.items():
+            self.stdout.write(f"{mode:<10} deliveries={metrics['deliveries']:<8} seconds={metrics['seconds']}")
+
+    async def run(self, headsets, signals):
+        results = {}
+        for mode, addressed in (('broadcast', False), ('addressed', True)):
+            layer = InMemoryChannelLayer(capacity=headsets + 1)
+            channels = [await layer.new_channel() for _ in range(headsets + 1)]
+            for channel in channels:
+                await layer.group_add('session_bench', channel)
+            deliveries, seconds = await negotiate(layer, channels, signals, addressed)
+            results[mode] = {'deliveries': deliveries, 'seconds': round(seconds, 4)}
+        return results
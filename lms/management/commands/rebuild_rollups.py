@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from lms.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Recompute the lesson, session and class analytics rollups from Progress."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--school', type=int, help="Only rebuild the rollups of this school id.")
+
+    def handle(self, *args, **options):
+        counts = rebuild_rollups(school_id=options['school'])
+        for model, count in counts.items():
+            self.stdout.write(f"{model}: {count} row(s)")
+        self.stdout.write(self.style.SUCCESS("Rollups rebuilt"))
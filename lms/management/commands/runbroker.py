@@ -0,0 +1,42 @@
+import asyncio
+import os
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from lms.layers import LayerBroker
+
+
+class Command(BaseCommand):
+    help = "Run the local channel layer broker used by lms.layers.UnixSocketChannelLayer."
+
+    def add_arguments(self, parser):
+        config = settings.CHANNEL_LAYERS.get('default', {}).get('CONFIG', {})
+        parser.add_argument('--path', default=config.get('path', os.environ.get('LMS_BROKER_SOCKET')))
+        parser.add_argument('--group-expiry', type=int, default=config.get('group_expiry', 86400))
+        parser.add_argument('--buffer-limit', type=int, default=4 * 1024 * 1024,
+                            help="Bytes queued for one worker before messages to it are dropped.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not path:
+            self.stderr.write("No socket path: pass --path or set LMS_BROKER_SOCKET")
+            return
+
+        # A previous broker may have left its socket file behind
+        if os.path.exists(path):
+            os.unlink(path)
+
+        async def serve():
+            broker = LayerBroker(path, group_expiry=options['group_expiry'], buffer_limit=options['buffer_limit'])
+            server = await broker.start()
+            os.chmod(path, 0o600)
+            self.stdout.write(f"Broker listening on {path}")
+            async with server:
+                await server.serve_forever()
+
+        try:
+            asyncio.run(serve())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if os.path.exists(path):
+                os.unlink(path)
@@ -0,0 +1,62 @@
+from django.contrib.auth.models import Group
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from lms.authentication import token_cache
+from lms.models import User
+from lms.roles import ROLE_BITS, ROLE_GROUPS, mask_from_groups, role_from_groups
+
+
+class Command(BaseCommand):
+    help = "Backfill User.role and User.role_mask from role groups (or groups from User.role) and fix mismatches in bulk."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--source', choices=['groups', 'role'], default='groups',
+            help="Which side wins on a mismatch: 'groups' rewrites User.role/role_mask, 'role' rewrites group membership.",
+        )
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true', help="Report mismatches without writing.")
+
+    def handle(self, *args, **options):
+        groups = {group.name: group for group in Group.objects.filter(name__in=ROLE_GROUPS.values())}
+        Membership = User.groups.through
+
+        # Role-group membership for every user, in one query
+        memberships = {}
+        for user_id, group_name in Membership.objects.filter(group__in=groups.values()).values_list('user_id', 'group__name'):
+            memberships.setdefault(user_id, set()).add(group_name)
+
+        mismatched = []
+        for user_id, role, mask in User.objects.values_list('id', 'role', 'role_mask').iterator():
+            group_names = memberships.get(user_id, set())
+            if options['source'] == 'groups':
+                expected = (role_from_groups(group_names), mask_from_groups(group_names))
+                if (role, mask) != expected:
+                    mismatched.append(User(id=user_id, role=expected[0], role_mask=expected[1]))
+            elif group_names != ({ROLE_GROUPS[role]} if role in ROLE_GROUPS else set()) or mask != ROLE_BITS.get(role, 0):
+                mismatched.append(User(id=user_id, role=role, role_mask=ROLE_BITS.get(role, 0)))
+
+        self.stdout.write(f"{len(mismatched)} user(s) with a role/group mismatch")
+        if options['dry_run'] or not mismatched:
+            return
+
+        with transaction.atomic():
+            if options['source'] == 'groups':
+                User.objects.bulk_update(mismatched, ['role', 'role_mask'], batch_size=options['batch_size'])
+            else:
+                User.objects.bulk_update(mismatched, ['role_mask'], batch_size=options['batch_size'])
+                ids = [user.id for user in mismatched]
+                Membership.objects.filter(user_id__in=ids, group__in=groups.values()).delete()
+                Membership.objects.bulk_create(
+                    [
+                        Membership(user_id=user.id, group_id=groups[ROLE_GROUPS[user.role]].id)
+                        for user in mismatched
+                        if ROLE_GROUPS.get(user.role) in groups
+                    ],
+                    batch_size=options['batch_size'],
+                )
+
+        # Bulk writes skip the model signals; drop this process's cached principals.
+        # Other processes pick up the change once their cache TTL expires.
+        token_cache.clear()
+        self.stdout.write(self.style.SUCCESS(f"Reconciled {len(mismatched)} user(s) from {options['source']}"))
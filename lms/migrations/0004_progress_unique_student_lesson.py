@@ -0,0 +1,30 @@
+# Generated by Django 5.1.2 on 2026-10-18 02:44
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def remove_duplicate_progress(apps, schema_editor):
+    # Keep the newest row for each (student, lesson) so the constraint can be added
+    Progress = apps.get_model('lms', 'Progress')
+    keep = (
+        Progress.objects.values('student', 'lesson')
+        .annotate(keep_id=Max('id'))
+        .values_list('keep_id', flat=True)
+    )
+    Progress.objects.exclude(id__in=list(keep)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lms', '0003_interactionevent'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_progress, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='progress',
+            constraint=models.UniqueConstraint(fields=('student', 'lesson'), name='unique_progress_per_student_lesson'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 02:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lms', '0004_progress_unique_student_lesson'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='progress',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
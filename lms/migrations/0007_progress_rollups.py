@@ -0,0 +1,71 @@
+# Generated by Django 5.1.2 on 2026-10-18 02:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lms', '0006_progress_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClassRollup',
+            fields=[
+                ('progress_count', models.IntegerField(default=0)),
+                ('completed_count', models.IntegerField(default=0)),
+                ('score_sum', models.BigIntegerField(default=0)),
+                ('scores_0_19', models.IntegerField(default=0)),
+                ('scores_20_39', models.IntegerField(default=0)),
+                ('scores_40_59', models.IntegerField(default=0)),
+                ('scores_60_79', models.IntegerField(default=0)),
+                ('scores_80_100', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('lesson_class', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rollup', serialize=False, to='lms.class')),
+                ('school', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='lms.school')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='LessonRollup',
+            fields=[
+                ('progress_count', models.IntegerField(default=0)),
+                ('completed_count', models.IntegerField(default=0)),
+                ('score_sum', models.BigIntegerField(default=0)),
+                ('scores_0_19', models.IntegerField(default=0)),
+                ('scores_20_39', models.IntegerField(default=0)),
+                ('scores_40_59', models.IntegerField(default=0)),
+                ('scores_60_79', models.IntegerField(default=0)),
+                ('scores_80_100', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('lesson', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rollup', serialize=False, to='lms.lesson')),
+                ('school', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='lms.school')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='SessionRollup',
+            fields=[
+                ('progress_count', models.IntegerField(default=0)),
+                ('completed_count', models.IntegerField(default=0)),
+                ('score_sum', models.BigIntegerField(default=0)),
+                ('scores_0_19', models.IntegerField(default=0)),
+                ('scores_20_39', models.IntegerField(default=0)),
+                ('scores_40_59', models.IntegerField(default=0)),
+                ('scores_60_79', models.IntegerField(default=0)),
+                ('scores_80_100', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('session', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rollup', serialize=False, to='lms.session')),
+                ('school', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='lms.school')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # The class list filters classes by enrolled student. With only the (class_id, user_id)
+    # unique index SQLite walks every class of the school and probes each one; a covering
+    # (user_id, class_id) index lets it start from the student's enrollments instead.
+    # The through table is auto-created by Class.students, hence raw SQL.
+
+    dependencies = [
+        ('lms', '0007_progress_rollups'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX "lms_class_students_user_class_idx" ON "lms_class_students" ("user_id", "class_id")',
+            reverse_sql='DROP INDEX "lms_class_students_user_class_idx"',
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.1.2 on 2026-10-18 03:22
+
+from django.db import migrations, models
+
+# lms.roles as of this migration: role, group name and bit, in precedence order
+ROLES = [('admin', 'Admin', 1), ('teacher', 'Teacher', 2), ('student', 'Student', 4)]
+
+
+def backfill_roles(apps, schema_editor):
+    # Role and mask from role-group membership, so existing teachers keep their access without sync_roles
+    User = apps.get_model('lms', 'User')
+    memberships = {}
+    rows = User.groups.through.objects.filter(group__name__in=[group for _, group, _ in ROLES])
+    for user_id, group_name in rows.values_list('user_id', 'group__name'):
+        memberships.setdefault(user_id, set()).add(group_name)
+
+    users = []
+    for user in User.objects.only('id', 'role', 'role_mask').iterator():
+        group_names = memberships.get(user.pk, set())
+        user.role = next((role for role, group, _ in ROLES if group in group_names), '')
+        user.role_mask = sum(bit for _, group, bit in ROLES if group in group_names)
+        users.append(user)
+    User.objects.bulk_update(users, ['role', 'role_mask'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lms', '0009_lesson_package'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='role_mask',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='role',
+            field=models.CharField(blank=True, choices=[('admin', 'Admin'), ('teacher', 'Teacher'), ('student', 'Student')], default='', max_length=10),
+        ),
+        migrations.RunPython(backfill_roles, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 03:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lms', '0010_user_role_mask'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='session',
+            name='seq',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
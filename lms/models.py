@@ -1,9 +1,9 @@
-import json
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import RegexValidator
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
+from .protocol import encode_frame
 
 # Custom User model
 class School(models.Model):
@@ -25,7 +25,8 @@ class User(AbstractUser):
         ('admin', 'Admin'),
         ('teacher', 'Teacher'),
         ('student', 'Student'),
-    ], default='student')  # Default role can be set as 'student'
+    ], default='', blank=True)  # Highest-precedence role group of the user, '' when in none
+    role_mask = models.PositiveSmallIntegerField(default=0)  # lms.roles bits of every role group the user is in
 
     def __str__(self):
         return self.nickname
@@ -52,6 +53,17 @@ class Session(models.Model):
     started_at = models.DateTimeField(null=True, blank=True)
     stopped_at = models.DateTimeField(null=True, blank=True)
     notification_sent = models.BooleanField(default=False)
+    seq = models.PositiveBigIntegerField(default=0)  # Sequence number of the last control change (lms/session_state.py)
+
+    def notification_event(self):
+        # Notify all students in the session (frame encoded once for every recipient)
+        return {
+            'type': 'session.notification',
+            'text': encode_frame({
+                'action': 'session_notification',
+                'message': f'Session "{self.title}" has started!',
+            }),
+        }
 
     def notify_students(self):
         # Check if the notification has already been sent
@@ -60,26 +72,36 @@ class Session(models.Model):
             channel_layer = get_channel_layer()
             group_name = f'session_{self.id}'  # Unique group for the session
 
-            # Notify all students in the session
-            async_to_sync(channel_layer.group_send)(
-                group_name,
-                {
-                    'type': 'session.notification',
-                    'message': f'Session "{self.title}" has started!',
-                }
-            )
+            async_to_sync(channel_layer.group_send)(group_name, self.notification_event())
             self.notification_sent = True  # Mark notification as sent
             self.save(update_fields=['notification_sent'])  # Save the change
 
+    async def anotify_students(self):
+        # Same as notify_students() for async callers: awaits the group send on the running loop
+        if not self.notification_sent:
+            await get_channel_layer().group_send(f'session_{self.id}', self.notification_event())
+            self.notification_sent = True
+            await self.asave(update_fields=['notification_sent'])
+
     def __str__(self):
         return self.title
     
+# Uploaded SCORM/VR lesson package, stored once per content hash (see lms/packages.py)
+class LessonPackage(models.Model):
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    size = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.sha256
+
 class Lesson(models.Model):
     school = models.ForeignKey(School, on_delete=models.CASCADE)
     title = models.CharField(max_length=255)
     content = models.TextField()  # SCORM package metadata can be linked here
     lesson_class = models.CharField(max_length=255, default='General')  # Provide a sensible default
     session = models.ForeignKey(Session, on_delete=models.CASCADE, related_name='lessons')  # Use the correct reference
+    package = models.ForeignKey(LessonPackage, on_delete=models.PROTECT, null=True, blank=True, related_name='lessons')
     def __str__(self):
         return self.title
 
@@ -90,8 +112,67 @@ class Progress(models.Model):
     score = models.IntegerField(default=0)
     completed = models.BooleanField(default=False)
     progress_data = models.JSONField(null=True, blank=True)  # SCORM progress tracking
+    version = models.PositiveIntegerField(default=1)  # Bumped on every write, for optimistic concurrency
+    updated_at = models.DateTimeField(auto_now=True)
     def __str__(self):
         return f"{self.student.nickname} - {self.lesson.title}"
 
     class Meta:
-        verbose_name_plural = "Progress"
\ No newline at end of file
+        verbose_name_plural = "Progress"
+        constraints = [
+            # One row per student and lesson, the conflict target of the bulk upsert
+            models.UniqueConstraint(fields=['student', 'lesson'], name='unique_progress_per_student_lesson'),
+        ]
+
+class InteractionEvent(models.Model):
+    # Append-only log of headset interactions (gaze, clicks, actions), written in batches by lms.ingest
+    school = models.ForeignKey(School, on_delete=models.CASCADE)
+    session = models.ForeignKey(Session, on_delete=models.CASCADE, related_name='events')
+    student = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)  # Null for anonymous devices
+    kind = models.CharField(max_length=20)  # e.g. 'gaze', 'click', 'action'
+    data = models.JSONField(null=True, blank=True)
+    occurred_at = models.DateTimeField()  # Device-reported time, or receipt time when missing
+    received_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.kind} @ {self.occurred_at}"
+
+    class Meta:
+        indexes = [models.Index(fields=['session', 'occurred_at'])]
+
+
+# Analytics rollups, maintained incrementally by lms.rollups on every Progress write
+class ProgressRollup(models.Model):
+    school = models.ForeignKey(School, on_delete=models.CASCADE)
+    # Plain integers: a counter that drifted negative must not make Progress writes fail
+    progress_count = models.IntegerField(default=0)
+    completed_count = models.IntegerField(default=0)
+    score_sum = models.BigIntegerField(default=0)
+    # Score distribution in bands of 20 points
+    scores_0_19 = models.IntegerField(default=0)
+    scores_20_39 = models.IntegerField(default=0)
+    scores_40_59 = models.IntegerField(default=0)
+    scores_60_79 = models.IntegerField(default=0)
+    scores_80_100 = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        abstract = True
+
+    @property
+    def average_score(self):
+        return self.score_sum / self.progress_count if self.progress_count else None
+
+    @property
+    def completion_rate(self):
+        return self.completed_count / self.progress_count if self.progress_count else None
+
+class LessonRollup(ProgressRollup):
+    lesson = models.OneToOneField(Lesson, on_delete=models.CASCADE, primary_key=True, related_name='rollup')
+
+class SessionRollup(ProgressRollup):
+    session = models.OneToOneField(Session, on_delete=models.CASCADE, primary_key=True, related_name='rollup')
+
+class ClassRollup(ProgressRollup):
+    # Progress of the class's students, on any lesson
+    lesson_class = models.OneToOneField(Class, on_delete=models.CASCADE, primary_key=True, related_name='rollup')
@@ -0,0 +1,65 @@
+# Per-connection outbound queue for SessionConsumer.
+#
+# Handlers only enqueue frames and a writer task drains the queue into the
+# socket, so a client on a slow link can't stall the channel layer behind it.
+# Frames are either reliable (session control, signaling, peer and presence
+# updates, replies) or ephemeral (pings, heartbeat and clock replies, viewport
+# batches). Reliable frames go first, in order, and are never dropped: once
+# more than LMS_SEND_QUEUE_LIMIT are waiting the client is too slow and gets
+# disconnected. Ephemeral frames carry a key; a newer frame with the same key
+# replaces a queued one, and beyond LMS_SEND_QUEUE_EPHEMERAL the oldest is dropped.
+import asyncio
+from collections import OrderedDict, deque
+
+# Totals over every connection of this worker process
+stats = {'sent': 0, 'superseded': 0, 'dropped': 0, 'slow_disconnects': 0}
+
+
+class SendQueue:
+    def __init__(self, limit, ephemeral_limit):
+        self.limit = limit
+        self.ephemeral_limit = ephemeral_limit
+        self._reliable = deque()
+        self._ephemeral = OrderedDict()  # key -> frame
+        self._ready = asyncio.Event()
+        self.stats = {'sent': 0, 'superseded': 0, 'dropped': 0, 'max_depth': 0}
+
+    def __len__(self):
+        return len(self._reliable) + len(self._ephemeral)
+
+    def put(self, frame, key=None):
+        """
+        Queue a frame; frames with a key are ephemeral. Returns False when the
+        reliable backlog is over the limit and the client should be disconnected.
+        """
+        if key is None:
+            self._reliable.append(frame)
+        elif key in self._ephemeral:
+            self._ephemeral[key] = frame
+            self._ephemeral.move_to_end(key)
+            self._count('superseded')
+        else:
+            if len(self._ephemeral) >= self.ephemeral_limit:
+                self._ephemeral.popitem(last=False)
+                self._count('dropped')
+            self._ephemeral[key] = frame
+
+        self.stats['max_depth'] = max(self.stats['max_depth'], len(self))
+        self._ready.set()
+        return len(self._reliable) <= self.limit
+
+    def pending(self, key):
+        return key in self._ephemeral
+
+    async def get(self):
+        while not self:
+            self._ready.clear()
+            await self._ready.wait()
+        self._count('sent')
+        if self._reliable:
+            return self._reliable.popleft()
+        return self._ephemeral.popitem(last=False)[1]
+
+    def _count(self, name):
+        self.stats[name] += 1
+        stats[name] += 1
@@ -0,0 +1,133 @@
+# Content-addressed store for lesson packages.
+#
+# Each upload is hashed while it is written to a temporary file in the store,
+# then moved to <LMS_PACKAGE_ROOT>/<first two hex digits>/<sha256>. The same
+# package uploaded by several schools is kept once, with one LessonPackage row.
+# Uploads over LMS_PACKAGE_MAX_SIZE bytes are refused.
+import hashlib
+import os
+import re
+import tempfile
+from django.conf import settings
+from django.db import IntegrityError
+from .models import LessonPackage
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class PackageTooLarge(ValueError):
+    """
+    The upload is over LMS_PACKAGE_MAX_SIZE; ``limit`` is that size in bytes.
+    """
+
+    def __init__(self, limit):
+        super().__init__(f"Packages are limited to {limit} bytes")
+        self.limit = limit
+
+
+def package_root():
+    return str(getattr(settings, 'LMS_PACKAGE_ROOT', settings.BASE_DIR / 'packages'))
+
+
+def package_path(sha256):
+    return os.path.join(package_root(), sha256[:2], sha256)
+
+
+def store_package(uploaded):
+    """
+    Save an uploaded file under its SHA-256. Returns (package, created);
+    created is False when the same content was already stored. Raises
+    PackageTooLarge when the upload is over LMS_PACKAGE_MAX_SIZE.
+    """
+    limit = getattr(settings, 'LMS_PACKAGE_MAX_SIZE', 2 * 1024 ** 3)
+    # The declared size is checked first; the count while writing catches uploads that don't declare it
+    if uploaded.size is not None and uploaded.size > limit:
+        raise PackageTooLarge(limit)
+    os.makedirs(package_root(), exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    moved = False
+    fd, temp_path = tempfile.mkstemp(dir=package_root(), prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as temp:
+            for chunk in uploaded.chunks():
+                size += len(chunk)
+                if size > limit:
+                    raise PackageTooLarge(limit)
+                digest.update(chunk)
+                temp.write(chunk)
+        sha256 = digest.hexdigest()
+        path = package_path(sha256)
+        if os.path.exists(path):
+            os.remove(temp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_path, path)
+            moved = True
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    try:
+        return LessonPackage.objects.get_or_create(sha256=sha256, defaults={'size': size})
+    except IntegrityError:
+        # Stored concurrently by another upload of the same content
+        return LessonPackage.objects.get(sha256=sha256), False
+    except BaseException:
+        # No row refers to the file we just stored, so don't leave it behind
+        if moved:
+            os.remove(path)
+        raise
+
+
+def parse_range(header, size):
+    """
+    The (start, end) byte positions, end inclusive, of a single-range
+    ``Range: bytes=`` header; None when absent or not a form we serve
+    (the whole file is sent). Raises ValueError when unsatisfiable.
+    """
+    match = RANGE_RE.match(header or '')
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if size == 0:
+        raise ValueError("Empty file")
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError("Empty suffix range")
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or (last and int(last) < start):
+        raise ValueError("Range not satisfiable")
+    return start, end
+
+
+class FileRange:
+    """
+    Read-only view of ``length`` bytes of an open file from its current
+    position. fileno() is the file's own, so servers with sendfile support
+    (bounded by Content-Length) send it without copying through Python.
+    """
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
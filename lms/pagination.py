@@ -0,0 +1,16 @@
+from rest_framework.pagination import CursorPagination
+
+# Cursor pagination for class rosters: keyset on id, no COUNT(*) query per page
+class ClassCursorPagination(CursorPagination):
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = 'id'
+
+
+# Progress lists polled by headsets; keyset on id like the class rosters
+class ProgressCursorPagination(CursorPagination):
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    ordering = 'id'
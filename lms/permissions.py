@@ -1,19 +1,20 @@
 from rest_framework.permissions import BasePermission
+from .roles import ROLE_ADMIN, ROLE_STUDENT, ROLE_TEACHER, get_role_mask
 
-# Permission for users who are in the 'Teacher' group
+# Permission for users with the 'teacher' role (Teacher group)
 class IsTeacher(BasePermission):
     def has_permission(self, request, view):
-        # Check if the user is in the 'Teacher' group
-        return request.user.groups.filter(name='Teacher').exists()
+        # Check the per-request role bitmask for the teacher bit
+        return bool(get_role_mask(request) & ROLE_TEACHER)
 
-# Permission for users who are in the 'Admin' group
+# Permission for users with the 'admin' role (Admin group)
 class IsSchoolAdmin(BasePermission):
     def has_permission(self, request, view):
-        # Check if the user is in the 'Admin' group
-        return request.user.groups.filter(name='Admin').exists()
+        # Check the per-request role bitmask for the admin bit
+        return bool(get_role_mask(request) & ROLE_ADMIN)
 
-# Permission for users who are in the 'Student' group
+# Permission for users with the 'student' role (Student group)
 class IsStudent(BasePermission):
     def has_permission(self, request, view):
-        # Check if the user is in the 'Student' group
-        return request.user.groups.filter(name='Student').exists()
\ No newline at end of file
+        # Check the per-request role bitmask for the student bit
+        return bool(get_role_mask(request) & ROLE_STUDENT)
@@ -0,0 +1,85 @@
+# Who is connected to each session, for rosters and idle eviction.
+#
+# Each worker process keeps its own index of the sockets it serves.
+# SessionConsumer joins on connect, refreshes last_seen on every frame (clients
+# that have nothing else to say send {"action": "heartbeat"}) and closes sockets
+# idle for longer than LMS_PRESENCE_TIMEOUT (if set), which removes them here.
+import time
+from datetime import timedelta
+from django.utils import timezone
+
+
+class Presence:
+    __slots__ = [
+        'peer_id', 'channel_name', 'user_id', 'role', 'binary', 'send_queue', 'connected_at', 'last_seen', 'last_seen_at',
+    ]
+
+    def __init__(self, peer_id, channel_name, user_id=None, role=None, binary=False, send_queue=None):
+        self.peer_id = peer_id
+        self.channel_name = channel_name
+        self.user_id = user_id
+        self.role = role
+        self.binary = binary
+        self.send_queue = send_queue  # lms.outbound.SendQueue of the connection
+        self.connected_at = timezone.now()
+        self.touch()
+
+    def touch(self):
+        self.last_seen = time.monotonic()  # For idle checks
+        self.last_seen_at = None  # Wall-clock time, computed when the roster is read
+
+    def idle_for(self):
+        return time.monotonic() - self.last_seen
+
+    def as_dict(self):
+        if self.last_seen_at is None:
+            self.last_seen_at = timezone.now() - timedelta(seconds=self.idle_for())
+        presence = {
+            'peer_id': self.peer_id,
+            'user_id': self.user_id,
+            'role': self.role,
+            'binary': self.binary,
+            'connected_at': self.connected_at.isoformat(),
+            'last_seen': self.last_seen_at.isoformat(),
+        }
+        if self.send_queue is not None:
+            presence['send_queue'] = {'depth': len(self.send_queue), **self.send_queue.stats}
+        return presence
+
+
+class PresenceRegistry:
+    def __init__(self):
+        self._sessions = {}  # session id -> {peer id: Presence}
+
+    def join(self, session_id, peer_id, channel_name, **metadata):
+        presence = Presence(peer_id, channel_name, **metadata)
+        self._sessions.setdefault(session_id, {})[peer_id] = presence
+        return presence
+
+    def leave(self, session_id, peer_id, channel_name):
+        """
+        Remove a connection; returns False when a reconnect of the same peer
+        already replaced it.
+        """
+        peers = self._sessions.get(session_id)
+        if not peers or peer_id not in peers or peers[peer_id].channel_name != channel_name:
+            return False
+        del peers[peer_id]
+        if not peers:
+            del self._sessions[session_id]
+        return True
+
+    def get(self, session_id, peer_id):
+        return self._sessions.get(session_id, {}).get(peer_id)
+
+    def count(self, session_id):
+        return len(self._sessions.get(session_id, ()))
+
+    def roster(self, session_id):
+        return [presence.as_dict() for presence in self._sessions.get(session_id, {}).values()]
+
+    def clear(self):
+        self._sessions.clear()
+
+
+presence_registry = PresenceRegistry()
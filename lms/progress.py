@@ -0,0 +1,192 @@
+import time
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import Lesson, Progress, User
+from .response_cache import PROGRESS, invalidate
+from .rollups import apply_progress_changes
+from .scorm import merge_patch, set_cmi_elements
+
+# Columns rewritten when a (student, lesson) row already exists
+UPSERT_FIELDS = ['score', 'completed', 'progress_data', 'version', 'updated_at']
+
+
+def _version_key(student_id):
+    return f'lms:progress-version:{student_id}'
+
+
+def progress_version(student_id):
+    """
+    Version of a student's whole progress list, used as validator for
+    conditional GETs. It is the time (ns) of the last change; when the cache
+    entry is missing a fresh one is seeded, which only costs clients one full
+    response.
+    """
+    version = cache.get(_version_key(student_id))
+    if version is None:
+        cache.add(_version_key(student_id), time.time_ns(), timeout=None)
+        version = cache.get(_version_key(student_id))
+    return version
+
+
+def bump_progress_version(*student_ids):
+    # Called after every write to Progress; signals cover save()/delete(), bulk paths call it directly
+    now = time.time_ns()
+    cache.set_many({_version_key(student_id): now for student_id in student_ids}, timeout=None)
+    invalidate(PROGRESS, *student_ids)
+
+
+class VersionConflict(Exception):
+    """
+    The row changed since the client last read it; ``current`` is its version now.
+    """
+
+    def __init__(self, current):
+        super().__init__(f"Progress is at version {current}")
+        self.current = current
+
+
+def bulk_upsert_progress(items, school_id, session_id=None):
+    """
+    Insert or update many Progress rows in one transaction. Each item is a
+    validated dict with student, lesson, score, completed and progress_data.
+
+    Lessons and students outside the school (or, with session_id, lessons
+    outside that session) are rejected per item with two queries for the whole
+    batch. When the same (student, lesson) appears twice the last record wins.
+    Returns one result dict per item, in order.
+    """
+    lessons = Lesson.objects.filter(id__in={item['lesson'] for item in items}, school_id=school_id)
+    if session_id is not None:
+        lessons = lessons.filter(session_id=session_id)
+    valid_lessons = set(lessons.values_list('id', flat=True))
+    valid_students = set(
+        User.objects.filter(id__in={item['student'] for item in items}, school_id=school_id)
+        .values_list('id', flat=True)
+    )
+
+    results = []
+    latest = {}  # (student, lesson) -> index of the record that wins
+    for index, item in enumerate(items):
+        result = {'index': index, 'student': item['student'], 'lesson': item['lesson'], 'status': 'ok'}
+        if item['lesson'] not in valid_lessons:
+            result.update(status='error', error='Lesson not found or unauthorized')
+        elif item['student'] not in valid_students:
+            result.update(status='error', error='Student not found or unauthorized')
+        else:
+            key = (item['student'], item['lesson'])
+            if key in latest:
+                results[latest[key]].update(status='skipped', error='Superseded by a later record')
+            latest[key] = index
+        results.append(result)
+
+    if not latest:
+        return results
+
+    with transaction.atomic():
+        # Missing rows are first inserted at version 0 (a concurrent insert of the same key wins), so
+        # every row exists and can be locked; nobody sees version 0, the update below bumps it
+        Progress.objects.bulk_create(
+            [
+                Progress(school_id=school_id, student_id=student, lesson_id=lesson, score=items[index]['score'],
+                         completed=items[index]['completed'], version=0)
+                for (student, lesson), index in latest.items()
+            ],
+            ignore_conflicts=True,
+        )
+        # Locked until the commit: a concurrent upsert of the same rows waits and then reads our versions
+        existing = {
+            (student_id, lesson_id): (pk, version, score, completed)
+            for pk, student_id, lesson_id, version, score, completed in Progress.objects.select_for_update().filter(
+                student_id__in={student for student, _ in latest},
+                lesson_id__in={lesson for _, lesson in latest},
+            ).values_list('id', 'student_id', 'lesson_id', 'version', 'score', 'completed')
+            if (student_id, lesson_id) in latest
+        }
+        now = timezone.now()
+        rows = [
+            Progress(
+                pk=existing[key][0],
+                student_id=items[index]['student'],
+                lesson_id=items[index]['lesson'],
+                score=items[index]['score'],
+                completed=items[index]['completed'],
+                progress_data=items[index]['progress_data'],
+                # Every write bumps the row version, so clients patching concurrently notice the upsert
+                version=F('version') + 1,
+                updated_at=now,
+            )
+            for key, index in latest.items()
+        ]
+        Progress.objects.bulk_update(rows, UPSERT_FIELDS)
+        apply_progress_changes(
+            # Rows at version 0 are the placeholders inserted above
+            removed=[(*key, score, completed) for key, (_, version, score, completed) in existing.items() if version],
+            added=[(row.student_id, row.lesson_id, row.score, row.completed) for row in rows],
+        )
+    # After the commit, so a poll can't cache the old rows under the new version
+    bump_progress_version(*{student for student, _ in latest})
+    return results
+
+
+def patch_progress(student_id, lesson_id, school_id, version, merge=None, elements=None, **fields):
+    """
+    Apply a delta to one student's progress on a lesson and return the new
+    version. ``merge`` is a JSON Merge Patch for progress_data, ``elements``
+    maps CMI element paths to values, and ``fields`` may set score/completed.
+
+    ``version`` is the version the client last saw (0 when it has none yet).
+    The write only lands if the row is still at that version; otherwise
+    VersionConflict is raised and nothing changes. Raises Lesson.DoesNotExist
+    for lessons outside the school and scorm.PatchError for bad element paths.
+    """
+    row = (
+        Progress.objects.filter(student_id=student_id, lesson_id=lesson_id)
+        .values('id', 'version', 'progress_data', 'score', 'completed')
+        .first()
+    )
+    if row is None:
+        if version != 0:
+            raise VersionConflict(0)
+        if not Lesson.objects.filter(id=lesson_id, school_id=school_id).exists():
+            raise Lesson.DoesNotExist(f"Lesson {lesson_id} does not exist")
+        data = None
+    elif row['version'] != version:
+        raise VersionConflict(row['version'])
+    else:
+        data = row['progress_data']
+
+    if merge is not None:
+        data = merge_patch(data, merge)
+    if elements:
+        data = set_cmi_elements(data, elements)
+
+    if row is None:
+        try:
+            with transaction.atomic():
+                Progress.objects.create(
+                    school_id=school_id, student_id=student_id, lesson_id=lesson_id,
+                    progress_data=data, version=1, **fields,
+                )
+        except IntegrityError:
+            # Another device created the row first
+            raise VersionConflict(
+                Progress.objects.filter(student_id=student_id, lesson_id=lesson_id).values_list('version', flat=True).first() or 0
+            )
+        return 1
+
+    # Compare-and-swap on the version column
+    with transaction.atomic():
+        updated = Progress.objects.filter(pk=row['id'], version=version).update(
+            progress_data=data, version=F('version') + 1, updated_at=timezone.now(), **fields
+        )
+        if updated and fields:
+            apply_progress_changes(
+                removed=[(student_id, lesson_id, row['score'], row['completed'])],
+                added=[(student_id, lesson_id, fields.get('score', row['score']), fields.get('completed', row['completed']))],
+            )
+    if not updated:
+        raise VersionConflict(Progress.objects.filter(pk=row['id']).values_list('version', flat=True).first() or 0)
+    bump_progress_version(student_id)
+    return version + 1
@@ -0,0 +1,145 @@
+# Binary WebSocket subprotocol for headsets ("lms.binary.v1").
+#
+# Every frame starts with a 2-byte header: protocol version, then a tag that
+# selects the body layout. Multi-byte fields are big-endian.
+#
+#   control   start / pause / stop            no body
+#   signaling offer / answer / ice_candidate  target (u8 length + UTF-8), JSON object
+#             end_of_candidates
+#   pose      t_ms u32, position xyz f32, orientation quaternion xyzw f32
+#   gaze      t_ms u32, origin xyz f32, direction xyz f32
+#   interact  t_ms u32, kind u8, target (u8 length + UTF-8)
+#   json      any other message as a UTF-8 JSON object (also used server -> client)
+import json
+import struct
+
+SUBPROTOCOL = 'lms.binary.v1'
+VERSION = 1
+
+HEADER = struct.Struct('!BB')
+POSE = struct.Struct('!I7f')
+GAZE = struct.Struct('!I6f')
+INTERACTION = struct.Struct('!IB')
+
+TAG_START = 0x01
+TAG_PAUSE = 0x02
+TAG_STOP = 0x03
+TAG_OFFER = 0x04
+TAG_ANSWER = 0x05
+TAG_ICE_CANDIDATE = 0x06
+TAG_END_OF_CANDIDATES = 0x07
+TAG_POSE = 0x10
+TAG_GAZE = 0x11
+TAG_INTERACTION = 0x12
+TAG_JSON = 0x7F
+
+CONTROL_TAGS = {TAG_START: 'start', TAG_PAUSE: 'pause', TAG_STOP: 'stop'}
+SIGNALING_TAGS = {
+    TAG_OFFER: 'offer',
+    TAG_ANSWER: 'answer',
+    TAG_ICE_CANDIDATE: 'ice_candidate',
+    TAG_END_OF_CANDIDATES: 'end_of_candidates',
+}
+ACTION_TAGS = {action: tag for tag, action in {**CONTROL_TAGS, **SIGNALING_TAGS}.items()}
+
+INTERACTION_KINDS = ['click', 'grab', 'release', 'select', 'answer']
+
+JSON_HEADER = HEADER.pack(VERSION, TAG_JSON)
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+def encode_frame(payload):
+    """
+    Serialize an outgoing JSON frame once. Group and peer messages carry the
+    result in their "text" key and handlers write it to the socket untouched,
+    instead of every recipient calling json.dumps on the same payload.
+    """
+    return json.dumps(payload, separators=(',', ':'))
+
+
+def _pack_str(value):
+    encoded = str(value).encode()
+    if len(encoded) > 255:
+        raise ProtocolError("String field longer than 255 bytes")
+    return bytes([len(encoded)]) + encoded
+
+
+def _unpack_str(body, offset):
+    if offset >= len(body):
+        raise ProtocolError("Truncated string field")
+    length = body[offset]
+    end = offset + 1 + length
+    if end > len(body):
+        raise ProtocolError("Truncated string field")
+    return bytes(body[offset + 1:end]).decode(), end
+
+
+def pack(message):
+    """
+    Encode a message dict (the same shape JSON clients send) as a binary frame.
+    """
+    action = message.get('action')
+    tag = ACTION_TAGS.get(action)
+
+    if tag in CONTROL_TAGS:
+        return HEADER.pack(VERSION, tag)
+    if tag in SIGNALING_TAGS:
+        payload = {key: value for key, value in message.items() if key not in ('action', 'target')}
+        return HEADER.pack(VERSION, tag) + _pack_str(message['target']) + json.dumps(payload).encode()
+    if action == 'pose':
+        return HEADER.pack(VERSION, TAG_POSE) + POSE.pack(message['t'], *message['position'], *message['orientation'])
+    if action == 'gaze':
+        return HEADER.pack(VERSION, TAG_GAZE) + GAZE.pack(message['t'], *message['origin'], *message['direction'])
+    if action == 'interaction':
+        kind = INTERACTION_KINDS.index(message['kind'])
+        return HEADER.pack(VERSION, TAG_INTERACTION) + INTERACTION.pack(message['t'], kind) + _pack_str(message.get('target', ''))
+    return JSON_HEADER + json.dumps(message).encode()
+
+
+def unpack(frame):
+    """
+    Decode a binary frame into a message dict. Raises ProtocolError on
+    malformed or unsupported frames.
+    """
+    if len(frame) < HEADER.size:
+        raise ProtocolError("Frame shorter than its header")
+    version, tag = HEADER.unpack_from(frame)
+    if version != VERSION:
+        raise ProtocolError(f"Unsupported protocol version {version}")
+    body = memoryview(frame)[HEADER.size:]
+
+    try:
+        if tag in CONTROL_TAGS:
+            return {'action': CONTROL_TAGS[tag]}
+        if tag in SIGNALING_TAGS:
+            target, offset = _unpack_str(body, 0)
+            payload = json.loads(bytes(body[offset:])) if offset < len(body) else {}
+            return {**payload, 'action': SIGNALING_TAGS[tag], 'target': target}
+        if tag == TAG_POSE:
+            t, *values = POSE.unpack(body)
+            return {'action': 'pose', 't': t, 'position': values[:3], 'orientation': values[3:]}
+        if tag == TAG_GAZE:
+            t, *values = GAZE.unpack(body)
+            return {'action': 'gaze', 't': t, 'origin': values[:3], 'direction': values[3:]}
+        if tag == TAG_INTERACTION:
+            t, kind = INTERACTION.unpack_from(body)
+            target, _ = _unpack_str(body, INTERACTION.size)
+            return {'action': 'interaction', 't': t, 'kind': INTERACTION_KINDS[kind], 'target': target}
+        if tag == TAG_JSON:
+            message = json.loads(bytes(body))
+            if not isinstance(message, dict):
+                raise ProtocolError("JSON frame is not an object")
+            return message
+    except (struct.error, IndexError, UnicodeDecodeError, ValueError) as exc:
+        raise ProtocolError(f"Malformed frame (tag {tag:#x}): {exc}") from exc
+    raise ProtocolError(f"Unknown frame tag {tag:#x}")
+
+
+def wrap_json(text):
+    """
+    Turn an already-encoded JSON frame into a binary frame without re-serializing it.
+    """
+    return JSON_HEADER + text.encode()
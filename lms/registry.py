@@ -0,0 +1,33 @@
+# Per-session peer registry for addressed WebRTC signaling.
+#
+# Each worker process keeps its own copy. Consumers announce themselves to the
+# session group on connect (and existing peers answer the newcomer directly),
+# so peers connected to other workers are registered here as well.
+class PeerRegistry:
+    def __init__(self):
+        self._sessions = {}  # session id -> {peer id: channel name}
+
+    def register(self, session_id, peer_id, channel_name):
+        self._sessions.setdefault(session_id, {})[peer_id] = channel_name
+
+    def unregister(self, session_id, peer_id, channel_name=None):
+        peers = self._sessions.get(session_id)
+        if not peers:
+            return
+        # A reconnect may already have replaced the entry with a newer channel
+        if channel_name is None or peers.get(peer_id) == channel_name:
+            peers.pop(peer_id, None)
+        if not peers:
+            del self._sessions[session_id]
+
+    def lookup(self, session_id, peer_id):
+        return self._sessions.get(session_id, {}).get(peer_id)
+
+    def peers(self, session_id):
+        return list(self._sessions.get(session_id, {}))
+
+    def clear(self):
+        self._sessions.clear()
+
+
+peer_registry = PeerRegistry()
@@ -0,0 +1,106 @@
+# Cached responses of the school-scoped read endpoints.
+#
+# Entries are keyed by endpoint, school, user, host and the query parameters the
+# endpoint reads (others, like cache busters, don't split entries) plus the
+# generations of the scopes the response reads: the classes and users of a
+# school, or one student's progress. Signals (lms/signals.py) replace a scope's
+# generation whenever something it covers is written, so every entry built from
+# the old data stops matching at once; entries also expire after
+# LMS_RESPONSE_CACHE_TIMEOUT in case data changed without a signal (update()).
+# Generations live in the same cache alias as the entries, so with a shared
+# backend (LMS_RESPONSE_CACHE_DIR) a write in one worker invalidates all of them.
+import hashlib
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.utils.http import urlencode
+from rest_framework import status
+from rest_framework.response import Response
+
+CLASSES = 'classes'  # Classes of a school and their rosters
+USERS = 'users'  # Users of a school
+PROGRESS = 'progress'  # Progress of one student
+
+# Totals of this worker process; 'endpoints' has hits and misses per endpoint
+stats = {'hits': 0, 'misses': 0, 'invalidations': 0, 'endpoints': {}}
+
+
+def response_cache():
+    return caches[getattr(settings, 'LMS_RESPONSE_CACHE', 'default')]
+
+
+def _generation_key(scope, key):
+    return f'lms:response-generation:{scope}:{key}'
+
+
+def generations(*scopes):
+    """
+    Current generation of each (scope, key) pair. A missing one is seeded
+    with a fresh value, which only costs the entries built before it.
+    """
+    keys = [_generation_key(scope, key) for scope, key in scopes]
+    cache = response_cache()
+    current = cache.get_many(keys)
+    missing = [key for key in keys if key not in current]
+    if missing:
+        for key in missing:
+            cache.add(key, time.time_ns(), timeout=None)
+        current.update(cache.get_many(missing))
+    return [current.get(key) for key in keys]
+
+
+def invalidate(scope, *keys):
+    # Called from signals, maybe inside a transaction: bump now for reads in this transaction and again
+    # after the commit, so a concurrent request can't store the old rows under the new generation
+    keys = [key for key in keys if key is not None]
+    if not keys:
+        return
+
+    def bump():
+        now = time.time_ns()
+        response_cache().set_many({_generation_key(scope, key): now for key in keys}, timeout=None)
+
+    bump()
+    stats['invalidations'] += len(keys)
+    if connection.in_atomic_block:
+        transaction.on_commit(bump)
+
+
+def cache_key(endpoint, request, current, params):
+    query = urlencode(sorted((name, request.GET.getlist(name)) for name in params if name in request.GET), doseq=True)
+    # The host is part of the key because paginated responses carry absolute next/previous links
+    parts = [endpoint, request.user.school_id, request.user.pk, request.get_host(), current, query]
+    return 'lms:response:' + hashlib.sha256(repr(parts).encode()).hexdigest()
+
+
+def cached_response(endpoint, request, scopes, build, params=()):
+    """
+    The response of ``build()`` for this request, from the cache when the
+    scopes it reads haven't changed since it was stored. ``params`` are the
+    query parameters ``build()`` reads. Only 200 responses are stored;
+    ``X-Cache`` tells whether this one was a hit.
+    """
+    cache = response_cache()
+    key = cache_key(endpoint, request, generations(*scopes), params)
+    counts = stats['endpoints'].setdefault(endpoint, {'hits': 0, 'misses': 0})
+
+    data = cache.get(key)
+    if data is not None:
+        stats['hits'] += 1
+        counts['hits'] += 1
+        response = Response(data)
+        response['X-Cache'] = 'hit'
+        return response
+
+    stats['misses'] += 1
+    counts['misses'] += 1
+    response = build()
+    if response.status_code == status.HTTP_200_OK:
+        cache.set(key, response.data, timeout=getattr(settings, 'LMS_RESPONSE_CACHE_TIMEOUT', 300))
+    response['X-Cache'] = 'miss'
+    return response
+
+
+def reset_stats():
+    stats.update({'hits': 0, 'misses': 0, 'invalidations': 0, 'endpoints': {}})
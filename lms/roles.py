@@ -0,0 +1,53 @@
+# Role bitmask resolution. User.role_mask is the source of truth for permission
+# checks; it and User.role are kept in sync with the Admin/Teacher/Student groups.
+ROLE_ADMIN = 1
+ROLE_TEACHER = 2
+ROLE_STUDENT = 4
+
+ROLE_BITS = {
+    'admin': ROLE_ADMIN,
+    'teacher': ROLE_TEACHER,
+    'student': ROLE_STUDENT,
+}
+
+# Role <-> group name, in precedence order (a user in several groups gets the first match)
+ROLE_GROUPS = {
+    'admin': 'Admin',
+    'teacher': 'Teacher',
+    'student': 'Student',
+}
+GROUP_ROLES = {group: role for role, group in ROLE_GROUPS.items()}
+
+
+def role_from_groups(group_names):
+    """
+    Pick the role implied by a set of group names, or '' when the user is in
+    none of the role groups.
+    """
+    for role, group in ROLE_GROUPS.items():
+        if group in group_names:
+            return role
+    return ''
+
+
+def mask_from_groups(group_names):
+    # Bits of every role group in the set, so a teacher who is also an admin keeps both
+    mask = 0
+    for role, group in ROLE_GROUPS.items():
+        if group in group_names:
+            mask |= ROLE_BITS[role]
+    return mask
+
+
+def get_role_mask(request):
+    """
+    Compute the role bitmask once per request and cache it on the request, so
+    stacked permission classes share a single resolution.
+    """
+    mask = getattr(request, '_role_mask', None)
+    if mask is None:
+        # Users resolved through the token cache carry their mask on the principal
+        principal = getattr(request.user, 'principal', None)
+        mask = principal.role_mask if principal is not None else getattr(request.user, 'role_mask', 0)
+        request._role_mask = mask
+    return mask
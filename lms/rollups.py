@@ -0,0 +1,163 @@
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Coalesce
+from .models import Class, ClassRollup, Lesson, LessonRollup, Progress, SessionRollup
+
+# Score bands: (upper bound, column, label); scores outside 0-100 count in the outer bands
+BANDS = [
+    (20, 'scores_0_19', '0-19'),
+    (40, 'scores_20_39', '20-39'),
+    (60, 'scores_40_59', '40-59'),
+    (80, 'scores_60_79', '60-79'),
+    (None, 'scores_80_100', '80-100'),
+]
+COUNTER_FIELDS = ['progress_count', 'completed_count', 'score_sum'] + [column for _, column, _ in BANDS]
+
+
+def band(score):
+    for upper, column, _ in BANDS:
+        if upper is None or score < upper:
+            return column
+
+
+def contribution(score, completed):
+    # What one Progress row adds to every rollup it belongs to
+    return {'progress_count': 1, 'completed_count': int(bool(completed)), 'score_sum': score, band(score): 1}
+
+
+def apply_progress_changes(removed=(), added=()):
+    """
+    Fold Progress writes into the lesson, session and class rollups. Both
+    arguments are (student_id, lesson_id, score, completed) tuples: an update
+    removes the old values and adds the new ones, a create only adds, a delete
+    only removes.
+
+    The query count does not depend on how many rows changed: two lookups for
+    the sessions and classes involved, then per rollup model one locking read
+    of the touched rows and one upsert.
+    """
+    rows = [(row, -1) for row in removed] + [(row, 1) for row in added]
+    if not rows:
+        return
+
+    lessons = {
+        lesson_id: (session_id, school_id)
+        for lesson_id, session_id, school_id in Lesson.objects.filter(
+            id__in={row[1] for row, _ in rows}
+        ).values_list('id', 'session_id', 'school_id')
+    }
+    classes = {}
+    for student_id, class_id, school_id in Class.students.through.objects.filter(
+        user_id__in={row[0] for row, _ in rows}
+    ).values_list('user_id', 'class_id', 'class__school_id'):
+        classes.setdefault(student_id, []).append((class_id, school_id))
+
+    deltas = {}  # rollup model -> {pk: (school id, {column: delta})}
+
+    def collect(model, pk, school_id, values, sign):
+        _, columns = deltas.setdefault(model, {}).setdefault(pk, (school_id, {}))
+        for column, value in values.items():
+            columns[column] = columns.get(column, 0) + sign * value
+
+    for (student_id, lesson_id, score, completed), sign in rows:
+        if lesson_id not in lessons:
+            # The lesson is being deleted along with its rollup
+            continue
+        session_id, school_id = lessons[lesson_id]
+        values = contribution(score, completed)
+        collect(LessonRollup, lesson_id, school_id, values, sign)
+        collect(SessionRollup, session_id, school_id, values, sign)
+        for class_id, class_school_id in classes.get(student_id, []):
+            collect(ClassRollup, class_id, class_school_id, values, sign)
+
+    with transaction.atomic(savepoint=False):
+        for model, changes in deltas.items():
+            changes = {pk: change for pk, change in changes.items() if any(change[1].values())}
+            if not changes:
+                continue
+            current = model.objects.select_for_update().in_bulk(list(changes))
+            updated = []
+            for pk, (school_id, columns) in changes.items():
+                rollup = current.get(pk)
+                if rollup is None:
+                    if columns.get('progress_count', 0) <= 0:
+                        # Nothing to subtract from: never rolled up (see rebuild_rollups)
+                        continue
+                    rollup = model(pk=pk, school_id=school_id)
+                for column, delta in columns.items():
+                    setattr(rollup, column, getattr(rollup, column) + delta)
+                updated.append(rollup)
+            model.objects.bulk_create(
+                updated,
+                update_conflicts=True,
+                unique_fields=[model._meta.pk.name],
+                update_fields=COUNTER_FIELDS + ['updated_at'],
+            )
+
+
+def rollup_aggregates():
+    """
+    Aggregate expressions over Progress that produce every rollup counter.
+    """
+    aggregates = {
+        'progress_count': Count('id'),
+        'completed_count': Count('id', filter=Q(completed=True)),
+        'score_sum': Coalesce(Sum('score'), 0),
+    }
+    lower = None
+    for upper, column, _ in BANDS:
+        condition = Q()
+        if lower is not None:
+            condition &= Q(score__gte=lower)
+        if upper is not None:
+            condition &= Q(score__lt=upper)
+        aggregates[column] = Count('id', filter=condition)
+        lower = upper
+    return aggregates
+
+
+def compute_rollups(school_id=None, class_ids=None):
+    """
+    Aggregate the rollups on the fly from Progress: {rollup model: {pk: values}}.
+    With class_ids only those class rollups are computed.
+    """
+    progress = Progress.objects.all()
+    if school_id is not None:
+        progress = progress.filter(school_id=school_id)
+    aggregates = rollup_aggregates()
+
+    # Values for one group, keyed the way the rollup model expects
+    def group(queryset, key, school):
+        return {
+            row.pop(key): {'school_id': row.pop(school), **row}
+            for row in queryset.values(key, school).annotate(**aggregates).order_by()
+            if row[key] is not None
+        }
+
+    result = {}
+    if class_ids is None:
+        result[LessonRollup] = group(progress, 'lesson_id', 'lesson__school_id')
+        result[SessionRollup] = group(progress, 'lesson__session_id', 'lesson__session__school_id')
+        in_class = progress.filter(student__student_classes__isnull=False)
+    else:
+        in_class = progress.filter(student__student_classes__in=class_ids)
+    result[ClassRollup] = group(in_class, 'student__student_classes', 'student__student_classes__school_id')
+    return result
+
+
+def rebuild_rollups(school_id=None, class_ids=None):
+    """
+    Replace the stored rollups (all of them, one school's, or the given
+    classes') with freshly aggregated ones. Returns the row count per model.
+    """
+    computed = compute_rollups(school_id, class_ids)
+    with transaction.atomic():
+        for model, rows in computed.items():
+            stale = model.objects.all()
+            if school_id is not None:
+                stale = stale.filter(school_id=school_id)
+            if model is ClassRollup and class_ids is not None:
+                stale = stale.filter(pk__in=class_ids)
+            stale.delete()
+            model.objects.bulk_create([model(pk=pk, **values) for pk, values in rows.items()], batch_size=500)
+    return {model.__name__: len(rows) for model, rows in computed.items()}
@@ -0,0 +1,77 @@
+# Incremental updates to Progress.progress_data (SCORM CMI state).
+#
+# progress_data is stored as nested JSON: "cmi.interactions.0.result" lives at
+# data["cmi"]["interactions"][0]["result"]. Numeric path segments index lists.
+
+
+class PatchError(ValueError):
+    pass
+
+
+def merge_patch(target, patch):
+    """
+    Apply an RFC 7386 JSON Merge Patch and return the result. Objects are
+    merged recursively, null removes a key, anything else replaces the value.
+    """
+    if not isinstance(patch, dict):
+        return patch
+    result = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = merge_patch(result.get(key), value)
+    return result
+
+
+def set_cmi_elements(data, elements):
+    """
+    Set CMI data-model elements by dotted path, e.g.
+    {"cmi.interactions.0.result": "correct", "cmi.suspend_data": "..."}.
+    Missing objects are created; a list index may address an existing entry or
+    append one (index == length), as CMI collections grow by one element at a time.
+    """
+    data = data if isinstance(data, dict) else {}
+    for path, value in elements.items():
+        segments = path.split('.')
+        if segments[0] != 'cmi' or not all(segments):
+            raise PatchError(f"{path!r} is not a cmi.* element path")
+
+        node = data
+        for segment, next_segment in zip(segments, segments[1:]):
+            child_default = [] if next_segment.isdigit() else {}
+            node = _child(node, segment, child_default, path)
+        _assign(node, segments[-1], value, path)
+    return data
+
+
+def _child(node, segment, default, path):
+    if isinstance(node, list):
+        index = _index(node, segment, path)
+        if index == len(node):
+            node.append(default)
+        return node[index]
+    existing = node.get(segment)
+    if not isinstance(existing, (dict, list)):
+        node[segment] = existing = default
+    return existing
+
+
+def _assign(node, segment, value, path):
+    if isinstance(node, list):
+        index = _index(node, segment, path)
+        if index == len(node):
+            node.append(value)
+        else:
+            node[index] = value
+    else:
+        node[segment] = value
+
+
+def _index(node, segment, path):
+    if not segment.isdigit():
+        raise PatchError(f"{path!r}: {segment!r} indexes a collection and must be a number")
+    index = int(segment)
+    if index > len(node):
+        raise PatchError(f"{path!r}: index {index} skips entries (collection has {len(node)})")
+    return index
@@ -1,8 +1,61 @@
 from rest_framework import serializers
 from .models import User, School, Class, Session, Lesson, Progress
+from .rollups import BANDS
+
+
+def query_params(request):
+    # DRF requests have query_params, plain Django ones only GET
+    params = getattr(request, 'query_params', None)
+    return request.GET if params is None else params
+
+
+def requested_fields(names, request):
+    # Field names kept by ?fields=a,b and ?exclude=c; unknown names are an error
+    kept = list(names)
+    for param in ('fields', 'exclude'):
+        value = query_params(request).get(param)
+        if not value:
+            continue
+        listed = {name.strip() for name in value.split(',') if name.strip()}
+        unknown = listed - set(names)
+        if unknown:
+            raise serializers.ValidationError({param: f"Unknown fields: {', '.join(sorted(unknown))}"})
+        kept = [name for name in kept if (name in listed) == (param == 'fields')]
+    return kept
+
+
+# Sparse fieldsets: with the request in its context, a serializer used at the top level of a
+# response (directly or as the child of a list) keeps only the fields picked by ?fields=/?exclude=
+class SparseFieldsetMixin:
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        top = self.parent.parent if isinstance(self.parent, serializers.ListSerializer) else self.parent
+        if request is None or top is not None:
+            return fields
+        return {name: fields[name] for name in requested_fields(fields, request)}
+
+
+def project_queryset(queryset, serializer_class, request):
+    """
+    Defer the model columns none of the serializer's kept fields read, so
+    ?fields=/?exclude= also shrink the SELECT. Foreign keys are only deferred
+    when the queryset doesn't select_related them.
+    """
+    params = query_params(request)
+    if not (params.get('fields') or params.get('exclude')):
+        return queryset
+    fields = serializer_class(context={'request': request}).fields.values()
+    sources = {field.source.split('.')[0] for field in fields if field.source != '*'}
+    deferred = [
+        field.name for field in queryset.model._meta.concrete_fields
+        if not field.primary_key and field.name not in sources and field.attname not in sources
+        and not (field.is_relation and queryset.query.select_related)
+    ]
+    return queryset.defer(*deferred) if deferred else queryset
 
 # User serializer for nickname and PIN authentication
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     school = serializers.CharField(source='school.name', read_only=True)
 
     class Meta:
@@ -10,13 +63,13 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ['id', 'nickname', 'school', 'is_staff', 'is_active']
 
 # School Serializer
-class SchoolSerializer(serializers.ModelSerializer):
+class SchoolSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = School
         fields = ['id', 'name']
 
 # Class Serializer
-class ClassSerializer(serializers.ModelSerializer):
+class ClassSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     teacher = UserSerializer()
     students = UserSerializer(many=True)  # Include students
 
@@ -24,20 +77,63 @@ class ClassSerializer(serializers.ModelSerializer):
         model = Class
         fields = ['id', 'name', 'teacher', 'students']  # Adjust fields as necessary
 
+# Class Serializer for ?roster=summary (expects a student_count annotation)
+class ClassSummarySerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    teacher = serializers.IntegerField(source='teacher_id', read_only=True)
+    student_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Class
+        fields = ['id', 'name', 'teacher', 'student_count']
+
 # Lesson Serializer
-class LessonSerializer(serializers.ModelSerializer):
+class LessonSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = Lesson
-        fields = ['id', 'title', 'content', 'lesson_class']
+        fields = ['id', 'title', 'content', 'lesson_class', 'package']
+        extra_kwargs = {'package': {'read_only': True}}  # SHA-256; uploaded through the package endpoint
 
 # Session Serializer
-class SessionSerializer(serializers.ModelSerializer):
+class SessionSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = Session
         fields = ['id', 'title', 'teacher', 'is_active', 'is_paused', 'created_at', 'started_at', 'stopped_at']
 
 # Progress Serializer
-class ProgressSerializer(serializers.ModelSerializer):
+class ProgressSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    class Meta:
+        model = Progress
+        fields = ['id', 'student', 'lesson', 'score', 'completed', 'progress_data', 'version', 'updated_at']
+
+# Progress list without the SCORM blob (?progress_data=false)
+class ProgressSummarySerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = Progress
-        fields = ['id', 'student', 'lesson', 'score', 'completed', 'progress_data']
+        fields = ['id', 'student', 'lesson', 'score', 'completed', 'version', 'updated_at']
+
+# One record of a bulk progress upsert; records replace the stored score, completion and SCORM data
+class ProgressRecordSerializer(serializers.Serializer):
+    lesson = serializers.IntegerField()
+    student = serializers.IntegerField(required=False)  # Teachers only; students always write their own
+    score = serializers.IntegerField()
+    completed = serializers.BooleanField()
+    progress_data = serializers.JSONField(allow_null=True)
+
+# Delta update of one progress row: only the changed parts of the SCORM data travel
+class ProgressPatchSerializer(serializers.Serializer):
+    version = serializers.IntegerField(min_value=0)  # Version the client last saw, 0 for a new row
+    merge = serializers.DictField(required=False)  # JSON Merge Patch applied to progress_data
+    set = serializers.DictField(child=serializers.JSONField(), required=False)  # CMI element path -> value
+    score = serializers.IntegerField(required=False)
+    completed = serializers.BooleanField(required=False)
+
+# Counters of a lesson, session or class rollup plus the rates derived from them
+class RollupSerializer(serializers.Serializer):
+    progress_count = serializers.IntegerField()
+    completed_count = serializers.IntegerField()
+    average_score = serializers.FloatField()
+    completion_rate = serializers.FloatField()
+    score_distribution = serializers.SerializerMethodField()
+
+    def get_score_distribution(self, rollup):
+        return {label: getattr(rollup, column) for _, column, label in BANDS}
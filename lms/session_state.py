@@ -0,0 +1,261 @@
+import asyncio
+import logging
+import threading
+import time
+from django.conf import settings
+from django.db import DatabaseError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import Session
+
+logger = logging.getLogger(__name__)
+
+# Columns owned by the state store
+STATE_FIELDS = ['is_active', 'is_paused', 'started_at', 'stopped_at', 'seq']
+
+
+class SessionState:
+    __slots__ = ['session_id', 'teacher_id', 'school_id', 'is_active', 'is_paused', 'started_at', 'stopped_at', 'seq']
+
+    def __init__(self, session_id, teacher_id, school_id, is_active, is_paused, started_at, stopped_at, seq=0):
+        self.session_id = session_id
+        self.teacher_id = teacher_id
+        self.school_id = school_id
+        self.is_active = is_active
+        self.is_paused = is_paused
+        self.started_at = started_at
+        self.stopped_at = stopped_at
+        self.seq = seq
+
+    def snapshot(self):
+        return {
+            "is_active": self.is_active,
+            "is_paused": self.is_paused,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "stopped_at": self.stopped_at.isoformat() if self.stopped_at else None,
+            "seq": self.seq,
+        }
+
+
+class SessionStateStore:
+    """
+    Authoritative live state for sessions in this process. Control actions are
+    answered from memory; changed columns are written back with update_fields
+    after LMS_SESSION_FLUSH_DELAY seconds, so rapid start/pause toggles collapse
+    into a single UPDATE.
+
+    Every control broadcast carries the new state and its sequence number, and
+    consumers feed it to observe(), which keeps the stores of other worker
+    processes in step. The sequence is a hybrid clock stored with the row: each
+    change takes max(seq + 1, wall clock in µs), so a worker that just loaded
+    the session still outranks one holding an older change, and a write never
+    replaces a row with a higher seq. A session is only kept while it has
+    sockets on this worker and is not stopped; the next use loads it from the
+    database again.
+    """
+
+    def __init__(self):
+        self._states = {}  # session id -> SessionState
+        self._dirty = {}  # session id -> set of changed columns
+        self._flush_tasks = {}  # session id -> pending write-behind task
+        self._lock = threading.Lock()  # flush_pending() runs outside the event loop's thread
+
+    def _from_values(self, session_id, values):
+        return SessionState(
+            session_id, values['teacher_id'], values['school_id'], values['is_active'],
+            values['is_paused'], values['started_at'], values['stopped_at'], values['seq'],
+        )
+
+    async def get(self, session_id):
+        """
+        Return the live state, loading it from the database on first use.
+        Raises Session.DoesNotExist for unknown sessions.
+        """
+        state = self._states.get(session_id)
+        if state is None:
+            values = await Session.objects.filter(pk=session_id).values(
+                'teacher_id', 'school_id', *STATE_FIELDS
+            ).afirst()
+            if values is None:
+                raise Session.DoesNotExist(f"Session {session_id} does not exist")
+            with self._lock:
+                state = self._states.setdefault(session_id, self._from_values(session_id, values))
+        return state
+
+    def _transition(self, state, action):
+        # Apply a control action in memory; returns the changed columns
+        changed = set()
+
+        def assign(field, value):
+            if getattr(state, field) != value:
+                setattr(state, field, value)
+                changed.add(field)
+
+        if action == 'start':
+            if not state.is_active:
+                assign('started_at', timezone.now())
+            assign('is_active', True)
+            assign('is_paused', False)
+        elif action == 'pause':
+            if state.is_active:
+                assign('is_paused', True)
+        elif action == 'stop':
+            if state.is_active:
+                assign('stopped_at', timezone.now())
+            assign('is_active', False)
+            assign('is_paused', False)
+        else:
+            raise ValueError(f"Unknown session action {action!r}")
+
+        # A start or stop outranks whatever came before even when our view already matches it,
+        # since another worker may still hold (and be about to write) a different state
+        if changed or action != 'pause':
+            # Microseconds stay exact in JSON numbers, which clients may parse as doubles
+            state.seq = max(state.seq + 1, time.time_ns() // 1000)
+            changed.add('seq')
+        return changed
+
+    async def apply(self, session_id, action):
+        """
+        Apply a control action without touching the database; the write is
+        scheduled in the background.
+        """
+        state = await self.get(session_id)
+        with self._lock:
+            changed = self._transition(state, action)
+            if changed:
+                self._dirty.setdefault(session_id, set()).update(changed)
+        if changed and action == 'stop':
+            # Written now and dropped: a stopped session needs no live state
+            await self.evict(session_id)
+        elif changed and session_id not in self._flush_tasks:
+            self._flush_tasks[session_id] = asyncio.ensure_future(self._flush_later(session_id))
+        return state
+
+    def _seed(self, session):
+        """
+        State for a session just loaded from the database; call with the lock
+        held. The row wins when another worker wrote a newer change than the
+        one we remember.
+        """
+        values = {field: getattr(session, field) for field in STATE_FIELDS}
+        state = self._states.get(session.pk)
+        if state is None:
+            state = self._states[session.pk] = self._from_values(session.pk, {
+                'teacher_id': session.teacher_id,
+                'school_id': session.school_id,
+                **values,
+            })
+        elif values['seq'] > state.seq:
+            for field, value in values.items():
+                setattr(state, field, value)
+            self._dirty.pop(session.pk, None)
+        return state
+
+    async def apply_now(self, session, action):
+        """
+        Apply a control action from async code that has already loaded the
+        session (the REST views); the changed columns are written before returning.
+        """
+        with self._lock:
+            state = self._seed(session)
+            changed = self._transition(state, action)
+            if changed:
+                self._dirty.setdefault(session.pk, set()).update(changed)
+        # Also writes anything still pending from the write-behind path
+        await self.flush(session.pk)
+        for field in STATE_FIELDS:
+            setattr(session, field, getattr(state, field))
+        if action == 'stop':
+            self._drop(session.pk)
+        return state
+
+    def observe(self, session_id, snapshot):
+        """
+        Adopt a state broadcast by another consumer (possibly in another
+        worker process) when it is newer than ours. Nothing is persisted: the
+        worker that made the change writes it.
+        """
+        state = self._states.get(session_id)
+        if state is None:
+            return
+        with self._lock:
+            if snapshot["seq"] > state.seq:
+                state.is_active = snapshot["is_active"]
+                state.is_paused = snapshot["is_paused"]
+                state.started_at = parse_datetime(snapshot["started_at"]) if snapshot["started_at"] else None
+                state.stopped_at = parse_datetime(snapshot["stopped_at"]) if snapshot["stopped_at"] else None
+                state.seq = snapshot["seq"]
+
+    async def _flush_later(self, session_id):
+        await asyncio.sleep(getattr(settings, 'LMS_SESSION_FLUSH_DELAY', 0.25))
+        await self.flush(session_id)
+
+    async def flush(self, session_id):
+        """
+        Write the columns changed since the last flush, using the latest values.
+        """
+        task = self._flush_tasks.pop(session_id, None)
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+
+        with self._lock:
+            changed = self._dirty.pop(session_id, None)
+            state = self._states.get(session_id)
+            if not changed or state is None:
+                return
+            values = {field: getattr(state, field) for field in changed | {'seq'}}
+
+        try:
+            # Not over a newer change another worker already wrote
+            await Session.objects.filter(pk=session_id, seq__lt=values['seq']).aupdate(**values)
+        except DatabaseError:
+            logger.exception(f"Could not persist state of session {session_id}")
+
+    async def flush_all(self):
+        for session_id in list(self._dirty):
+            await self.flush(session_id)
+
+    def flush_pending(self):
+        """
+        Write every pending change synchronously, for process exit (see
+        LmsConfig.ready) when the event loop that owns the flush tasks is gone.
+        """
+        with self._lock:
+            pending = [
+                (session_id, {field: getattr(self._states[session_id], field) for field in changed | {'seq'}})
+                for session_id, changed in self._dirty.items() if session_id in self._states
+            ]
+            self._dirty.clear()
+            self._flush_tasks.clear()
+        for session_id, values in pending:
+            try:
+                Session.objects.filter(pk=session_id, seq__lt=values['seq']).update(**values)
+            except DatabaseError:
+                logger.exception(f"Could not persist state of session {session_id}")
+        return len(pending)
+
+    def clear(self):
+        for task in self._flush_tasks.values():
+            task.cancel()
+        with self._lock:
+            self._states.clear()
+            self._dirty.clear()
+            self._flush_tasks.clear()
+
+    async def evict(self, session_id):
+        """
+        Write pending changes and drop the session's state, when it is stopped
+        or the last socket on this worker has left.
+        """
+        await self.flush(session_id)
+        self._drop(session_id)
+
+    def _drop(self, session_id):
+        with self._lock:
+            # A change made while the flush was running keeps the state until it is written
+            if session_id not in self._dirty:
+                self._states.pop(session_id, None)
+
+
+session_states = SessionStateStore()
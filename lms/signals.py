@@ -0,0 +1,151 @@
+from functools import partial
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+from .authentication import invalidate_token, invalidate_user, token_cache
+from .models import Class, Progress, School, User
+from .progress import bump_progress_version
+from .response_cache import CLASSES, PROGRESS, USERS, invalidate
+from .roles import GROUP_ROLES, ROLE_BITS, ROLE_GROUPS, mask_from_groups, role_from_groups
+from .rollups import apply_progress_changes, rebuild_rollups
+
+# Progress columns that feed the analytics rollups
+ROLLUP_SOURCE_FIELDS = {'student', 'lesson', 'score', 'completed'}
+
+
+def sync_role_from_groups(user_ids):
+    # Recompute User.role and User.role_mask from role-group membership for the given users
+    memberships = {user_id: set() for user_id in user_ids}
+    rows = User.groups.through.objects.filter(
+        user_id__in=user_ids, group__name__in=ROLE_GROUPS.values()
+    ).values_list('user_id', 'group__name')
+    for user_id, group_name in rows:
+        memberships[user_id].add(group_name)
+
+    # One UPDATE per resulting (role, mask); update() skips post_save, so callers invalidate the token cache
+    by_role = {}
+    for user_id, group_names in memberships.items():
+        by_role.setdefault((role_from_groups(group_names), mask_from_groups(group_names)), []).append(user_id)
+    for (role, mask), ids in by_role.items():
+        User.objects.filter(pk__in=ids).exclude(role=role, role_mask=mask).update(role=role, role_mask=mask)
+    return memberships
+
+
+# Token cache invalidation: tokens deleted, users saved or deleted, group membership changed
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    invalidate_token(instance.key)
+
+
+@receiver(pre_save, sender=User)
+def user_saving(sender, instance, update_fields=None, **kwargs):
+    # Remember the school the user is leaving, if any
+    instance._previous_school_id = None
+    if instance.pk is not None and (update_fields is None or {'school', 'school_id'} & set(update_fields)):
+        instance._previous_school_id = User.objects.filter(pk=instance.pk).values_list('school_id', flat=True).first()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
+    # Cached user lists and class rosters of the school show the user, as did those of the school it left
+    school_ids = {instance.school_id, getattr(instance, '_previous_school_id', None)}
+    invalidate(USERS, *school_ids)
+    invalidate(CLASSES, *school_ids)
+
+
+# Class rosters and user lists show the school's name
+@receiver(post_save, sender=School)
+@receiver(post_delete, sender=School)
+def school_changed(sender, instance, **kwargs):
+    invalidate(CLASSES, instance.pk)
+    invalidate(USERS, instance.pk)
+
+
+# Cached class lists of the school
+@receiver(post_save, sender=Class)
+@receiver(post_delete, sender=Class)
+def class_changed(sender, instance, **kwargs):
+    invalidate(CLASSES, instance.school_id)
+
+
+# Conditional GETs of /api/results/ revalidate against the student's progress version
+@receiver(post_save, sender=Progress)
+@receiver(post_delete, sender=Progress)
+def progress_changed(sender, instance, **kwargs):
+    invalidate(PROGRESS, instance.student_id)
+    # The version only once the write is visible, or a poll racing the transaction would pair the new ETag with the old rows
+    transaction.on_commit(partial(bump_progress_version, instance.student_id))
+
+
+# Analytics rollups: Progress saved through the ORM (bulk paths in lms.progress update them directly)
+@receiver(pre_save, sender=Progress)
+def progress_saving(sender, instance, update_fields=None, **kwargs):
+    # Remember what the row contributed before this save
+    instance._rollup_skip = update_fields is not None and not ROLLUP_SOURCE_FIELDS & set(update_fields)
+    instance._rollup_previous = None
+    if instance.pk is not None and not instance._rollup_skip:
+        instance._rollup_previous = (
+            Progress.objects.filter(pk=instance.pk).values_list('student_id', 'lesson_id', 'score', 'completed').first()
+        )
+
+
+@receiver(post_save, sender=Progress)
+def progress_saved(sender, instance, **kwargs):
+    if getattr(instance, '_rollup_skip', False):
+        return
+    previous = getattr(instance, '_rollup_previous', None)
+    apply_progress_changes(
+        removed=[previous] if previous else [],
+        added=[(instance.student_id, instance.lesson_id, instance.score, instance.completed)],
+    )
+
+
+@receiver(post_delete, sender=Progress)
+def progress_deleted(sender, instance, **kwargs):
+    apply_progress_changes(removed=[(instance.student_id, instance.lesson_id, instance.score, instance.completed)])
+
+
+@receiver(m2m_changed, sender=Class.students.through)
+def class_students_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # Class rollups cover the class's students, so membership changes recompute them
+    if action == 'pre_clear' and reverse:
+        instance._rollup_classes = list(instance.student_classes.values_list('pk', flat=True))
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        rebuild_rollups(class_ids=[instance.pk])
+        invalidate(CLASSES, instance.school_id)
+        return
+    class_ids = list(pk_set) if pk_set else getattr(instance, '_rollup_classes', None)
+    if class_ids:
+        rebuild_rollups(class_ids=class_ids)
+        invalidate(CLASSES, *set(Class.objects.filter(pk__in=class_ids).values_list('school_id', flat=True)))
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def user_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        # user.groups.add(...) / remove / clear
+        memberships = sync_role_from_groups([instance.pk])
+        instance.role = role_from_groups(memberships[instance.pk])
+        instance.role_mask = mask_from_groups(memberships[instance.pk])
+        invalidate_user(instance.pk)
+    elif pk_set:
+        # group.user_set.add(...) / remove
+        sync_role_from_groups(list(pk_set))
+        for user_id in pk_set:
+            invalidate_user(user_id)
+    else:
+        # group.user_set.clear() does not report which users were affected
+        if instance.name in ROLE_GROUPS.values():
+            bit = ROLE_BITS[GROUP_ROLES[instance.name]]
+            stale = User.objects.alias(bit=F('role_mask').bitand(bit)).filter(bit=bit).values_list('pk', flat=True)
+            sync_role_from_groups(list(stale))
+        token_cache.clear()
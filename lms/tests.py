@@ -1,13 +1,58 @@
-from django.test import TestCase
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+from importlib import import_module
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.exceptions import ChannelFull
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, connections
+from django.db.models import F
+from django.db.models.signals import pre_save
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
-from rest_framework.test import APIClient
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
 from django.contrib.auth.models import Group
-from .models import User, Lesson, Progress, School, Session
+from .models import User, Lesson, LessonPackage, Progress, School, Session, Class, InteractionEvent, LessonRollup, SessionRollup, ClassRollup
 from rest_framework.authtoken.models import Token
+from .caching import LRUTTLCache
+from .permissions import IsStudent
+from .roles import ROLE_ADMIN, ROLE_TEACHER
+from . import outbound, protocol
+from .layers import LayerBroker, UnixSocketChannelLayer
+from .routing import websocket_urlpatterns
+from .consumers import SessionConsumer
+from .session_state import SessionState, SessionStateStore, session_states
+from .clock import ClockEstimate, clock_registry, now_ms
+from .dpvr_control import DeviceError, DPVRController, SimulatedBackend, dpvr_controller
+from .registry import peer_registry
+from .presence import presence_registry
+from .authentication import token_cache
+from .rollups import COUNTER_FIELDS, compute_rollups, rebuild_rollups
+from .urls import urlpatterns
+from .views import AdminUserListView, ClassListView
+from .ingest import event_buffer
+from .progress import bulk_upsert_progress, patch_progress
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from .packages import package_path, store_package
+from .response_cache import response_cache, reset_stats, stats as response_stats
+from io import StringIO
 
 class ProgressViewTestCase(TestCase):
     def setUp(self):
+        cache.clear()
+        response_cache().clear()
+
         # Create the Student group if it doesn't exist
         student_group, created = Group.objects.get_or_create(name='Student')
 
@@ -74,6 +119,1832 @@ class ProgressViewTestCase(TestCase):
         # Test fetching progress data
         response = self.client.get(reverse('progress'))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['score'], 85)
-        self.assertEqual(response.data[0]['completed'], True)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['score'], 85)
+        self.assertEqual(response.data['results'][0]['completed'], True)
+
+    def test_unchanged_progress_returns_not_modified(self):
+        response = self.client.get(reverse('progress'))
+        etag = response['ETag']
+        self.assertNotIn('Last-Modified', response)
+
+        # Token and version both come from caches: no query at all
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('progress'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # A different query string is a different representation
+        response = self.client.get(reverse('progress'), {'progress_data': 'false'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_progress_writes_change_the_etag(self):
+        etag = self.client.get(reverse('progress'))['ETag']
+        self.client.patch(reverse('progress-patch', args=[self.lesson.pk]), {'version': 1, 'score': 90}, format='json')
+
+        response = self.client.get(reverse('progress'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0]['score'], 90)
+
+        etag = response['ETag']
+        self.client.post(reverse('progress-bulk'), {'records': [
+            {'lesson': self.lesson.pk, 'score': 95, 'completed': True, 'progress_data': None},
+        ]}, format='json')
+        response = self.client.get(reverse('progress'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        etag = response['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.progress.delete()
+        self.assertEqual(self.client.get(reverse('progress'), HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+    def test_pagination_and_omitting_progress_data(self):
+        second = Lesson.objects.create(title='Second', content='', school=self.school, session=self.session)
+        Progress.objects.create(student=self.student_user, lesson=second, school=self.school, progress_data={'cmi': {}})
+
+        response = self.client.get(reverse('progress'), {'page_size': 1, 'progress_data': 'false'})
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertNotIn('progress_data', response.data['results'][0])
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual(response.data['results'][0]['lesson'], second.pk)
+        self.assertIsNone(response.data['next'])
+
+
+class ClassListViewTestCase(TestCase):
+    def setUp(self):
+        self.school = School.objects.create(name='Test School')
+        self.teacher = User.objects.create(username='teacher', nickname='teacher', pin='0000', school=self.school)
+        self.student = User.objects.create(username='student', nickname='student', pin='1234', school=self.school)
+        self.student_count = 0
+
+        self.client = APIClient()
+        token = Token.objects.create(user=self.student)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def add_classes(self, count, students_per_class):
+        # Enroll the authenticated student plus extra classmates in each new class
+        for i in range(count):
+            school_class = Class.objects.create(school=self.school, name=f'Class {i}', teacher=self.teacher)
+            classmates = []
+            for j in range(students_per_class):
+                self.student_count += 1
+                classmates.append(User.objects.create(
+                    username=f'classmate{self.student_count}',
+                    nickname=f'classmate{self.student_count}',
+                    pin='1234',
+                    school=self.school,
+                ))
+            school_class.students.add(self.student, *classmates)
+
+    def test_class_list_query_count_is_constant(self):
+        # Warm the token cache, then: class page + students prefetch, whatever the roster size
+        self.client.get(reverse('classes'))
+        self.add_classes(2, 2)
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('classes'))
+        self.assertEqual(len(response.data['results']), 2)
+
+        self.add_classes(10, 30)
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('classes'), {'page_size': 100})
+        self.assertEqual(len(response.data['results']), 12)
+        self.assertEqual(len(response.data['results'][-1]['students']), 31)
+        self.assertEqual(response.data['results'][-1]['teacher']['school'], 'Test School')
+
+    def test_class_list_summary_mode(self):
+        self.add_classes(5, 30)
+        self.client.get(reverse('classes'))
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('classes'), {'roster': 'summary'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([c['student_count'] for c in response.data['results']], [31] * 5)
+        self.assertNotIn('students', response.data['results'][0])
+
+    def test_class_list_cursor_pagination(self):
+        self.add_classes(3, 1)
+        response = self.client.get(reverse('classes'), {'page_size': 2})
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIsNotNone(response.data['next'])
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertIsNone(response.data['next'])
+
+    def test_class_list_excludes_other_schools(self):
+        self.add_classes(1, 1)
+        other_school = School.objects.create(name='Other School')
+        other_class = Class.objects.create(school=other_school, name='Elsewhere', teacher=self.teacher)
+        other_class.students.add(self.student)
+
+        response = self.client.get(reverse('classes'))
+        self.assertEqual([c['name'] for c in response.data['results']], ['Class 0'])
+
+
+class CachedTokenAuthenticationTestCase(TestCase):
+    def setUp(self):
+        self.school = School.objects.create(name='Test School')
+        self.teacher = User.objects.create(username='teacher', nickname='teacher', pin='0000', school=self.school)
+        self.teacher.groups.add(Group.objects.get_or_create(name='Teacher')[0])
+        self.token = Token.objects.create(user=self.teacher)
+
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def create_session(self):
+        return self.client.post(reverse('create-session'), {'title': 'Cached'})
+
+    def test_repeat_requests_skip_token_and_group_queries(self):
+        # Miss: token, then the insert
+        with self.assertNumQueries(2):
+            self.assertEqual(self.create_session().status_code, status.HTTP_201_CREATED)
+        # Hit: only the view's own query remains
+        with self.assertNumQueries(1):
+            self.assertEqual(self.create_session().status_code, status.HTTP_201_CREATED)
+
+    def test_token_deletion_invalidates(self):
+        self.create_session()
+        self.token.delete()
+        self.assertEqual(self.create_session().status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_group_change_invalidates(self):
+        self.create_session()
+        self.teacher.groups.clear()
+        self.assertEqual(self.create_session().status_code, status.HTTP_403_FORBIDDEN)
+
+        Group.objects.get(name='Teacher').user_set.add(self.teacher)
+        self.assertEqual(self.create_session().status_code, status.HTTP_201_CREATED)
+
+    def test_user_save_invalidates(self):
+        self.create_session()
+        self.teacher.is_active = False
+        self.teacher.save()
+        self.assertEqual(self.create_session().status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_cache_is_bounded_and_expires(self):
+        now = [0]
+        cache = LRUTTLCache(maxsize=2, ttl=10, timer=lambda: now[0])
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)  # Evicts 'b', the least recently used
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+
+        now[0] = 10
+        self.assertIsNone(cache.get('c'))
+
+
+class RoleResolutionTestCase(TestCase):
+    def setUp(self):
+        self.school = School.objects.create(name='Test School')
+        self.teacher_group = Group.objects.get_or_create(name='Teacher')[0]
+        self.student_group = Group.objects.get_or_create(name='Student')[0]
+        self.user = User.objects.create(username='user', nickname='user', pin='0000', school=self.school)
+
+    def test_role_follows_group_membership(self):
+        self.user.groups.add(self.teacher_group)
+        self.assertEqual(User.objects.get(pk=self.user.pk).role, 'teacher')
+
+        self.user.groups.remove(self.teacher_group)
+        self.assertEqual(User.objects.get(pk=self.user.pk).role, '')
+
+        self.student_group.user_set.add(self.user)
+        self.assertEqual(User.objects.get(pk=self.user.pk).role, 'student')
+
+    def test_mask_covers_every_role_group(self):
+        admin_group = Group.objects.get_or_create(name='Admin')[0]
+        self.user.groups.add(admin_group, self.teacher_group)
+        user = User.objects.get(pk=self.user.pk)
+        self.assertEqual((user.role, user.role_mask), ('admin', ROLE_ADMIN | ROLE_TEACHER))
+
+        # An admin who also teaches can still create sessions
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.user).key}')
+        self.assertEqual(client.post(reverse('create-session'), {'title': 'Both'}).status_code, status.HTTP_201_CREATED)
+
+        admin_group.user_set.clear()
+        self.assertEqual(User.objects.get(pk=self.user.pk).role_mask, ROLE_TEACHER)
+
+    def test_users_without_groups_have_no_role(self):
+        request = type('Request', (), {'user': User.objects.get(pk=self.user.pk)})()
+        self.assertEqual(self.user.role, '')
+        self.assertFalse(IsStudent().has_permission(request, None))
+
+    def test_migration_backfills_role_and_mask(self):
+        # Rows written before the mask existed: groups set, role still the old 'student' default
+        self.user.groups.add(self.teacher_group)
+        User.objects.filter(pk=self.user.pk).update(role='student', role_mask=0)
+        import_module('lms.migrations.0010_user_role_mask').backfill_roles(django_apps, None)
+        user = User.objects.get(pk=self.user.pk)
+        self.assertEqual((user.role, user.role_mask), ('teacher', ROLE_TEACHER))
+
+    def test_stacked_permissions_resolve_role_once(self):
+        self.user.groups.add(self.teacher_group)
+        token = Token.objects.create(user=self.user)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+        # Token lookup (cache miss) + insert; no group queries
+        with self.assertNumQueries(2):
+            response = client.post(reverse('create-session'), {'title': 'Roles'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_sync_roles_command(self):
+        # Simulate drift left behind by writes that bypassed the m2m signal
+        other = User.objects.create(username='other', nickname='other', pin='0000', school=self.school)
+        User.groups.through.objects.create(user_id=self.user.pk, group_id=self.teacher_group.pk)
+        User.objects.filter(pk=other.pk).update(role='teacher')
+
+        out = StringIO()
+        call_command('sync_roles', '--dry-run', stdout=out)
+        self.assertIn('2 user(s)', out.getvalue())
+
+        call_command('sync_roles', stdout=StringIO())
+        self.assertEqual(User.objects.get(pk=self.user.pk).role_mask, ROLE_TEACHER)
+        self.assertEqual(User.objects.get(pk=self.user.pk).role, 'teacher')
+        self.assertEqual(User.objects.get(pk=other.pk).role, '')
+
+    def test_sync_roles_command_from_role(self):
+        User.objects.filter(pk=self.user.pk).update(role='teacher')
+        call_command('sync_roles', '--source', 'role', stdout=StringIO())
+        self.assertEqual(list(self.user.groups.values_list('name', flat=True)), ['Teacher'])
+        self.assertEqual(User.objects.get(pk=self.user.pk).role_mask, ROLE_TEACHER)
+
+
+class UnixSocketChannelLayerTestCase(SimpleTestCase):
+    async def start_broker(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'broker.sock')
+        self.broker = LayerBroker(self.path)
+        await self.broker.start()
+        # Two layer instances stand in for two worker processes
+        self.worker_a = UnixSocketChannelLayer(self.path, capacity=2)
+        self.worker_b = UnixSocketChannelLayer(self.path, capacity=2)
+
+    async def stop_broker(self):
+        await self.worker_a.close()
+        await self.worker_b.close()
+        await self.broker.close()
+        self.tmp.cleanup()
+
+    async def run_with_broker(self, test):
+        await self.start_broker()
+        try:
+            await asyncio.wait_for(test(), timeout=5)
+        finally:
+            await self.stop_broker()
+
+    async def test_group_send_reaches_every_worker(self):
+        async def test():
+            channel_a = await self.worker_a.new_channel()
+            channel_b = await self.worker_b.new_channel()
+            await self.worker_a.group_add('session_1', channel_a)
+            await self.worker_b.group_add('session_1', channel_b)
+
+            await self.worker_b.group_send('session_1', {'type': 'session_control', 'status': 'started'})
+            self.assertEqual((await self.worker_a.receive(channel_a))['status'], 'started')
+            self.assertEqual((await self.worker_b.receive(channel_b))['status'], 'started')
+
+            await self.worker_a.group_discard('session_1', channel_a)
+            await self.worker_a.group_send('session_1', {'type': 'session_control', 'status': 'stopped'})
+            self.assertEqual((await self.worker_b.receive(channel_b))['status'], 'stopped')
+            self.assertTrue(self.worker_a.queue(channel_a).empty())
+        await self.run_with_broker(test)
+
+    async def test_send_across_workers(self):
+        async def test():
+            channel_b = await self.worker_b.new_channel()
+            receive = asyncio.ensure_future(self.worker_b.receive(channel_b))
+            await asyncio.sleep(0.05)  # Let worker_b start listening
+            await self.worker_a.send(channel_b, {'type': 'webrtc_signal', 'payload': b'\x00\x01'})
+            self.assertEqual((await receive)['payload'], b'\x00\x01')
+        await self.run_with_broker(test)
+
+    async def test_local_channel_capacity(self):
+        async def test():
+            channel = await self.worker_a.new_channel()
+            await self.worker_a.send(channel, {'type': 'a'})
+            await self.worker_a.send(channel, {'type': 'b'})
+            with self.assertRaises(ChannelFull):
+                await self.worker_a.send(channel, {'type': 'c'})
+        await self.run_with_broker(test)
+
+    async def test_receivers_survive_a_broker_restart(self):
+        async def test():
+            channel_a = await self.worker_a.new_channel()
+            await self.worker_a.group_add('session_1', channel_a)
+            receive = asyncio.ensure_future(self.worker_a.receive(channel_a))
+            await asyncio.sleep(0.05)  # Let the broker take worker_a's connection
+
+            # The restarted broker knows nothing; worker_a listens and joins its groups again
+            await self.broker.close()
+            self.broker = LayerBroker(self.path)
+            await self.broker.start()
+            while self.worker_a.reconnect_task is None:
+                await asyncio.sleep(0.01)
+            await self.worker_a.reconnect_task
+
+            await self.worker_b.group_send('session_1', {'type': 'session_control', 'status': 'started'})
+            self.assertEqual((await receive)['status'], 'started')
+        await self.run_with_broker(test)
+
+    def test_broker_drops_messages_for_a_backed_up_worker(self):
+        class Transport:
+            size = 0
+
+            def get_write_buffer_size(self):
+                return self.size
+
+        class Writer:
+            transport = Transport()
+            frames = []
+
+            def write(self, data):
+                self.frames.append(data)
+
+        broker = LayerBroker('unused', buffer_limit=100)
+        writer = broker.listeners['specific.a'] = Writer()
+        broker.groups['session_1'] = {'specific.a!x': time.time()}
+        broker.fan_out('session_1', b'body')
+        writer.transport.size = 101
+        broker.fan_out('session_1', b'body')
+        self.assertEqual((len(writer.frames), broker.dropped), (1, 1))
+
+
+class SessionConsumerTestCase(TestCase):
+    def setUp(self):
+        session_states.clear()
+        clock_registry.clear()
+        presence_registry.clear()
+        peer_registry.clear()
+        self.school = School.objects.create(name='Test School')
+        self.teacher = User.objects.create(username='teacher', nickname='teacher', pin='0000', school=self.school)
+        self.session = Session.objects.create(title='Live', teacher=self.teacher, school=self.school)
+        # The connection used by sync_to_async code, resolved here on the main thread
+        self.db = connections['default']
+
+    async def connect(self, peer):
+        communicator = WebsocketCommunicator(
+            URLRouter(websocket_urlpatterns), f'/ws/session/{self.session.pk}/?peer={peer}'
+        )
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual((await communicator.receive_json_from())['action'], 'session_state')
+        self.assertEqual((await communicator.receive_json_from())['peer_id'], peer)
+        return communicator
+
+    async def test_anonymous_clients_cannot_claim_taken_ids(self):
+        headset_a = await self.connect('a')
+        for peer in ('a', str(self.teacher.pk)):
+            communicator = WebsocketCommunicator(
+                URLRouter(websocket_urlpatterns), f'/ws/session/{self.session.pk}/?peer={peer}'
+            )
+            connected, code = await communicator.connect()
+            self.assertEqual((connected, code), (False, 4409))
+        self.assertIsNotNone(peer_registry.lookup(self.session.pk, 'a'))
+        await headset_a.disconnect()
+
+    async def test_ids_taken_on_another_worker_are_not_taken_over(self):
+        # Another worker's registry has no entry for 'a' and lets a second socket claim it
+        headset_a = await self.connect('a')
+        holder = peer_registry.lookup(self.session.pk, 'a')
+        layer = get_channel_layer()
+        remote = await layer.new_channel()
+        await layer.group_send(f'session_{self.session.pk}', {
+            'type': 'peer_joined', 'peer_id': 'a', 'channel': remote, 'anonymous': True,
+            'text': '{"action": "peer_joined", "peer_id": "a"}',
+        })
+        self.assertEqual(await layer.receive(remote), {'type': 'peer_rejected'})
+        self.assertEqual(peer_registry.lookup(self.session.pk, 'a'), holder)
+        self.assertTrue(await headset_a.receive_nothing())
+
+        # The turned-away socket leaving doesn't look like 'a' leaving
+        await layer.group_send(f'session_{self.session.pk}', {
+            'type': 'peer_left', 'peer_id': 'a', 'channel': remote,
+            'text': '{"action": "peer_left", "peer_id": "a"}',
+        })
+        self.assertTrue(await headset_a.receive_nothing())
+        self.assertEqual(peer_registry.lookup(self.session.pk, 'a'), holder)
+        await headset_a.disconnect()
+
+    async def test_rejected_peers_are_closed(self):
+        headset_a = await self.connect('a')
+        await get_channel_layer().send(peer_registry.lookup(self.session.pk, 'a'), {'type': 'peer_rejected'})
+        self.assertEqual(await headset_a.receive_output(timeout=1), {'type': 'websocket.close', 'code': 4409})
+
+    async def test_signals_reach_only_the_target_peer(self):
+        teacher = await self.connect('teacher')
+        headset_a = await self.connect('a')
+        headset_b = await self.connect('b')
+        # Drain the join notices
+        self.assertEqual((await teacher.receive_json_from())['peer_id'], 'a')
+        self.assertEqual((await teacher.receive_json_from())['peer_id'], 'b')
+        self.assertEqual((await headset_a.receive_json_from())['peer_id'], 'b')
+
+        await teacher.send_json_to({'action': 'offer', 'target': 'a', 'sdp': 'v=0'})
+        self.assertEqual((await teacher.receive_json_from())['status'], 'success')
+
+        signal = await headset_a.receive_json_from()
+        self.assertEqual((signal['action'], signal['from'], signal['sdp']), ('offer', 'teacher', 'v=0'))
+        self.assertEqual(set(signal), {'action', 'from', 'sdp'})  # No channel-layer internals
+        self.assertTrue(await headset_b.receive_nothing())
+
+        for communicator in (teacher, headset_a, headset_b):
+            await communicator.disconnect()
+
+    async def test_unaddressed_signals_are_rejected(self):
+        teacher = await self.connect('teacher')
+
+        await teacher.send_json_to({'action': 'ice_candidate', 'candidate': 'candidate:1'})
+        self.assertEqual((await teacher.receive_json_from())['status'], 'error')
+
+        await teacher.send_json_to({'action': 'answer', 'target': 'nobody', 'sdp': 'v=0'})
+        self.assertEqual((await teacher.receive_json_from())['message'], 'Unknown peer nobody')
+        await teacher.disconnect()
+
+    @override_settings(LMS_ICE_COALESCE_WINDOW=0.05, LMS_ICE_COALESCE_MAX=3)
+    async def test_ice_candidates_are_coalesced(self):
+        teacher = await self.connect('teacher')
+        headset = await self.connect('a')
+        await teacher.receive_json_from()  # peer_joined
+
+        # Two candidates inside the window arrive as a single batch
+        for n in range(2):
+            await teacher.send_json_to({'action': 'ice_candidate', 'target': 'a', 'candidate': f'candidate:{n}'})
+            self.assertEqual((await teacher.receive_json_from())['message'], 'ice_candidate queued')
+        self.assertTrue(await headset.receive_nothing(timeout=0.01))
+        batch = await headset.receive_json_from(timeout=1)
+        self.assertEqual(batch['action'], 'ice_candidates')
+        self.assertEqual([c['candidate'] for c in batch['candidates']], ['candidate:0', 'candidate:1'])
+        self.assertFalse(batch['end'])
+
+        # Hitting the batch size flushes without waiting for the window
+        for n in range(3):
+            await teacher.send_json_to({'action': 'ice_candidate', 'target': 'a', 'candidate': f'candidate:{n}'})
+            await teacher.receive_json_from()
+        self.assertEqual(len((await headset.receive_json_from(timeout=0.02))['candidates']), 3)
+
+        # The end-of-candidates marker flushes what is left and is flagged
+        await teacher.send_json_to({'action': 'ice_candidate', 'target': 'a', 'candidate': 'candidate:9'})
+        await teacher.send_json_to({'action': 'ice_candidate', 'target': 'a', 'candidate': None})
+        batch = await headset.receive_json_from(timeout=0.02)
+        self.assertEqual((len(batch['candidates']), batch['end']), (1, True))
+
+        await teacher.disconnect()
+        await headset.disconnect()
+
+    @override_settings(LMS_ICE_COALESCE_WINDOW=5)
+    async def test_answer_flushes_pending_candidates(self):
+        teacher = await self.connect('teacher')
+        headset = await self.connect('a')
+
+        await headset.send_json_to({'action': 'ice_candidate', 'target': 'teacher', 'candidate': 'candidate:0'})
+        await headset.send_json_to({'action': 'answer', 'target': 'teacher', 'sdp': 'v=0'})
+
+        self.assertEqual((await teacher.receive_json_from())['action'], 'peer_joined')
+        self.assertEqual((await teacher.receive_json_from())['action'], 'ice_candidates')
+        self.assertEqual((await teacher.receive_json_from())['action'], 'answer')
+
+        await teacher.disconnect()
+        await headset.disconnect()
+
+    @override_settings(LMS_SESSION_FLUSH_DELAY=0.05)
+    async def test_control_actions_are_answered_from_memory(self):
+        teacher = await self.connect('teacher')
+        headset = await self.connect('a')
+        await teacher.receive_json_from()  # peer_joined
+
+        # Rapid toggles: no queries on the hot path, one coalesced UPDATE afterwards
+        queries = CaptureQueriesContext(self.db)
+        await sync_to_async(queries.__enter__)()
+        for action in ('start', 'pause', 'start'):
+            await teacher.send_json_to({'action': action})
+            await teacher.receive_json_from()  # group broadcast
+            await teacher.receive_json_from()  # direct response
+        self.assertEqual(len(queries), 0)
+
+        frames = [await headset.receive_json_from() for _ in range(3)]
+        self.assertEqual([frame['status'] for frame in frames], ['started', 'paused', 'started'])
+        self.assertEqual(set(frames[0]), {'action', 'message', 'status', 'seq', 'execute_at'})
+        self.assertEqual(sorted(frame['seq'] for frame in frames), [frame['seq'] for frame in frames])
+
+        await asyncio.sleep(0.1)
+        await sync_to_async(queries.__exit__)(None, None, None)
+        self.assertEqual(len(queries), 1)
+        self.assertTrue(queries[0]['sql'].startswith('UPDATE'))
+
+        session = await Session.objects.aget(pk=self.session.pk)
+        self.assertEqual((session.is_active, session.is_paused, session.seq), (True, False, frames[-1]['seq']))
+        self.assertIsNotNone(session.started_at)
+
+        # A late joiner gets the current state on connect
+        late = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/session/{self.session.pk}/?peer=late')
+        await late.connect()
+        snapshot = await late.receive_json_from()
+        self.assertEqual((snapshot['is_active'], snapshot['seq']), (True, frames[-1]['seq']))
+
+        for communicator in (teacher, headset, late):
+            await communicator.disconnect()
+
+    @override_settings(LMS_CLOCK_SYNC_SAMPLES=2, LMS_CLOCK_SYNC_INTERVAL=0, LMS_CONTROL_LEAD_MARGIN=50)
+    async def test_time_sync_schedules_control_broadcasts(self):
+        teacher = await self.connect('teacher')
+        headset = await self.connect('a')
+        await teacher.receive_json_from()  # peer_joined
+
+        # The headset's clock runs 2 s ahead of the server's
+        await headset.send_json_to({'action': 'time_sync'})
+        for _ in range(2):
+            ping = await headset.receive_json_from()
+            self.assertEqual(ping['action'], 'ping')
+            t1 = now_ms() + 2000
+            await asyncio.sleep(0.02)  # 20 ms on the way back
+            await headset.send_json_to({'action': 'pong', 'id': ping['id'], 't0': ping['t0'], 't1': t1, 't2': t1})
+            clock = await headset.receive_json_from()
+            self.assertEqual(clock['action'], 'clock')
+        self.assertAlmostEqual(clock['offset'], 2000 - clock['rtt'] / 2, delta=5)
+        self.assertGreaterEqual(clock['rtt'], 20)
+
+        # A pong for a ping we never sent is refused
+        await headset.send_json_to({'action': 'pong', 'id': 99, 't1': 0, 't2': 0})
+        self.assertEqual((await headset.receive_json_from())['status'], 'error')
+        for malformed in ([1], {'id': 1}, True, '1'):
+            await headset.send_json_to({'action': 'pong', 'id': malformed, 't1': 0, 't2': 0})
+            self.assertEqual((await headset.receive_json_from())['message'], 'Unknown ping id')
+
+        # Broadcasts are scheduled the worst round trip plus the margin ahead
+        sent = now_ms()
+        await teacher.send_json_to({'action': 'start'})
+        frame = await headset.receive_json_from()
+        self.assertGreaterEqual(frame['execute_at'], sent + 70)
+        self.assertLess(frame['execute_at'], sent + 1000)
+
+        await teacher.disconnect()
+        await headset.disconnect()
+        self.assertEqual(clock_registry.worst_rtt(self.session.pk), 0)
+
+    async def test_teacher_gets_the_roster_then_deltas(self):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/session/{self.session.pk}/')
+        communicator.scope['user'] = self.teacher
+        await communicator.connect()
+        await communicator.receive_json_from()  # session_state
+        await communicator.receive_json_from()  # peer_id
+        roster = await communicator.receive_json_from()
+        self.assertEqual(roster['action'], 'presence_roster')
+        self.assertEqual([(peer['peer_id'], peer['user_id']) for peer in roster['peers']], [(str(self.teacher.pk), self.teacher.pk)])
+
+        headset = await self.connect('a')
+        self.assertEqual((await communicator.receive_json_from())['action'], 'peer_joined')
+        delta = await communicator.receive_json_from()
+        self.assertEqual((delta['op'], delta['peer']['peer_id']), ('join', 'a'))
+        self.assertNotIn('count', delta)
+        self.assertEqual(presence_registry.count(self.session.pk), 2)
+
+        # Headsets don't get presence frames
+        other = await self.connect('b')
+        self.assertEqual((await headset.receive_json_from())['action'], 'peer_joined')
+        self.assertTrue(await headset.receive_nothing())
+
+        await headset.disconnect()
+        await communicator.receive_json_from()  # peer_joined for b
+        await communicator.receive_json_from()  # presence join for b
+        self.assertEqual(await communicator.receive_json_from(), {'action': 'presence', 'op': 'leave', 'peer_id': 'a'})
+        self.assertEqual((await communicator.receive_json_from())['action'], 'peer_left')
+
+        await other.disconnect()
+        await communicator.disconnect()
+        self.assertEqual(presence_registry.count(self.session.pk), 0)
+
+    @override_settings(LMS_VIEWPORT_RATE=20)
+    async def test_viewports_are_downsampled_and_batched(self):
+        teacher = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/session/{self.session.pk}/')
+        teacher.scope['user'] = self.teacher
+        await teacher.connect()
+        for _ in range(3):
+            await teacher.receive_json_from()  # session_state, peer_id, presence_roster
+        headset_a = await self.connect('a')
+        headset_b = await self.connect('b')
+        for _ in range(4):
+            await teacher.receive_json_from()  # peer_joined and presence join, twice
+
+        # Headsets can't watch
+        await headset_a.receive_json_from()  # peer_joined for b
+        await headset_a.send_json_to({'action': 'viewport_subscribe'})
+        self.assertEqual((await headset_a.receive_json_from())['status'], 'error')
+
+        await teacher.send_json_to({'action': 'viewport_subscribe', 'students': ['a'], 'rate': 100})
+        self.assertEqual(await teacher.receive_json_from(), {'action': 'viewport_subscribe', 'rate': 20, 'status': 'success'})
+
+        # A burst at headset frame rate arrives as the latest sample only, and only for the watched student
+        for t in range(20):
+            pose = {'action': 'pose', 't': t, 'position': [0, 1.6, 0], 'orientation': [0, 0, 0, 1]}
+            await headset_a.send_json_to(pose)
+            await headset_b.send_json_to(pose)
+        await headset_a.send_json_to({'action': 'gaze', 't': 19, 'origin': [0, 1.6, 0], 'direction': [0, 0, -1]})
+        frame = await teacher.receive_json_from(timeout=1)
+        self.assertEqual(frame['action'], 'viewport')
+        self.assertEqual(set(frame['students']), {'a'})
+        self.assertEqual((frame['students']['a']['pose']['t'], frame['students']['a']['gaze']['t']), (19, 19))
+        self.assertTrue(await teacher.receive_nothing(timeout=0.15))  # Nothing moved since
+
+        # Unsubscribing while a batch is waiting drops it
+        await headset_a.send_json_to({'action': 'pose', 't': 20, 'position': [0, 0, 0], 'orientation': [0, 0, 0, 1]})
+        await asyncio.sleep(0.01)
+        await teacher.send_json_to({'action': 'viewport_unsubscribe'})
+        self.assertEqual((await teacher.receive_json_from())['action'], 'viewport_unsubscribe')
+        await headset_a.send_json_to({'action': 'pose', 't': 21, 'position': [0, 0, 0], 'orientation': [0, 0, 0, 1]})
+        self.assertTrue(await teacher.receive_nothing(timeout=0.15))
+
+        # and the next subscription starts its own ticks
+        await teacher.send_json_to({'action': 'viewport_subscribe', 'students': ['a']})
+        await teacher.receive_json_from()
+        await headset_a.send_json_to({'action': 'pose', 't': 22, 'position': [0, 0, 0], 'orientation': [0, 0, 0, 1]})
+        frame = await teacher.receive_json_from(timeout=1)
+        self.assertEqual(frame['students']['a']['pose']['t'], 22)
+
+        for communicator in (teacher, headset_a, headset_b):
+            await communicator.disconnect()
+
+    async def test_pending_viewport_ticks_stop_after_unsubscribe(self):
+        # The last batch is still queued, so the tick reschedules itself; unsubscribing meanwhile ends it
+        consumer = SessionConsumer()
+        consumer.viewport_interval = 0.01
+        consumer.viewport_pending = {'a': {'pose': {}}}
+        consumer.send_queue = outbound.SendQueue(8, 8)
+        consumer.send_queue.put('{"action": "viewport"}', key='viewport')
+        consumer.viewport_flush_task = asyncio.ensure_future(consumer.flush_viewport_later())
+        await asyncio.sleep(0.015)
+        consumer.viewport_interval = None
+        await asyncio.sleep(0.02)
+        self.assertIsNone(consumer.viewport_flush_task)
+
+    @override_settings(LMS_VIEWPORT_RATE=20)
+    async def test_headsets_joining_later_learn_about_viewers(self):
+        teacher = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/session/{self.session.pk}/')
+        teacher.scope['user'] = self.teacher
+        await teacher.connect()
+        for _ in range(3):
+            await teacher.receive_json_from()  # session_state, peer_id, presence_roster
+        await teacher.send_json_to({'action': 'viewport_subscribe'})
+        await teacher.receive_json_from()
+
+        # The teacher's introduction tells the newcomer somebody watches, so its samples are forwarded
+        headset = await self.connect('a')
+        for _ in range(2):
+            await teacher.receive_json_from()  # peer_joined, presence join
+        await headset.send_json_to({'action': 'pose', 't': 1, 'position': [0, 1.6, 0], 'orientation': [0, 0, 0, 1]})
+        frame = await teacher.receive_json_from(timeout=1)
+        self.assertEqual((frame['action'], frame['students']['a']['pose']['t']), ('viewport', 1))
+
+        for communicator in (teacher, headset):
+            await communicator.disconnect()
+
+    @override_settings(LMS_SEND_QUEUE_LIMIT=0)
+    async def test_slow_clients_are_disconnected(self):
+        slow_disconnects = outbound.stats['slow_disconnects']
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/session/{self.session.pk}/?peer=a')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        output = await communicator.receive_output(timeout=1)
+        while output['type'] == 'websocket.send':
+            output = await communicator.receive_output(timeout=1)
+        self.assertEqual(output, {'type': 'websocket.close', 'code': 4429})
+        self.assertEqual(outbound.stats['slow_disconnects'], slow_disconnects + 1)
+
+    @override_settings(LMS_PRESENCE_TIMEOUT=0.1)
+    async def test_idle_connections_are_evicted(self):
+        headset = await self.connect('a')
+        await asyncio.sleep(0.06)
+        await headset.send_json_to({'action': 'heartbeat'})
+        self.assertEqual((await headset.receive_json_from())['status'], 'success')
+        await asyncio.sleep(0.06)
+        self.assertEqual(presence_registry.count(self.session.pk), 1)  # The heartbeat kept it alive
+
+        self.assertEqual(await headset.receive_output(timeout=1), {'type': 'websocket.close', 'code': 4408})
+        self.assertEqual(presence_registry.count(self.session.pk), 0)
+
+    @override_settings(LMS_PRESENCE_TIMEOUT=None)
+    async def test_idle_connections_stay_open_when_eviction_is_off(self):
+        headset = await self.connect('a')
+        self.assertTrue(await headset.receive_nothing(timeout=0.2))
+        self.assertEqual(presence_registry.count(self.session.pk), 1)
+        await headset.disconnect()
+
+    async def test_session_notification_is_relayed(self):
+        headset = await self.connect('a')
+        await sync_to_async(self.session.notify_students)()
+        frame = await headset.receive_json_from()
+        self.assertEqual(frame, {'action': 'session_notification', 'message': 'Session "Live" has started!'})
+        await headset.disconnect()
+
+    async def test_unknown_session_is_rejected(self):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/session/999/')
+        connected, code = await communicator.connect()
+        self.assertFalse(connected)
+        self.assertEqual(code, 4404)
+
+    async def test_binary_subprotocol(self):
+        teacher = await self.connect('teacher')
+        headset = WebsocketCommunicator(
+            URLRouter(websocket_urlpatterns), f'/ws/session/{self.session.pk}/?peer=a',
+            subprotocols=[protocol.SUBPROTOCOL],
+        )
+        connected, subprotocol = await headset.connect()
+        self.assertEqual((connected, subprotocol), (True, protocol.SUBPROTOCOL))
+        self.assertEqual(protocol.unpack(await headset.receive_from())['action'], 'session_state')
+        self.assertEqual(protocol.unpack(await headset.receive_from())['peer_id'], 'a')
+        await teacher.receive_json_from()  # peer_joined
+
+        # Control and signaling actions share the JSON clients' handling
+        await headset.send_to(bytes_data=protocol.pack({'action': 'start'}))
+        self.assertEqual(protocol.unpack(await headset.receive_from())['status'], 'started')
+        self.assertEqual(protocol.unpack(await headset.receive_from())['status'], 'started')
+        self.assertEqual((await teacher.receive_json_from())['status'], 'started')
+
+        await headset.send_to(bytes_data=protocol.pack({'action': 'answer', 'target': 'teacher', 'sdp': 'v=0'}))
+        self.assertEqual(protocol.unpack(await headset.receive_from())['status'], 'success')
+        self.assertEqual(await teacher.receive_json_from(), {'action': 'answer', 'from': 'a', 'sdp': 'v=0'})
+
+        # Telemetry is kept, not acknowledged
+        pose = {'action': 'pose', 't': 1200, 'position': [0.0, 1.5, 0.0], 'orientation': [0.0, 0.0, 0.0, 1.0]}
+        await headset.send_to(bytes_data=protocol.pack(pose))
+        self.assertTrue(await headset.receive_nothing())
+
+        await headset.send_to(bytes_data=b'\x01\x10\x00')
+        self.assertEqual(protocol.unpack(await headset.receive_from())['status'], 'error')
+
+        await teacher.disconnect()
+        await headset.disconnect()
+
+
+class SessionControlViewTestCase(TestCase):
+    def setUp(self):
+        session_states.clear()
+        self.school = School.objects.create(name='Test School')
+        self.teacher = User.objects.create(username='teacher', nickname='teacher', pin='0000', school=self.school)
+        self.teacher.groups.add(Group.objects.get_or_create(name='Teacher')[0])
+        self.session = Session.objects.create(title='Live', teacher=self.teacher, school=self.school)
+
+        self.client = APIClient()
+        self.token = Token.objects.create(user=self.teacher)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def control(self, action):
+        return self.client.post(reverse(f'{action}-session'), {'session_id': self.session.pk})
+
+    def test_start_pause_stop(self):
+        self.assertEqual(self.control('pause').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.control('start').status_code, status.HTTP_200_OK)
+        self.assertEqual(self.control('pause').status_code, status.HTTP_200_OK)
+
+        self.session.refresh_from_db()
+        self.assertEqual((self.session.is_active, self.session.is_paused), (True, True))
+        self.assertTrue(self.session.notification_sent)
+
+        self.assertEqual(self.control('stop').status_code, status.HTTP_200_OK)
+        self.session.refresh_from_db()
+        self.assertEqual((self.session.is_active, self.session.is_paused), (False, False))
+        self.assertIsNotNone(self.session.stopped_at)
+        self.assertNotIn(self.session.pk, session_states._states)  # Stopped sessions are dropped
+
+    def test_loaded_row_wins_over_remembered_state(self):
+        self.assertEqual(self.control('start').status_code, status.HTTP_200_OK)
+        # Another worker paused it; this one still remembers it running
+        Session.objects.filter(pk=self.session.pk).update(is_paused=True, seq=F('seq') + 1)
+        self.assertEqual(self.control('start').status_code, status.HTTP_200_OK)
+        self.session.refresh_from_db()
+        self.assertFalse(self.session.is_paused)
+        self.assertEqual(session_states._states[self.session.pk].seq, self.session.seq)
+
+    def test_a_worker_that_just_loaded_the_session_outranks_older_changes(self):
+        for action in ('start', 'pause', 'start'):
+            self.control(action)
+        live = session_states._states[self.session.pk]
+
+        # Another worker loads the session fresh and stops it: its seq comes from the row and the clock
+        other = SessionStateStore()
+        stopped = async_to_sync(other.apply_now)(Session.objects.get(pk=self.session.pk), 'stop')
+        self.assertGreater(stopped.seq, live.seq)
+        session_states.observe(self.session.pk, stopped.snapshot())
+        self.assertEqual((live.is_active, live.seq), (False, stopped.seq))
+
+        # A change this worker made before it heard of the stop is not written over it
+        other_live = SessionState(self.session.pk, self.teacher.pk, self.school.pk, True, True, None, None, stopped.seq - 1)
+        session_states._states[self.session.pk] = other_live
+        session_states._dirty[self.session.pk] = {'is_active', 'is_paused'}
+        async_to_sync(session_states.flush)(self.session.pk)
+        self.session.refresh_from_db()
+        self.assertEqual((self.session.is_active, self.session.is_paused, self.session.seq), (False, False, stopped.seq))
+
+    def test_pending_state_is_written_on_exit(self):
+        async def start():
+            await session_states.get(self.session.pk)
+            return await session_states.apply(self.session.pk, 'start')
+        async_to_sync(start)()
+        self.assertFalse(Session.objects.get(pk=self.session.pk).is_active)
+        self.assertEqual(session_states.flush_pending(), 1)
+        self.assertTrue(Session.objects.get(pk=self.session.pk).is_active)
+
+    def test_auth_and_permission_errors(self):
+        anonymous = APIClient()
+        self.assertEqual(anonymous.post(reverse('start-session'), {'session_id': self.session.pk}).status_code, 401)
+        anonymous.credentials(HTTP_AUTHORIZATION='Token not-a-token')
+        response = anonymous.post(reverse('start-session'), {'session_id': self.session.pk})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Token')
+
+        student = User.objects.create(username='student', nickname='student', pin='1234', school=self.school)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=student).key}')
+        self.assertEqual(client.post(reverse('create-session'), {'title': 'No'}).status_code, 403)
+
+        other = User.objects.create(username='other', nickname='other', pin='0000', school=self.school)
+        other.groups.add(Group.objects.get(name='Teacher'))
+        client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=other).key}')
+        self.assertEqual(client.post(reverse('stop-session'), {'session_id': self.session.pk}).status_code, 404)
+        self.assertEqual(client.post(reverse('add-lesson'), {'session_id': 'x'}, format='json').status_code, 404)
+
+    def test_create_session_and_add_lesson(self):
+        response = self.client.post(reverse('create-session'), {'title': 'New'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        session_id = response.json()['id']
+
+        response = self.client.post(reverse('add-lesson'), {'session_id': session_id, 'title': 'Intro', 'content': ''})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Lesson.objects.get(pk=response.json()['id']).session_id, session_id)
+
+    def test_device_command_without_backend(self):
+        response = self.client.post(
+            reverse('device-command'), {'session_id': self.session.pk, 'action': 'start', 'devices': ['h1']}, format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response.json(), {'error': 'no DPVR backend configured'})
+
+    def test_device_command_reports_each_headset(self):
+        dpvr_controller.backend = SimulatedBackend(latency=(0, 0.001), offline={'h2'})
+        try:
+            # Socket peers are not device ids: the devices must be named
+            response = self.client.post(reverse('device-command'), {'session_id': self.session.pk, 'action': 'start'}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+            response = self.client.post(
+                reverse('device-command'), {'session_id': self.session.pk, 'action': 'pause', 'devices': ['h1', 'h2']},
+                format='json',
+            )
+            body = response.json()
+            self.assertEqual((body['acknowledged'], body['failed']), (1, 1))
+            self.assertEqual([result['status'] for result in body['results']], ['ok', 'error'])
+
+            response = self.client.post(reverse('device-command'), {'session_id': self.session.pk, 'action': 'eject'}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        finally:
+            dpvr_controller.backend = None
+
+    def test_presence_roster(self):
+        presence_registry.clear()
+        presence_registry.join(self.session.pk, 'h1', 'channel-1', user_id=7, role='student', binary=True)
+        response = self.client.get(reverse('session-presence', args=[self.session.pk]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 1)
+        self.assertEqual((response.data['peers'][0]['peer_id'], response.data['peers'][0]['binary']), ('h1', True))
+        presence_registry.clear()
+
+        self.assertEqual(self.client.get(reverse('session-presence', args=[999])).status_code, status.HTTP_404_NOT_FOUND)
+
+    async def test_control_is_broadcast_to_connected_students(self):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/session/{self.session.pk}/?peer=s1')
+        await communicator.connect()
+        await communicator.receive_json_from()  # session_state
+        await communicator.receive_json_from()  # peer_id
+
+        async def post(action):
+            return await self.async_client.post(
+                reverse(f'{action}-session'), {'session_id': self.session.pk},
+                content_type='application/json', headers={'Authorization': f'Token {self.token.key}'},
+            )
+
+        # The same session_control frame as a start sent on the socket, then the notification
+        response = await post('start')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        frame = await communicator.receive_json_from()
+        session = await Session.objects.aget(pk=self.session.pk)
+        self.assertEqual((frame['action'], frame['status'], frame['seq']), ('session_control', 'started', session.seq))
+        self.assertIn('execute_at', frame)
+        self.assertEqual((await communicator.receive_json_from())['action'], 'session_notification')
+
+        await post('stop')
+        self.assertEqual((await communicator.receive_json_from())['status'], 'stopped')
+        await communicator.disconnect()
+
+    @override_settings(LMS_SESSION_FLUSH_DELAY=0.05)
+    async def test_rest_stop_wins_over_a_live_worker(self):
+        # Another worker has the session live, with changes it has not written yet
+        live = SessionStateStore()
+        for action in ('start', 'pause', 'start'):
+            await live.apply(self.session.pk, action)
+        layer = get_channel_layer()
+        channel = await layer.new_channel()
+        await layer.group_add(f'session_{self.session.pk}', channel)
+
+        # This worker has never seen the session; its stop still outranks the live worker's state
+        session_states.clear()
+        response = await self.async_client.post(
+            reverse('stop-session'), {'session_id': self.session.pk},
+            content_type='application/json', headers={'Authorization': f'Token {self.token.key}'},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        event = await layer.receive(channel)
+        self.assertGreater(event['state']['seq'], live._states[self.session.pk].seq)
+        live.observe(self.session.pk, event['state'])
+        self.assertFalse(live._states[self.session.pk].is_active)
+
+        # The live worker's pending write and a later pause leave the stopped row alone
+        await live.apply(self.session.pk, 'pause')
+        await asyncio.sleep(0.1)
+        session = await Session.objects.aget(pk=self.session.pk)
+        self.assertEqual((session.is_active, session.is_paused, session.seq), (False, False, event['state']['seq']))
+        live.clear()
+
+    def test_errors_go_through_drf(self):
+        response = self.client.post(reverse('start-session'), 'not json', content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('JSON parse error', response.json()['detail'])
+
+        response = self.client.get(reverse('start-session'))
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+
+class ClockEstimateTestCase(SimpleTestCase):
+    def test_offset_comes_from_the_fastest_round_trip(self):
+        clock = ClockEstimate(window=3)
+        # Client 100 ms ahead; one-way delays (out, back) in ms
+        for t0, out, back in ((0, 40, 10), (1000, 5, 5), (2000, 30, 30)):
+            t1 = t0 + out + 100
+            clock.add(t0, t1, t1 + 1, t0 + out + 1 + back)
+        self.assertEqual((clock.offset, clock.rtt, clock.worst_rtt), (100, 10, 60))
+
+        clock.add(3000, 3200, 3200, 3080)
+        self.assertEqual(clock.worst_rtt, 80)  # The oldest sample left the window
+        with self.assertRaises(ValueError):
+            clock.add(0, 10, 5, 20)
+
+    @override_settings(LMS_CONTROL_LEAD_MARGIN=50, LMS_CONTROL_LEAD_MAX=200)
+    def test_execute_at_is_capped(self):
+        clock_registry.clear()
+        clock_registry.update(1, 'a', 30)
+        clock_registry.update(1, 'b', 500)
+        now = now_ms()
+        self.assertAlmostEqual(clock_registry.execute_at(1) - now, 200, delta=5)
+        clock_registry.discard(1, 'b')
+        self.assertAlmostEqual(clock_registry.execute_at(1) - now, 80, delta=5)
+        self.assertAlmostEqual(clock_registry.execute_at(2) - now, 50, delta=5)
+        clock_registry.clear()
+
+
+class FlakyBackend:
+    # Fails the first `failures` commands to each device
+    def __init__(self, failures):
+        self.failures = failures
+        self.attempts = {}
+
+    async def send(self, device_id, action, payload):
+        self.attempts[device_id] = self.attempts.get(device_id, 0) + 1
+        if self.attempts[device_id] <= self.failures:
+            raise DeviceError('Device busy')
+        return {'device': device_id, 'state': action}
+
+
+class BrokenBackend:
+    # Raises something other than DeviceError for one device
+    async def send(self, device_id, action, payload):
+        if device_id == 'h2':
+            raise ConnectionResetError('Connection reset by peer')
+        return {'device': device_id, 'state': action}
+
+
+class DPVRControllerTestCase(SimpleTestCase):
+    async def test_commands_are_sent_concurrently_within_the_bound(self):
+        controller = DPVRController(SimulatedBackend(latency=(0.05, 0.05)), concurrency=10)
+        result = await controller.dispatch([f'h{i}' for i in range(20)], 'start')
+        self.assertEqual((result['acknowledged'], result['failed']), (20, 0))
+        # Two waves of ten, instead of twenty commands one after another
+        self.assertGreaterEqual(result['elapsed_ms'], 95)
+        self.assertLess(result['elapsed_ms'], 500)
+        self.assertEqual([r['device'] for r in result['results']], [f'h{i}' for i in range(20)])
+
+    async def test_retries_and_timeouts(self):
+        controller = DPVRController(FlakyBackend(failures=2), retries=2, backoff=0.001)
+        result = (await controller.dispatch(['h1'], 'pause'))['results'][0]
+        self.assertEqual((result['status'], result['attempts'], result['ack']['state']), ('ok', 3, 'pause'))
+
+        controller = DPVRController(FlakyBackend(failures=5), retries=1, backoff=0.001)
+        result = (await controller.dispatch(['h1'], 'pause'))['results'][0]
+        self.assertEqual((result['status'], result['attempts']), ('error', 2))
+
+        controller = DPVRController(SimulatedBackend(latency=(0, 0), drop_rate=1.0, offline={'h2'}), timeout=0.02, retries=1, backoff=0.001)
+        timed_out, offline = (await controller.dispatch(['h1', 'h2'], 'stop'))['results']
+        self.assertEqual((timed_out['status'], timed_out['attempts']), ('timeout', 2))
+        self.assertEqual((offline['status'], offline['attempts']), ('error', 1))  # Not retried
+
+        with self.assertRaises(ValueError):
+            await controller.dispatch(['h1'], 'eject')
+
+    async def test_unexpected_backend_errors_fail_only_that_device(self):
+        result = await DPVRController(BrokenBackend(), retries=1, backoff=0.001).dispatch(['h1', 'h2', 'h3'], 'start')
+        self.assertEqual((result['acknowledged'], result['failed']), (2, 1))
+        broken = result['results'][1]
+        self.assertEqual((broken['status'], broken['attempts']), ('error', 2))  # Network errors are retried
+        self.assertEqual(broken['error'], 'ConnectionResetError: Connection reset by peer')
+
+    async def test_backend_comes_from_settings(self):
+        controller = DPVRController()
+        self.assertIsNone(controller.backend)
+        with self.assertRaises(ImproperlyConfigured):
+            await controller.dispatch(['h1'], 'start')
+
+        with override_settings(LMS_DPVR_BACKEND='lms.dpvr_control.SimulatedBackend'):
+            self.assertIsInstance(controller.backend, SimulatedBackend)
+        self.assertIsNone(controller.backend)
+
+
+class SendQueueTestCase(SimpleTestCase):
+    async def test_reliable_frames_go_first_and_ephemeral_ones_collapse(self):
+        queue = outbound.SendQueue(limit=3, ephemeral_limit=2)
+        queue.put('ping 1', key='ping')
+        queue.put('control 1')
+        queue.put('ping 2', key='ping')  # Replaces ping 1
+        queue.put('viewport', key='viewport')
+        queue.put('clock', key='clock')  # Full: the oldest ephemeral frame is dropped
+        queue.put('control 2')
+        self.assertEqual(len(queue), 4)
+        self.assertTrue(queue.pending('clock'))
+
+        self.assertEqual([await queue.get() for _ in range(4)], ['control 1', 'control 2', 'viewport', 'clock'])
+        self.assertEqual(queue.stats, {'sent': 4, 'superseded': 1, 'dropped': 1, 'max_depth': 4})
+
+        # Reliable frames are never dropped; past the limit the client is too slow
+        self.assertTrue(all(queue.put(f'control {n}') for n in range(3)))
+        self.assertFalse(queue.put('control 3'))
+        self.assertEqual(len(queue), 4)
+
+    async def test_get_waits_for_a_frame(self):
+        queue = outbound.SendQueue(limit=10, ephemeral_limit=10)
+        getter = asyncio.ensure_future(queue.get())
+        await asyncio.sleep(0)
+        self.assertFalse(getter.done())
+        queue.put('frame')
+        self.assertEqual(await asyncio.wait_for(getter, 1), 'frame')
+
+
+class BinaryProtocolTestCase(SimpleTestCase):
+    def test_binary_frames_round_trip(self):
+        messages = [
+            {'action': 'stop'},
+            {'action': 'ice_candidate', 'target': '12', 'candidate': 'candidate:1', 'sdpMid': '0'},
+            {'action': 'gaze', 't': 5, 'origin': [0.0, 1.5, 0.0], 'direction': [0.0, 0.0, -1.0]},
+            {'action': 'interaction', 't': 7, 'kind': 'grab', 'target': 'beaker'},
+            {'action': 'events', 'events': []},
+        ]
+        for message in messages:
+            self.assertEqual(protocol.unpack(protocol.pack(message)), message)
+        # 2-byte header + 32-byte body, against ~90 bytes of JSON
+        self.assertEqual(len(protocol.pack({'action': 'pose', 't': 1, 'position': [0, 0, 0], 'orientation': [0, 0, 0, 1]})), 34)
+
+
+class InteractionEventIngestTestCase(TestCase):
+    def setUp(self):
+        session_states.clear()
+        # Flush by hand: timer threads would write outside the test transaction
+        event_buffer.autoflush = False
+        event_buffer.flush()
+
+        self.school = School.objects.create(name='Test School')
+        self.student = User.objects.create(username='student', nickname='student', pin='1234', school=self.school)
+        self.session = Session.objects.create(title='Live', teacher=self.student, school=self.school)
+
+        self.client = APIClient()
+        token = Token.objects.create(user=self.student)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def tearDown(self):
+        event_buffer.flush()
+        event_buffer.autoflush = True
+
+    def post_events(self, events, session_id=None):
+        return self.client.post(
+            reverse('events'),
+            {'session_id': session_id or self.session.pk, 'events': events},
+            format='json',
+        )
+
+    def test_events_are_buffered_then_bulk_inserted(self):
+        events = [{'kind': 'gaze', 'data': {'target': 'beaker'}}, {'kind': 'click', 'occurred_at': '2026-01-01T10:00:00Z'}]
+        response = self.post_events(events)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(InteractionEvent.objects.count(), 0)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(event_buffer.flush(), 2)
+        stored = InteractionEvent.objects.order_by('id')
+        self.assertEqual([event.kind for event in stored], ['gaze', 'click'])
+        self.assertEqual(stored[0].student_id, self.student.pk)
+        self.assertEqual(stored[1].occurred_at.year, 2026)
+
+    def test_validation_and_scoping(self):
+        self.assertEqual(self.post_events([{'data': {}}]).status_code, status.HTTP_400_BAD_REQUEST)
+
+        other_school = School.objects.create(name='Other School')
+        other_session = Session.objects.create(title='Elsewhere', teacher=self.student, school=other_school)
+        self.assertEqual(self.post_events([{'kind': 'gaze'}], other_session.pk).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.post_events([{'kind': 'gaze'}], 'abc').status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(LMS_EVENT_BUFFER_SIZE=3, LMS_EVENT_FLUSH_INTERVAL=2.0)
+    def test_full_buffer_applies_backpressure(self):
+        self.assertEqual(self.post_events([{'kind': 'gaze'}] * 2).status_code, status.HTTP_202_ACCEPTED)
+
+        response = self.post_events([{'kind': 'gaze'}] * 2)
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '2')
+        self.assertEqual(len(event_buffer), 2)
+
+    async def test_websocket_events_action(self):
+        anonymous = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/session/{self.session.pk}/?peer=a')
+        await anonymous.connect()
+        await anonymous.receive_json_from()  # session_state
+        await anonymous.receive_json_from()  # peer_id
+        await anonymous.send_json_to({'action': 'events', 'events': [{'kind': 'click'}]})
+        self.assertEqual((await anonymous.receive_json_from())['status'], 'error')
+        await anonymous.disconnect()
+
+        headset = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/session/{self.session.pk}/')
+        headset.scope['user'] = self.student
+        await headset.connect()
+        await headset.receive_json_from()  # session_state
+        await headset.receive_json_from()  # peer_id
+        await headset.receive_json_from()  # presence_roster (the fixture's student also teaches the session)
+
+        await headset.send_json_to({'action': 'events', 'events': [{'kind': 'click'}] * 3})
+        self.assertEqual(await headset.receive_json_from(), {'action': 'events', 'status': 'accepted', 'count': 3})
+        self.assertEqual(len(event_buffer), 3)
+        await headset.disconnect()
+
+
+class ProgressBulkUpsertTestCase(TestCase):
+    def setUp(self):
+        self.school = School.objects.create(name='Test School')
+        self.teacher = User.objects.create(username='teacher', nickname='teacher', pin='0000', school=self.school)
+        self.teacher.groups.add(Group.objects.get_or_create(name='Teacher')[0])
+        self.student = User.objects.create(username='student', nickname='student', pin='1234', school=self.school)
+        self.session = Session.objects.create(title='Live', teacher=self.teacher, school=self.school)
+        self.lessons = [
+            Lesson.objects.create(title=f'Lesson {i}', content='', school=self.school, session=self.session)
+            for i in range(3)
+        ]
+        Progress.objects.create(school=self.school, student=self.student, lesson=self.lessons[0], score=10)
+
+    def client_for(self, user):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=user).key}')
+        return client
+
+    def record(self, lesson, **fields):
+        return {'lesson': lesson.pk, 'score': 90, 'completed': True, 'progress_data': {'cmi.location': '3'}, **fields}
+
+    def test_student_upserts_own_records(self):
+        client = self.client_for(self.student)
+        records = [self.record(lesson) for lesson in self.lessons]
+        response = client.post(reverse('progress-bulk'), {'records': records}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['status'] for r in response.data['results']], ['ok'] * 3)
+        self.assertEqual(Progress.objects.filter(student=self.student).count(), 3)
+        self.assertEqual(Progress.objects.get(student=self.student, lesson=self.lessons[0]).score, 90)
+
+    def test_query_count_does_not_grow_with_batch_size(self):
+        client = self.client_for(self.student)
+        client.post(reverse('progress-bulk'), {'records': [self.record(self.lessons[0])]}, format='json')
+
+        # Lessons, students, savepoint + insert missing + locked read + update + rollups (6) + release
+        with self.assertNumQueries(13):
+            client.post(reverse('progress-bulk'), {'records': [self.record(l) for l in self.lessons]}, format='json')
+
+    def test_per_item_errors_and_scoping(self):
+        other_school = School.objects.create(name='Other School')
+        outsider = User.objects.create(username='outsider', nickname='outsider', pin='1234', school=other_school)
+        foreign_session = Session.objects.create(title='Elsewhere', teacher=outsider, school=other_school)
+        foreign_lesson = Lesson.objects.create(title='Foreign', content='', school=other_school, session=foreign_session)
+
+        client = self.client_for(self.teacher)
+        records = [
+            self.record(self.lessons[1], student=self.student.pk, score=50),
+            self.record(foreign_lesson, student=self.student.pk),
+            self.record(self.lessons[1], student=outsider.pk),
+            {'lesson': self.lessons[2].pk, 'student': self.student.pk},
+            self.record(self.lessons[1], student=self.student.pk, score=70),
+            self.record(self.lessons[2]),
+        ]
+        response = client.post(reverse('progress-bulk'), {'records': records, 'session_id': self.session.pk}, format='json')
+        statuses = [r['status'] for r in response.data['results']]
+        self.assertEqual(statuses, ['skipped', 'error', 'error', 'error', 'ok', 'error'])
+        self.assertEqual(Progress.objects.get(student=self.student, lesson=self.lessons[1]).score, 70)
+        self.assertFalse(Progress.objects.filter(student=outsider).exists())
+
+    def test_students_cannot_write_for_others(self):
+        client = self.client_for(self.student)
+        response = client.post(reverse('progress-bulk'), {'records': [self.record(self.lessons[1], student=self.teacher.pk)]}, format='json')
+        self.assertEqual(response.data['results'][0]['status'], 'error')
+        self.assertFalse(Progress.objects.filter(student=self.teacher).exists())
+
+    def test_upsert_bumps_version(self):
+        client = self.client_for(self.student)
+        client.post(reverse('progress-bulk'), {'records': [self.record(l) for l in self.lessons[:2]]}, format='json')
+
+        versions = dict(Progress.objects.filter(student=self.student).values_list('lesson_id', 'version'))
+        self.assertEqual(versions, {self.lessons[0].pk: 2, self.lessons[1].pk: 1})
+
+
+class SparseFieldsetTestCase(TestCase):
+    def setUp(self):
+        school = School.objects.create(name='Test School')
+        self.student = User.objects.create(username='student', nickname='student', pin='1234', school=school)
+        self.teacher = User.objects.create(username='teacher', nickname='teacher', pin='0000', school=school)
+        self.teacher.groups.add(Group.objects.get_or_create(name='Teacher')[0])
+        self.session = Session.objects.create(title='Live', teacher=self.teacher, school=school)
+        lesson = Lesson.objects.create(title='Intro', content='x' * 10000, school=school, session=self.session)
+        Progress.objects.create(school=school, student=self.student, lesson=lesson, score=80, progress_data={'cmi': {}})
+        school_class = Class.objects.create(school=school, name='7A', teacher=self.teacher)
+        school_class.students.add(self.student)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.student).key}')
+        cache.clear()
+        response_cache().clear()
+        token_cache.clear()
+
+    def get(self, url, params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        return response, '\n'.join(query['sql'] for query in queries.captured_queries), len(queries)
+
+    def test_unselected_columns_are_not_read(self):
+        url = reverse('session-lessons', args=[self.session.pk])
+        response, sql, _ = self.get(url, {})
+        self.assertEqual(set(response.data[0]), {'id', 'title', 'content', 'lesson_class', 'package'})
+        self.assertIn('"content"', sql)
+
+        for params in ({'fields': 'id,title'}, {'exclude': 'content,lesson_class,package'}):
+            response, sql, _ = self.get(url, params)
+            self.assertEqual(response.data, [{'id': response.data[0]['id'], 'title': 'Intro'}])
+            self.assertNotIn('"content"', sql)
+
+        response, sql, _ = self.get(reverse('progress'), {'fields': 'id,lesson,score'})
+        self.assertEqual(set(response.data['results'][0]), {'id', 'lesson', 'score'})
+        self.assertNotIn('progress_data', sql)
+
+    def test_relations_are_only_loaded_when_selected(self):
+        self.get(reverse('classes'), {})  # Caches the token
+        response_cache().clear()
+        response, _, full = self.get(reverse('classes'), {})
+        response, sql, sparse = self.get(reverse('classes'), {'fields': 'id,name'})
+        self.assertEqual(response.data['results'], [{'id': response.data['results'][0]['id'], 'name': '7A'}])
+        self.assertEqual(sparse, full - 1)  # No students prefetch
+        self.assertNotIn('"lms_user"."nickname"', sql)
+
+        # Nested serializers keep all their fields
+        response, _, _ = self.get(reverse('classes'), {'fields': 'teacher'})
+        self.assertEqual(response.data['results'][0]['teacher']['nickname'], 'teacher')
+
+    def test_unknown_fields_are_rejected(self):
+        response, _, _ = self.get(reverse('session-lessons', args=[self.session.pk]), {'fields': 'id,secret'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.teacher).key}')
+        response = client.post(reverse('create-session') + '?fields=id,title', {'title': 'New'}, format='json')
+        self.assertEqual(set(response.json()), {'id', 'title'})
+        response = client.post(reverse('create-session') + '?exclude=nope', {'title': 'New'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ResponseCacheTestCase(TestCase):
+    def setUp(self):
+        self.school = School.objects.create(name='Test School')
+        self.student = User.objects.create(username='student', nickname='student', pin='1234', school=self.school)
+        self.teacher = User.objects.create(username='teacher', nickname='teacher', pin='0000', school=self.school)
+        self.admin = User.objects.create(username='admin', nickname='admin', pin='9999', school=self.school)
+        self.admin.groups.add(Group.objects.get_or_create(name='Admin')[0])
+        self.school_class = Class.objects.create(school=self.school, name='7A', teacher=self.teacher)
+        self.school_class.students.add(self.student)
+        session = Session.objects.create(title='Live', teacher=self.teacher, school=self.school)
+        self.lesson = Lesson.objects.create(title='Intro', content='x', school=self.school, session=session)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.student).key}')
+        cache.clear()
+        response_cache().clear()
+        token_cache.clear()
+        reset_stats()
+
+    def get(self, url, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params or {})
+        return response, len(queries)
+
+    def test_repeated_reads_are_served_from_the_cache(self):
+        self.get(reverse('classes'))  # Caches the token
+        response, count = self.get(reverse('classes'))
+        self.assertEqual(response['X-Cache'], 'hit')
+        self.assertEqual(count, 0)
+        self.assertEqual(response.data['results'][0]['students'][0]['nickname'], 'student')
+
+        # Query parameters are part of the key
+        response, _ = self.get(reverse('classes'), {'roster': 'summary'})
+        self.assertEqual(response['X-Cache'], 'miss')
+        self.assertEqual(response.data['results'][0]['student_count'], 1)
+        self.assertEqual(response_stats['endpoints']['classes'], {'hits': 1, 'misses': 2})
+
+        # ...but only those the endpoint reads: a cache buster doesn't split the entries
+        response, _ = self.get(reverse('classes'), {'roster': 'summary', '_': '123'})
+        self.assertEqual(response['X-Cache'], 'hit')
+
+    def test_writes_invalidate_the_school_scope(self):
+        self.get(reverse('classes'))
+        Class.objects.create(school=self.school, name='7B', teacher=self.teacher).students.add(self.student)
+        response, _ = self.get(reverse('classes'))
+        self.assertEqual(response['X-Cache'], 'miss')
+        self.assertEqual([c['name'] for c in response.data['results']], ['7A', '7B'])
+
+        # Roster changes from either side of the relation, and user edits
+        self.student.student_classes.remove(self.school_class)
+        response, _ = self.get(reverse('classes'))
+        self.assertEqual([c['name'] for c in response.data['results']], ['7B'])
+        self.teacher.nickname = 'ms-teacher'
+        self.teacher.save()
+        response, _ = self.get(reverse('classes'))
+        self.assertEqual(response.data['results'][0]['teacher']['nickname'], 'ms-teacher')
+
+        # Rosters show the school's name
+        self.school.name = 'Renamed School'
+        self.school.save()
+        response, _ = self.get(reverse('classes'))
+        self.assertEqual(response.data['results'][0]['teacher']['school'], 'Renamed School')
+
+        # Other schools keep their entries
+        other = School.objects.create(name='Other School')
+        Class.objects.create(school=other, name='8A', teacher=self.teacher)
+        self.assertEqual(self.get(reverse('classes'))[0]['X-Cache'], 'hit')
+
+    def test_progress_writes_invalidate_the_student(self):
+        self.get(reverse('progress'))
+        self.assertEqual(self.get(reverse('progress'))[0]['X-Cache'], 'hit')
+
+        Progress.objects.create(school=self.school, student=self.student, lesson=self.lesson, score=50)
+        response, _ = self.get(reverse('progress'))
+        self.assertEqual(response['X-Cache'], 'miss')
+        self.assertEqual(response.data['results'][0]['score'], 50)
+
+        # Bulk paths skip the signals but bump the version themselves
+        bulk_upsert_progress([{'student': self.student.pk, 'lesson': self.lesson.pk, 'score': 90,
+                               'completed': True, 'progress_data': None}], self.school.pk)
+        response, _ = self.get(reverse('progress'))
+        self.assertEqual(response.data['results'][0]['score'], 90)
+
+    def test_admin_user_list(self):
+        view = AdminUserListView.as_view()
+        factory = APIRequestFactory()
+
+        def get():
+            request = factory.get('/users/')
+            force_authenticate(request, user=self.admin)
+            return view(request)
+
+        self.assertEqual(get()['X-Cache'], 'miss')
+        self.assertEqual(get()['X-Cache'], 'hit')
+        User.objects.create(username='new', nickname='new', pin='1111', school=self.school)
+        response = get()
+        self.assertEqual(response['X-Cache'], 'miss')
+        self.assertIn('new', [user['nickname'] for user in response.data])
+
+        # A user moving to another school leaves the old school's list
+        self.student.school = School.objects.create(name='Other School')
+        self.student.save()
+        response = get()
+        self.assertEqual(response['X-Cache'], 'miss')
+        self.assertNotIn('student', [user['nickname'] for user in response.data])
+
+    @override_settings(CACHES={**settings.CACHES, 'responses': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'lms-response-cache-test'),
+    }})
+    def test_file_based_backend(self):
+        response_cache().clear()
+        self.get(reverse('classes'))
+        self.assertEqual(self.get(reverse('classes'))[0]['X-Cache'], 'hit')
+        self.school_class.students.add(User.objects.create(username='b', nickname='b', pin='1', school=self.school))
+        response, _ = self.get(reverse('classes'))
+        self.assertEqual(response['X-Cache'], 'miss')
+        self.assertEqual(len(response.data['results'][0]['students']), 2)
+        response_cache().clear()
+
+
+class LessonPackageTestCase(TestCase):
+    PACKAGE = bytes(range(256)) * 40
+
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(LMS_PACKAGE_ROOT=self.root.name)
+        self.settings_override.enable()
+        teacher_group = Group.objects.get_or_create(name='Teacher')[0]
+
+        self.clients = {}
+        self.lessons = []
+        for name in ('a', 'b'):
+            school = School.objects.create(name=name)
+            teacher = User.objects.create(username=f'{name}-teacher', nickname=f'{name}-teacher', pin='0000', school=school)
+            teacher.groups.add(teacher_group)
+            student = User.objects.create(username=f'{name}-student', nickname=f'{name}-student', pin='1234', school=school)
+            session = Session.objects.create(title='Live', teacher=teacher, school=school)
+            self.lessons.append(Lesson.objects.create(title='VR', content='', school=school, session=session))
+            for user in (teacher, student):
+                self.clients[user.nickname] = client = APIClient()
+                client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=user).key}')
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.root.cleanup()
+
+    def upload(self, nickname, lesson, content=PACKAGE):
+        return self.clients[nickname].post(
+            reverse('lesson-package', args=[lesson.pk]), {'file': SimpleUploadedFile('lesson.zip', content)}, format='multipart'
+        )
+
+    def download(self, nickname, lesson, **headers):
+        return self.clients[nickname].get(reverse('lesson-package', args=[lesson.pk]), **headers)
+
+    def test_packages_are_stored_once_per_content(self):
+        response = self.upload('a-teacher', self.lessons[0])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        sha256 = response.data['sha256']
+        with open(package_path(sha256), 'rb') as stored:
+            self.assertEqual(stored.read(), self.PACKAGE)
+
+        # Another school uploads the same package: no second copy
+        response = self.upload('b-teacher', self.lessons[1])
+        self.assertEqual((response.status_code, response.data['sha256'], response.data['created']), (200, sha256, False))
+        self.assertEqual(LessonPackage.objects.count(), 1)
+        self.assertEqual(sorted(os.listdir(os.path.dirname(package_path(sha256)))), [sha256])
+
+        self.assertEqual(self.upload('a-student', self.lessons[0]).status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.upload('a-teacher', self.lessons[1]).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_only_the_sessions_teacher_replaces_the_package(self):
+        colleague = User.objects.create(username='a-colleague', nickname='a-colleague', pin='0000', school=self.lessons[0].school)
+        colleague.groups.add(Group.objects.get(name='Teacher'))
+        self.clients['a-colleague'] = client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=colleague).key}')
+
+        response = self.upload('a-colleague', self.lessons[0], content=b'replacement')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.lessons[0].refresh_from_db()
+        self.assertIsNone(self.lessons[0].package)
+        self.assertFalse(LessonPackage.objects.exists())
+
+    def test_downloads_support_ranges_and_revalidation(self):
+        self.assertEqual(self.download('a-student', self.lessons[0]).status_code, status.HTTP_404_NOT_FOUND)
+        sha256 = self.upload('a-teacher', self.lessons[0]).data['sha256']
+        size = len(self.PACKAGE)
+
+        response = self.download('a-student', self.lessons[0])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(response.streaming_content), self.PACKAGE)
+        self.assertEqual((response['ETag'], response['Accept-Ranges'], response['Content-Length']), (f'"{sha256}"', 'bytes', str(size)))
+
+        # Resuming: explicit, open-ended and suffix ranges
+        for header, start, end in (('bytes=10-19', 10, 19), (f'bytes={size - 5}-', size - 5, size - 1), ('bytes=-3', size - 3, size - 1)):
+            response = self.download('a-student', self.lessons[0], HTTP_RANGE=header)
+            self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+            self.assertEqual(b''.join(response.streaming_content), self.PACKAGE[start:end + 1])
+            self.assertEqual(response['Content-Range'], f'bytes {start}-{end}/{size}')
+            self.assertEqual(response['Content-Length'], str(end - start + 1))
+
+        response = self.download('a-student', self.lessons[0], HTTP_RANGE=f'bytes={size}-')
+        self.assertEqual((response.status_code, response['Content-Range']), (416, f'bytes */{size}'))
+
+        # A Range for another version of the package gets the whole new one
+        response = self.download('a-student', self.lessons[0], HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"old"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response.close()
+
+        # A headset that already has this package downloads nothing
+        response = self.download('a-student', self.lessons[0], HTTP_IF_NONE_MATCH=f'"{sha256}"')
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.assertEqual(self.download('b-student', self.lessons[0]).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_empty_package_has_no_satisfiable_range(self):
+        self.upload('a-teacher', self.lessons[0], content=b'')
+        for header in ('bytes=0-', 'bytes=-3'):
+            response = self.download('a-student', self.lessons[0], HTTP_RANGE=header)
+            self.assertEqual((response.status_code, response['Content-Range']), (416, 'bytes */0'))
+
+    def test_oversized_uploads_are_refused(self):
+        with override_settings(LMS_PACKAGE_MAX_SIZE=len(self.PACKAGE) - 1):
+            response = self.upload('a-teacher', self.lessons[0])
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertFalse(LessonPackage.objects.exists())
+        self.assertEqual(os.listdir(self.root.name), [])
+
+    def test_stored_file_is_removed_when_the_row_is_not_created(self):
+        def fail(**kwargs):
+            raise RuntimeError('database unavailable')
+
+        pre_save.connect(fail, sender=LessonPackage)
+        try:
+            with self.assertRaises(RuntimeError):
+                store_package(SimpleUploadedFile('lesson.zip', self.PACKAGE))
+        finally:
+            pre_save.disconnect(fail, sender=LessonPackage)
+        self.assertEqual([name for _, _, names in os.walk(self.root.name) for name in names], [])
+
+
+class ProgressPatchTestCase(TestCase):
+    def setUp(self):
+        self.school = School.objects.create(name='Test School')
+        self.student = User.objects.create(username='student', nickname='student', pin='1234', school=self.school)
+        teacher = User.objects.create(username='teacher', nickname='teacher', pin='0000', school=self.school)
+        session = Session.objects.create(title='Live', teacher=teacher, school=self.school)
+        self.lesson = Lesson.objects.create(title='Lesson', content='', school=self.school, session=session)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.student).key}')
+        self.url = reverse('progress-patch', args=[self.lesson.pk])
+
+    def test_merge_patch_and_cmi_elements(self):
+        response = self.client.patch(self.url, {
+            'version': 0,
+            'merge': {'cmi': {'location': '1', 'suspend_data': 'abc'}},
+            'set': {'cmi.interactions.0.id': 'q1', 'cmi.interactions.0.result': 'wrong'},
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['version'], 1)
+
+        response = self.client.patch(self.url, {
+            'version': 1,
+            'merge': {'cmi': {'suspend_data': None}},
+            'set': {'cmi.interactions.0.result': 'correct', 'cmi.interactions.1.id': 'q2'},
+            'score': 50,
+        }, format='json')
+        self.assertEqual(response.data['version'], 2)
+
+        progress = Progress.objects.get(student=self.student, lesson=self.lesson)
+        self.assertEqual(progress.score, 50)
+        self.assertEqual(progress.progress_data, {'cmi': {
+            'location': '1',
+            'interactions': [{'id': 'q1', 'result': 'correct'}, {'id': 'q2'}],
+        }})
+
+    def test_stale_version_is_rejected(self):
+        Progress.objects.create(school=self.school, student=self.student, lesson=self.lesson,
+                                progress_data={'cmi': {'location': '5'}}, version=3)
+
+        response = self.client.patch(self.url, {'version': 2, 'merge': {'cmi': {'location': '6'}}}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['version'], 3)
+        self.assertEqual(Progress.objects.get(student=self.student).progress_data, {'cmi': {'location': '5'}})
+
+    def test_invalid_paths_and_foreign_lessons(self):
+        response = self.client.patch(self.url, {'version': 0, 'set': {'cmi.interactions.3.id': 'q'}}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        other_school = School.objects.create(name='Other School')
+        other_teacher = User.objects.create(username='other', nickname='other', pin='0000', school=other_school)
+        other_session = Session.objects.create(title='Other', teacher=other_teacher, school=other_school)
+        other = Lesson.objects.create(title='Other', content='', school=other_school, session=other_session)
+        response = self.client.patch(reverse('progress-patch', args=[other.pk]), {'version': 0}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(Progress.objects.exists())
+
+
+class ProgressRollupTestCase(TestCase):
+    def setUp(self):
+        self.school = School.objects.create(name='Test School')
+        self.teacher = User.objects.create(username='teacher', nickname='teacher', pin='0000', school=self.school)
+        self.teacher.groups.add(Group.objects.get_or_create(name='Teacher')[0])
+        self.students = [
+            User.objects.create(username=f'student{i}', nickname=f'student{i}', pin='1234', school=self.school)
+            for i in range(3)
+        ]
+        self.session = Session.objects.create(title='Live', teacher=self.teacher, school=self.school)
+        self.other_session = Session.objects.create(title='Later', teacher=self.teacher, school=self.school)
+        self.lessons = [
+            Lesson.objects.create(title=f'Lesson {i}', content='', school=self.school, session=session)
+            for i, session in enumerate([self.session, self.session, self.other_session])
+        ]
+        self.lesson_class = Class.objects.create(name='Class', school=self.school, teacher=self.teacher)
+        self.lesson_class.students.add(*self.students[:2])
+
+    def stored_rollups(self):
+        # Rollup rows as {model: {pk: values}}, without rows that dropped back to zero
+        return {
+            model: {
+                row.pop('pk'): row
+                for row in model.objects.values('pk', 'school_id', *COUNTER_FIELDS)
+                if row['progress_count']
+            }
+            for model in (LessonRollup, SessionRollup, ClassRollup)
+        }
+
+    def test_incremental_rollups_match_aggregation(self):
+        first, second, third = self.students
+        progress = Progress.objects.create(school=self.school, student=first, lesson=self.lessons[0], score=15)
+        Progress.objects.create(school=self.school, student=third, lesson=self.lessons[1], score=70, completed=True)
+        progress.score, progress.completed = 95, True
+        progress.save()
+
+        patch_progress(second.pk, self.lessons[0].pk, self.school.pk, 0, score=42)
+        patch_progress(second.pk, self.lessons[0].pk, self.school.pk, 1, score=64, completed=True)
+        bulk_upsert_progress([
+            {'student': first.pk, 'lesson': lesson.pk, 'score': 30 * i, 'completed': i > 0, 'progress_data': None}
+            for i, lesson in enumerate(self.lessons)
+        ], self.school.pk)
+
+        Progress.objects.get(student=third).delete()
+        self.lesson_class.students.add(third)
+        self.lesson_class.students.remove(first)
+
+        self.assertEqual(self.stored_rollups(), compute_rollups())
+        rollup = SessionRollup.objects.get(pk=self.session.pk)
+        self.assertEqual((rollup.progress_count, rollup.completed_count, rollup.score_sum), (3, 2, 94))
+
+    def test_rebuild_command_restores_rollups(self):
+        for student in self.students:
+            Progress.objects.create(school=self.school, student=student, lesson=self.lessons[2], score=80)
+        expected = self.stored_rollups()
+        SessionRollup.objects.update(progress_count=0)
+        LessonRollup.objects.all().delete()
+
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertEqual(self.stored_rollups(), expected)
+
+    def test_analytics_endpoints(self):
+        Progress.objects.create(school=self.school, student=self.students[0], lesson=self.lessons[0], score=90, completed=True)
+        Progress.objects.create(school=self.school, student=self.students[1], lesson=self.lessons[0], score=50)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.teacher).key}')
+
+        response = client.get(reverse('session-analytics', args=[self.session.pk]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['average_score'], 70)
+        self.assertEqual(response.data['completion_rate'], 0.5)
+        self.assertEqual(response.data['score_distribution']['40-59'], 1)
+        self.assertEqual([lesson['progress_count'] for lesson in response.data['lessons']], [2, 0])
+        self.assertIsNone(response.data['lessons'][1]['average_score'])
+
+        response = client.get(reverse('class-analytics', args=[self.lesson_class.pk]))
+        self.assertEqual(response.data['progress_count'], 2)
+
+        other_school = School.objects.create(name='Other School')
+        other_teacher = User.objects.create(username='other', nickname='other', pin='0000', school=other_school)
+        other_session = Session.objects.create(title='Other', teacher=other_teacher, school=other_school)
+        response = client.get(reverse('session-analytics', args=[other_session.pk]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.students[0]).key}')
+        response = client.get(reverse('class-analytics', args=[self.lesson_class.pk]))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+# Query budgets and SQLite query plans for every URL, against realistic data volumes
+@unittest.skipUnless(connection.vendor == 'sqlite', "EXPLAIN QUERY PLAN output is SQLite-specific")
+@override_settings(LMS_DPVR_BACKEND='lms.dpvr_control.SimulatedBackend')
+class QueryPlanRegressionTestCase(TestCase):
+    # Tables small enough (or only read whole) that a scan is fine
+    SCAN_ALLOWED = {'auth_group', 'django_content_type', 'django_migrations'}
+
+    @classmethod
+    def setUpTestData(cls):
+        teacher_group = Group.objects.get_or_create(name='Teacher')[0]
+        student_group = Group.objects.get_or_create(name='Student')[0]
+        cls.schools = School.objects.bulk_create([School(name=f'School {i}') for i in range(3)])
+
+        for index, school in enumerate(cls.schools):
+            teachers = User.objects.bulk_create([
+                User(username=f's{index}t{i}', nickname=f's{index}t{i}', pin='0000', school=school, role='teacher')
+                for i in range(4)
+            ])
+            students = User.objects.bulk_create([
+                User(username=f's{index}u{i}', nickname=f's{index}u{i}', pin='1234', school=school)
+                for i in range(120)
+            ])
+            teacher_group.user_set.add(*teachers)
+            student_group.user_set.add(*students)
+
+            classes = Class.objects.bulk_create([
+                Class(name=f'Class {i}', school=school, teacher=teachers[i % 4]) for i in range(4)
+            ])
+            for i, school_class in enumerate(classes):
+                school_class.students.add(*students[i * 30:(i + 1) * 30 + 5])
+
+            sessions = Session.objects.bulk_create([
+                Session(title=f'Session {i}', school=school, teacher=teachers[i % 4]) for i in range(200)
+            ])
+            lessons = Lesson.objects.bulk_create([
+                Lesson(title=f'Lesson {i}', content='', school=school, session=sessions[i // 2]) for i in range(400)
+            ])
+            Progress.objects.bulk_create([
+                Progress(school=school, student=student, lesson=lessons[(i * 7 + j) % 400], score=(i + j) % 101,
+                         completed=j % 2 == 0, progress_data={'cmi': {'location': str(j)}})
+                for i, student in enumerate(students) for j in range(10)
+            ])
+        rebuild_rollups()
+
+        cls.school = cls.schools[0]
+        cls.teacher = User.objects.get(nickname='s0t0')
+        cls.student = User.objects.get(nickname='s0u0')
+        cls.session = Session.objects.filter(teacher=cls.teacher).order_by('id').first()
+        cls.lesson = Lesson.objects.filter(progress__student=cls.student).order_by('id').first()
+        cls.school_class = Class.objects.filter(teacher=cls.teacher).first()
+        cls.tokens = {user.pk: Token.objects.create(user=user).key for user in (cls.teacher, cls.student)}
+
+    def setUp(self):
+        # Every request pays the cold-cache price, so budgets don't depend on test order
+        token_cache.clear()
+        cache.clear()
+        response_cache().clear()
+        session_states.clear()
+        event_buffer.autoflush = False
+
+    def tearDown(self):
+        event_buffer.flush()
+        event_buffer.autoflush = True
+
+    def cases(self):
+        # (url name, url args, method, payload, user, expected status, query budget)
+        teacher, student = self.teacher, self.student
+        version = Progress.objects.get(student=student, lesson=self.lesson).version
+        return [
+            ('login', [], 'post', {'nickname': 's0u0', 'pin': '1234'}, None, 200, 2),
+            ('classes', [], 'get', {}, student, 200, 3),
+            ('classes', [], 'get', {'roster': 'summary'}, student, 200, 2),
+            ('create-session', [], 'post', {'title': 'New'}, teacher, 201, 2),
+            ('add-lesson', [], 'post', {'session_id': self.session.pk, 'title': 'L', 'content': ''}, teacher, 201, 3),
+            ('start-session', [], 'post', {'session_id': self.session.pk}, teacher, 200, 4),
+            ('pause-session', [], 'post', {'session_id': self.session.pk}, teacher, 200, 3),
+            ('stop-session', [], 'post', {'session_id': self.session.pk}, teacher, 200, 3),
+            ('lesson-package', [self.lesson.pk], 'get', {}, student, 404, 2),
+            ('session-lessons', [self.session.pk], 'get', {'fields': 'id,title'}, student, 200, 2),
+            ('session-presence', [self.session.pk], 'get', {}, teacher, 200, 2),
+            ('device-command', [], 'post', {'session_id': self.session.pk, 'action': 'stop', 'devices': []}, teacher, 200, 2),
+            ('progress', [], 'get', {}, student, 200, 2),
+            ('progress', [], 'get', {'progress_data': 'false', 'page_size': 5}, student, 200, 2),
+            # Row read, savepoint, compare-and-swap, rollups (2 lookups + read and upsert per model), release
+            ('progress-patch', [self.lesson.pk], 'patch', {'version': version, 'score': 10}, student, 200, 13),
+            ('progress-bulk', [], 'post', {'records': [
+                {'lesson': self.lesson.pk, 'score': 77, 'completed': True, 'progress_data': None},
+            ]}, student, 200, 16),
+            ('events', [], 'post', {'session_id': self.session.pk, 'events': [{'kind': 'click'}]}, student, 202, 2),
+            ('session-analytics', [self.session.pk], 'get', {}, teacher, 200, 3),
+            ('class-analytics', [self.school_class.pk], 'get', {}, teacher, 200, 2),
+            ('websocket', [], 'get', {}, None, 200, 0),
+            ('index', [], 'get', {}, None, 200, 0),
+        ]
+
+    def full_scans(self, queries):
+        # Plan steps that read a whole table (SQLite reports "SCAN <table>", indexed reads are "SEARCH")
+        scans = []
+        with connection.cursor() as cursor:
+            for query in queries:
+                sql = query['sql']
+                if not sql.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+                    continue
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                for *_, detail in cursor.fetchall():
+                    # "SCAN <table>" (older SQLite: "SCAN TABLE <table>")
+                    words = [word for word in detail.split() if word != 'TABLE']
+                    if words[0] == 'SCAN' and words[1] not in self.SCAN_ALLOWED and words[1] != 'CONSTANT':
+                        scans.append(f'{detail}\n    in: {sql}')
+        return scans
+
+    def test_every_url_is_covered(self):
+        self.assertEqual({case[0] for case in self.cases()}, {pattern.name for pattern in urlpatterns})
+
+    def test_class_list_starts_from_enrollments(self):
+        queryset = ClassListView().get_queryset(type('Request', (), {'user': self.student, 'query_params': {}}))
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            first_step = cursor.fetchall()[0][-1]
+        self.assertIn('lms_class_students_user_class_idx', first_step)
+
+    def test_query_budgets_and_plans(self):
+        for name, args, method, payload, user, expected_status, budget in self.cases():
+            with self.subTest(url=name):
+                token_cache.clear()
+                client = APIClient()
+                if user is not None:
+                    client.credentials(HTTP_AUTHORIZATION=f'Token {self.tokens[user.pk]}')
+                with CaptureQueriesContext(connection) as queries:
+                    response = getattr(client, method)(reverse(name, args=args), payload, format='json')
+                self.assertEqual(response.status_code, expected_status)
+                sql = '\n'.join(query['sql'] for query in queries.captured_queries)
+                self.assertLessEqual(len(queries), budget, f"{name} ran {len(queries)} queries:\n{sql}")
+                self.assertEqual(self.full_scans(queries.captured_queries), [])
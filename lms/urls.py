@@ -1,5 +1,5 @@
 from django.urls import path, include
-from .views import LoginView, ClassListView, CreateSessionView, AddLessonView, StartSessionView, PauseSessionView, StopSessionView, ProgressView, websocket_view, index_view
+from .views import LoginView, ClassListView, CreateSessionView, AddLessonView, StartSessionView, PauseSessionView, StopSessionView, DeviceCommandView, SessionPresenceView, LessonPackageView, SessionLessonListView, ProgressView, ProgressBulkView, ProgressPatchView, InteractionEventView, SessionAnalyticsView, ClassAnalyticsView, websocket_view, index_view
 from channels.routing import ProtocolTypeRouter, URLRouter
 
 urlpatterns = [
@@ -10,7 +10,16 @@ urlpatterns = [
     path('api/session/start/', StartSessionView.as_view(), name='start-session'),
     path('api/session/pause/', PauseSessionView.as_view(), name='pause-session'),
     path('api/session/stop/', StopSessionView.as_view(), name='stop-session'),
+    path('api/session/devices/', DeviceCommandView.as_view(), name='device-command'),
+    path('api/session/<int:session_id>/presence/', SessionPresenceView.as_view(), name='session-presence'),
+    path('api/session/<int:session_id>/lessons/', SessionLessonListView.as_view(), name='session-lessons'),
+    path('api/lessons/<int:lesson_id>/package/', LessonPackageView.as_view(), name='lesson-package'),
     path('api/results/', ProgressView.as_view(), name='progress'),
+    path('api/progress/bulk/', ProgressBulkView.as_view(), name='progress-bulk'),
+    path('api/progress/<int:lesson_id>/', ProgressPatchView.as_view(), name='progress-patch'),
+    path('api/events/', InteractionEventView.as_view(), name='events'),
+    path('api/analytics/sessions/<int:session_id>/', SessionAnalyticsView.as_view(), name='session-analytics'),
+    path('api/analytics/classes/<int:class_id>/', ClassAnalyticsView.as_view(), name='class-analytics'),
     path('websocket/', websocket_view, name='websocket'),
     path('index/', index_view, name='index'),
 ]
@@ -1,10 +1,27 @@
+import zlib
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
 from django.utils.timezone import now
-from .models import User, Session, Lesson, Class, Progress
-from .serializers import SessionSerializer, LessonSerializer, ProgressSerializer, ClassSerializer, UserSerializer
+from django.db.models import Count, Prefetch
+from django.http import FileResponse, HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from .models import User, Session, Lesson, Class, Progress, LessonRollup, SessionRollup, ClassRollup
+from .serializers import project_queryset, SessionSerializer, LessonSerializer, ProgressSerializer, ProgressSummarySerializer, ProgressRecordSerializer, ProgressPatchSerializer, ClassSerializer, ClassSummarySerializer, RollupSerializer, UserSerializer
+from .pagination import ClassCursorPagination, ProgressCursorPagination
+from channels.layers import get_channel_layer
+from .async_views import AsyncAPIView
+from .consumers import broadcast_control
+from .session_state import session_states
+from .dpvr_control import ACTIONS as DEVICE_ACTIONS, dpvr_controller
+from .presence import presence_registry
+from .ingest import build_events, event_buffer
+from .progress import VersionConflict, bulk_upsert_progress, patch_progress, progress_version
+from .scorm import PatchError
+from .packages import FileRange, PackageTooLarge, package_path, parse_range, store_package
+from .response_cache import CLASSES, PROGRESS, USERS, cached_response
+from .roles import ROLE_TEACHER, get_role_mask
 from rest_framework.authtoken.models import Token
 from .permissions import IsTeacher, IsSchoolAdmin
 from django.contrib.auth import get_user_model
@@ -19,7 +36,7 @@ class LoginView(APIView):
         nickname = request.data.get('nickname')
         pin = request.data.get('pin')
 
-        user = User.objects.filter(nickname=nickname).first()
+        user = User.objects.select_related('school').filter(nickname=nickname).first()
 
         # Check if user exists and PIN matches
         if user and user.pin == pin:
@@ -38,113 +55,456 @@ class LoginView(APIView):
 # Fetch Classes Enrolled in
 class ClassListView(APIView):
     permission_classes = [IsAuthenticated]
+    pagination_class = ClassCursorPagination
+    # Query parameters the response depends on, for the response cache key
+    cache_params = ['roster', 'fields', 'exclude', 'cursor', 'page_size']
+
+    def get_queryset(self, request):
+        summary = request.query_params.get('roster') == 'summary'
+        queryset = Class.objects.all()
+
+        if summary:
+            # Summary mode: student counts instead of nested users. Annotating before the
+            # enrollment filter keeps the count on its own join.
+            queryset = queryset.annotate(student_count=Count('students', distinct=True))
+
+        # Filter classes by the user's school (school_id avoids a lookup on request.user.school)
+        queryset = queryset.filter(students=request.user, school_id=request.user.school_id)
+
+        if summary:
+            return project_queryset(queryset, ClassSummarySerializer, request)
+
+        # Full roster: teacher + school in the class query, students + their school in one prefetch,
+        # each left out when ?fields=/?exclude= drop it
+        selected = ClassSerializer(context={'request': request}).fields
+        if 'teacher' in selected:
+            queryset = queryset.select_related('teacher__school')
+        if 'students' in selected:
+            queryset = queryset.prefetch_related(
+                Prefetch('students', queryset=User.objects.select_related('school').order_by('id'))
+            )
+        return project_queryset(queryset, ClassSerializer, request)
 
     def get(self, request):
-        # Filter classes by the user's school
-        user_classes = request.user.student_classes.filter(school=request.user.school)
-        serialized_classes = ClassSerializer(user_classes, many=True).data
-        return Response(serialized_classes)
+        # Any write to the school's classes, rosters or users changes the generation and misses
+        return cached_response('classes', request, [(CLASSES, request.user.school_id)], lambda: self.list(request),
+                               self.cache_params)
+
+    def list(self, request):
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(self.get_queryset(request), request, view=self)
+
+        if request.query_params.get('roster') == 'summary':
+            serializer_class = ClassSummarySerializer
+        else:
+            serializer_class = ClassSerializer
+        return paginator.get_paginated_response(serializer_class(page, many=True, context={'request': request}).data)
+
+async def get_teacher_session(request):
+    # The teacher's own session named in the request body, or None
+    try:
+        return await Session.objects.aget(
+            id=request.data.get('session_id'), teacher_id=request.user.pk, school_id=request.user.school_id
+        )
+    except (Session.DoesNotExist, ValueError, TypeError):
+        return None
+
+
+def session_not_found():
+    return Response({'error': 'Session not found or unauthorized'}, status=status.HTTP_404_NOT_FOUND)
+
 
 # Create Session (Teachers Only)
-class CreateSessionView(APIView):
+class CreateSessionView(AsyncAPIView):
     permission_classes = [IsAuthenticated, IsTeacher]
 
-    def post(self, request):
+    async def post(self, request):
         teacher = request.user
         title = request.data.get('title')
 
         # Ensure session is created under the teacher's school
-        session = Session.objects.create(teacher=teacher, title=title, school=teacher.school)
-        return Response(SessionSerializer(session).data, status=status.HTTP_201_CREATED)
+        session = await Session.objects.acreate(teacher=teacher, title=title, school_id=teacher.school_id)
+        return Response(SessionSerializer(session, context={'request': request}).data, status=status.HTTP_201_CREATED)
 
 
 # Add Lesson to Session (Teachers Only)
-class AddLessonView(APIView):
+class AddLessonView(AsyncAPIView):
     permission_classes = [IsAuthenticated, IsTeacher]
 
-    def post(self, request):
-        session_id = request.data.get('session_id')
+    async def post(self, request):
         title = request.data.get('title')
         content = request.data.get('content')
 
-        try:
-            # Ensure session is from the same school as the teacher
-            session = Session.objects.get(id=session_id, teacher=request.user, school=request.user.school)
-        except Session.DoesNotExist:
-            return Response({'error': 'Session not found or unauthorized'}, status=status.HTTP_404_NOT_FOUND)
+        # Ensure session is from the same school as the teacher
+        session = await get_teacher_session(request)
+        if session is None:
+            return session_not_found()
 
         # Ensure the lesson is created under the teacher's school
-        lesson = Lesson.objects.create(session=session, title=title, content=content, school=request.user.school)
-        return Response(LessonSerializer(lesson).data, status=status.HTTP_201_CREATED)
+        lesson = await Lesson.objects.acreate(session=session, title=title, content=content, school_id=request.user.school_id)
+        return Response(LessonSerializer(lesson, context={'request': request}).data, status=status.HTTP_201_CREATED)
 
 
 # Start Session (Teachers Only)
-class StartSessionView(APIView):
+class StartSessionView(AsyncAPIView):
     permission_classes = [IsAuthenticated, IsTeacher]
 
-    def post(self, request):
-        session_id = request.data.get('session_id')
-
+    async def post(self, request):
         # Ensure session belongs to the teacher and their school
-        session = Session.objects.get(id=session_id, teacher=request.user, school=request.user.school)
-        session.is_active = True
-        session.started_at = timezone.now()  # Use timezone to set the current time
-        session.save()
-        
-        # Notify students through WebSocket
-        session.notify_students()  # This will trigger the WebSocket notification
+        session = await get_teacher_session(request)
+        if session is None:
+            return session_not_found()
+        state = await session_states.apply_now(session, 'start')  # Writes only the changed columns
+        # Sockets get the new state like a start sent on the socket
+        await broadcast_control(get_channel_layer(), session.pk, state, 'Session has started', 'started')
+
+        # Notify students through WebSocket, awaiting the channel layer on this event loop
+        await session.anotify_students()
         return Response({'message': 'Session started'}, status=status.HTTP_200_OK)
 
 
 # Pause Session (Teachers Only)
-class PauseSessionView(APIView):
+class PauseSessionView(AsyncAPIView):
     permission_classes = [IsAuthenticated, IsTeacher]
 
-    def post(self, request):
-        session_id = request.data.get('session_id')
-
+    async def post(self, request):
         # Ensure session belongs to the teacher and their school
-        session = Session.objects.get(id=session_id, teacher=request.user, school=request.user.school)
-        if session.is_active:
-            session.is_paused = True
-            session.save()
-            return Response({'message': 'Session paused'}, status=status.HTTP_200_OK)
-        return Response({'error': 'Session is not active'}, status=status.HTTP_400_BAD_REQUEST)
+        session = await get_teacher_session(request)
+        if session is None:
+            return session_not_found()
+        state = await session_states.apply_now(session, 'pause')
+        if not state.is_active:
+            return Response({'error': 'Session is not active'}, status=status.HTTP_400_BAD_REQUEST)
+        await broadcast_control(get_channel_layer(), session.pk, state, 'Session is paused', 'paused')
+        return Response({'message': 'Session paused'}, status=status.HTTP_200_OK)
 
 
 # Stop Session (Teachers Only)
-class StopSessionView(APIView):
+class StopSessionView(AsyncAPIView):
     permission_classes = [IsAuthenticated, IsTeacher]
 
-    def post(self, request):
-        session_id = request.data.get('session_id')
-
+    async def post(self, request):
         # Ensure session belongs to the teacher and their school
-        session = Session.objects.get(id=session_id, teacher=request.user, school=request.user.school)
-        session.is_active = False
-        session.stopped_at = now()
-        session.save()
+        session = await get_teacher_session(request)
+        if session is None:
+            return session_not_found()
+        state = await session_states.apply_now(session, 'stop')
+        await broadcast_control(get_channel_layer(), session.pk, state, 'Session has stopped', 'stopped')
         return Response({'message': 'Session stopped'}, status=status.HTTP_200_OK)
 
 
+# Send a playback command to the session's headsets and report each device's acknowledgement
+class DeviceCommandView(AsyncAPIView):
+    permission_classes = [IsAuthenticated, IsTeacher]
+
+    async def post(self, request):
+        session = await get_teacher_session(request)
+        if session is None:
+            return session_not_found()
+        if dpvr_controller.backend is None:
+            return Response({'error': 'no DPVR backend configured'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        action = request.data.get('action')
+        if action not in DEVICE_ACTIONS:
+            return Response({'error': f'action must be one of {", ".join(DEVICE_ACTIONS)}'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Device ids are the headsets' DPVR ids, which socket peer ids are not, so the caller names them
+        devices = request.data.get('devices')
+        if not isinstance(devices, list) or not all(isinstance(device, str) for device in devices):
+            return Response({'error': 'devices must be a list of device ids'}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(await dpvr_controller.dispatch(devices, action, {'session_id': session.pk}))
+
+
+# Devices connected to a session's socket right now (served by this worker process)
+class SessionPresenceView(APIView):
+    permission_classes = [IsAuthenticated, IsTeacher]
+
+    def get(self, request, session_id):
+        if not Session.objects.filter(id=session_id, school_id=request.user.school_id).exists():
+            return Response({'error': 'Session not found or unauthorized'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({
+            'session': session_id,
+            'count': presence_registry.count(session_id),
+            'peers': presence_registry.roster(session_id),
+        }, status=status.HTTP_200_OK)
+
+
+# Lessons of a session in the user's school, in order; ?fields=id,title skips the content column
+class SessionLessonListView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, session_id):
+        lessons = Lesson.objects.filter(session_id=session_id, school_id=request.user.school_id).order_by('id')
+        lessons = project_queryset(lessons, LessonSerializer, request)
+        return Response(LessonSerializer(lessons, many=True, context={'request': request}).data, status=status.HTTP_200_OK)
+
+
+# Lesson package: download (with Range and ETag revalidation) for the school, upload for teachers
+class LessonPackageView(APIView):
+
+    def get_permissions(self):
+        if self.request.method == 'POST':
+            return [IsAuthenticated(), IsTeacher()]
+        return [IsAuthenticated()]
+
+    def get(self, request, lesson_id):
+        lesson = Lesson.objects.select_related('package').filter(id=lesson_id, school_id=request.user.school_id).first()
+        if lesson is None or lesson.package is None:
+            return Response({'error': 'Lesson package not found'}, status=status.HTTP_404_NOT_FOUND)
+        package = lesson.package
+
+        # The ETag is the content hash: a headset that has the package sends it in If-None-Match and gets a 304
+        etag = f'"{package.sha256}"'
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            try:
+                file = open(package_path(package.sha256), 'rb')
+            except FileNotFoundError:
+                return Response({'error': 'Lesson package not found'}, status=status.HTTP_404_NOT_FOUND)
+
+            # A Range is honoured unless If-Range names another version
+            byte_range = None
+            if request.META.get('HTTP_IF_RANGE', etag) == etag:
+                try:
+                    byte_range = parse_range(request.META.get('HTTP_RANGE'), package.size)
+                except ValueError:
+                    file.close()
+                    response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+                    response['Content-Range'] = f'bytes */{package.size}'
+                    return response
+
+            if byte_range is None:
+                response = FileResponse(file, as_attachment=True, filename=package.sha256)
+            else:
+                start, end = byte_range
+                file.seek(start)
+                response = FileResponse(FileRange(file, end - start + 1), status=status.HTTP_206_PARTIAL_CONTENT,
+                                        as_attachment=True, filename=package.sha256)
+                response['Content-Length'] = end - start + 1
+                response['Content-Range'] = f'bytes {start}-{end}/{package.size}'
+            response['Content-Type'] = 'application/octet-stream'
+            response['Accept-Ranges'] = 'bytes'
+
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    def post(self, request, lesson_id):
+        # Only the teacher of the lesson's session may replace its package
+        lesson = Lesson.objects.filter(id=lesson_id, school_id=request.user.school_id, session__teacher=request.user).first()
+        if lesson is None:
+            return Response({'error': 'Lesson not found or unauthorized'}, status=status.HTTP_404_NOT_FOUND)
+        uploaded = request.FILES.get('file')
+        if uploaded is None:
+            return Response({'error': 'Upload the package as "file"'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            package, created = store_package(uploaded)
+        except PackageTooLarge as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        lesson.package = package
+        lesson.save(update_fields=['package'])
+        return Response(
+            {'lesson': lesson.id, 'sha256': package.sha256, 'size': package.size, 'created': created},
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK,
+        )
+
+
 # Get Progress for SCORM Lessons
 class ProgressView(APIView):
     permission_classes = [IsAuthenticated]
+    pagination_class = ProgressCursorPagination
+    cache_params = ['progress_data', 'fields', 'exclude', 'cursor', 'page_size']
 
     def get(self, request):
+        # The validator comes from the student's progress version, so an unchanged poll costs no query.
+        # No Last-Modified: with one-second resolution two writes in the same second would share it
+        version = progress_version(request.user.pk)
+        etag = f'"{request.user.pk}-{version}-{zlib.crc32(request.META.get("QUERY_STRING", "").encode()):x}"'
+        response = get_conditional_response(request, etag=etag)
+
+        if response is None:
+            response = cached_response('results', request, [(PROGRESS, request.user.pk)], lambda: self.list(request),
+                                       self.cache_params)
+
+        response['ETag'] = etag
+        # Clients may keep the response but must revalidate it on every poll
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    def list(self, request):
         # Ensure progress is filtered by the student's school
-        progress = Progress.objects.filter(student=request.user, lesson__school=request.user.school)
-        return Response(ProgressSerializer(progress, many=True).data)
+        progress = Progress.objects.filter(student=request.user, lesson__school_id=request.user.school_id)
+        if request.query_params.get('progress_data') == 'false':
+            progress, serializer_class = progress.defer('progress_data'), ProgressSummarySerializer
+        else:
+            serializer_class = ProgressSerializer
+        progress = project_queryset(progress, serializer_class, request)
+
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(progress, request, view=self)
+        return paginator.get_paginated_response(serializer_class(page, many=True, context={'request': request}).data)
+
+# Bulk upsert of SCORM progress (a student's own records, or a teacher's for a session)
+class ProgressBulkView(APIView):
+    permission_classes = [IsAuthenticated]
+    max_records = 1000
+
+    def post(self, request):
+        records = request.data.get('records')
+        if not isinstance(records, list) or not 0 < len(records) <= self.max_records:
+            return Response({'error': f'records must be a list of 1 to {self.max_records} items'}, status=status.HTTP_400_BAD_REQUEST)
+
+        session_id = request.data.get('session_id')
+        is_teacher = bool(get_role_mask(request) & ROLE_TEACHER)
+        if session_id is not None and is_teacher:
+            # Teachers may only write progress for their own sessions
+            if not Session.objects.filter(id=session_id, teacher=request.user, school_id=request.user.school_id).exists():
+                return Response({'error': 'Session not found or unauthorized'}, status=status.HTTP_404_NOT_FOUND)
+
+        results = [None] * len(records)
+        items, positions = [], []
+        for index, record in enumerate(records):
+            serializer = ProgressRecordSerializer(data=record)
+            if not serializer.is_valid():
+                results[index] = {'index': index, 'status': 'error', 'error': serializer.errors}
+                continue
+            item = serializer.validated_data
+            if not is_teacher:
+                # Students can only report their own progress
+                if item.get('student', request.user.pk) != request.user.pk:
+                    results[index] = {'index': index, 'status': 'error', 'error': 'Students can only update their own progress'}
+                    continue
+                item['student'] = request.user.pk
+            elif 'student' not in item:
+                results[index] = {'index': index, 'status': 'error', 'error': {'student': ['This field is required.']}}
+                continue
+            items.append(item)
+            positions.append(index)
+
+        if items:
+            for index, result in zip(positions, bulk_upsert_progress(items, request.user.school_id, session_id)):
+                result['index'] = index
+                results[index] = result
+
+        return Response({'results': results}, status=status.HTTP_200_OK)
+
+
+# Incremental update of a student's own progress on a lesson, guarded by the row version
+class ProgressPatchView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def patch(self, request, lesson_id):
+        serializer = ProgressPatchSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        delta = serializer.validated_data
+        fields = {field: delta[field] for field in ('score', 'completed') if field in delta}
+
+        try:
+            version = patch_progress(
+                request.user.pk, lesson_id, request.user.school_id, delta['version'],
+                merge=delta.get('merge'), elements=delta.get('set'), **fields,
+            )
+        except Lesson.DoesNotExist:
+            return Response({'error': 'Lesson not found or unauthorized'}, status=status.HTTP_404_NOT_FOUND)
+        except PatchError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        except VersionConflict as exc:
+            # The client re-reads the row and retries its delta on top of this version
+            return Response({'error': 'Progress was modified by another update', 'version': exc.current}, status=status.HTTP_409_CONFLICT)
+
+        return Response({'lesson': lesson_id, 'version': version}, status=status.HTTP_200_OK)
+
+
+def rollup_of(instance, model):
+    # Stored rollup, or an empty one when nothing has been recorded yet
+    try:
+        return instance.rollup
+    except model.DoesNotExist:
+        return model(pk=instance.pk, school_id=instance.school_id)
+
+
+# Session analytics for teachers: session totals and one entry per lesson, read from the rollups
+class SessionAnalyticsView(APIView):
+    permission_classes = [IsAuthenticated, IsTeacher]
+
+    def get(self, request, session_id):
+        session = Session.objects.select_related('rollup').filter(id=session_id, school_id=request.user.school_id).first()
+        if session is None:
+            return Response({'error': 'Session not found or unauthorized'}, status=status.HTTP_404_NOT_FOUND)
+
+        lessons = Lesson.objects.filter(session=session).select_related('rollup').order_by('id')
+        return Response({
+            'session': session.id,
+            'title': session.title,
+            **RollupSerializer(rollup_of(session, SessionRollup)).data,
+            'lessons': [
+                {'lesson': lesson.id, 'title': lesson.title, **RollupSerializer(rollup_of(lesson, LessonRollup)).data}
+                for lesson in lessons
+            ],
+        }, status=status.HTTP_200_OK)
+
+
+# Class analytics for teachers: progress of the class's students, read from the rollup
+class ClassAnalyticsView(APIView):
+    permission_classes = [IsAuthenticated, IsTeacher]
+
+    def get(self, request, class_id):
+        lesson_class = Class.objects.select_related('rollup').filter(id=class_id, school_id=request.user.school_id).first()
+        if lesson_class is None:
+            return Response({'error': 'Class not found or unauthorized'}, status=status.HTTP_404_NOT_FOUND)
+
+        return Response({
+            'class': lesson_class.id,
+            'name': lesson_class.name,
+            **RollupSerializer(rollup_of(lesson_class, ClassRollup)).data,
+        }, status=status.HTTP_200_OK)
+
+
+# Batch-ingest interaction events from a headset (buffered, written in bulk)
+class InteractionEventView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        try:
+            session_id = int(request.data.get('session_id'))
+        except (TypeError, ValueError):
+            return Response({'error': 'session_id must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Ensure the session belongs to the user's school
+        if not Session.objects.filter(id=session_id, school_id=request.user.school_id).exists():
+            return Response({'error': 'Session not found or unauthorized'}, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            events = build_events(request.data.get('events'), session_id, request.user.school_id, request.user.pk)
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        retry_after = event_buffer.add(events)
+        if retry_after is not None:
+            # Backpressure: the buffer is full, ask the device to retry later
+            return Response(
+                {'error': 'Event buffer full', 'retry_after': retry_after},
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+                headers={'Retry-After': str(max(1, round(retry_after)))},
+            )
+        return Response({'accepted': len(events)}, status=status.HTTP_202_ACCEPTED)
 
 #NO URLS FOR THESE SO FAR
 # Admin: List all users in the admin's school (Admin Only)
 class AdminUserListView(APIView):
     permission_classes = [IsAuthenticated, IsSchoolAdmin]
+    cache_params = ['fields', 'exclude']
 
     def get(self, request):
+        return cached_response('admin-users', request, [(USERS, request.user.school_id)], lambda: self.list(request),
+                               self.cache_params)
+
+    def list(self, request):
         # Get all users from the admin's school
-        users = User.objects.filter(school=request.user.school)
-        return Response(UserSerializer(users, many=True).data)
+        users = project_queryset(User.objects.filter(school=request.user.school), UserSerializer, request)
+        return Response(UserSerializer(users, many=True, context={'request': request}).data)
 
 
 # Admin: Create new user in the admin's school (Admin Only)
@@ -164,7 +524,7 @@ class AdminCreateUserView(APIView):
         elif role == 'student':
             user.groups.add(Group.objects.get(name='Student'))
 
-        return Response(UserSerializer(user).data, status=status.HTTP_201_CREATED)
+        return Response(UserSerializer(user, context={'request': request}).data, status=status.HTTP_201_CREATED)
 
 from django.shortcuts import render
 
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -58,6 +59,97 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Several ASGI workers on one host: start `manage.py runbroker` and point every worker at its socket
+if os.environ.get('LMS_BROKER_SOCKET'):
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "lms.layers.UnixSocketChannelLayer",
+            "CONFIG": {
+                "path": os.environ['LMS_BROKER_SOCKET'],
+                "capacity": 100,  # Per-channel queue bound in each worker
+            },
+        },
+    }
+
+# Trickle-ICE coalescing in lms.consumers.SessionConsumer: candidates for the same peer
+# are batched for up to this many seconds, or until this many have been gathered
+LMS_ICE_COALESCE_WINDOW = 0.03
+LMS_ICE_COALESCE_MAX = 10
+
+# Seconds lms.session_state waits before writing live session state back to the database;
+# toggles within the window are coalesced into one UPDATE
+LMS_SESSION_FLUSH_DELAY = 0.25
+
+# Clock sync in lms.consumers.SessionConsumer (see lms/clock.py): pings in the initial burst,
+# seconds between later pings and samples kept per connection. Control broadcasts are
+# scheduled the session's worst round trip plus the margin ahead, at most the max (ms)
+LMS_CLOCK_SYNC_SAMPLES = 8
+LMS_CLOCK_SYNC_INTERVAL = 5.0
+LMS_CLOCK_SYNC_WINDOW = 16
+LMS_CONTROL_LEAD_MARGIN = 50
+LMS_CONTROL_LEAD_MAX = 1000
+
+# Seconds without any frame (clients send {"action": "heartbeat"} when idle) after which
+# lms.consumers.SessionConsumer closes a socket and drops it from the presence roster;
+# None disables eviction, for clients that never send heartbeats
+LMS_PRESENCE_TIMEOUT = None
+
+# Highest rate (Hz) at which a student's pose/gaze reaches teachers watching viewports;
+# teachers get one batched frame per tick
+LMS_VIEWPORT_RATE = 10
+
+# Outbound queue of each session socket (lms/outbound.py): reliable frames waiting before
+# the client is disconnected as too slow, and ephemeral frames kept before the oldest is dropped
+LMS_SEND_QUEUE_LIMIT = 256
+LMS_SEND_QUEUE_EPHEMERAL = 32
+
+# Directory of the content-addressed lesson package store (lms/packages.py), and the
+# largest upload it accepts in bytes
+LMS_PACKAGE_ROOT = BASE_DIR / 'packages'
+LMS_PACKAGE_MAX_SIZE = 2 * 1024 ** 3
+
+# Response cache of the class list, progress list and admin user list (lms/response_cache.py):
+# cache alias, and seconds an entry is kept when no signal invalidated it first
+LMS_RESPONSE_CACHE = 'responses'
+LMS_RESPONSE_CACHE_TIMEOUT = 300
+
+# Headset commands (lms.dpvr_control): backend class, commands in flight, seconds to wait for
+# each acknowledgement, retries after a timeout or error, and the base of the jittered backoff.
+# No backend by default: device commands return 503 until the SDK backend is named here
+LMS_DPVR_BACKEND = None
+LMS_DPVR_CONCURRENCY = 32
+LMS_DPVR_TIMEOUT = 2.0
+LMS_DPVR_RETRIES = 2
+LMS_DPVR_BACKOFF = 0.1
+
+# Interaction event ingestion (lms.ingest): rows are bulk-inserted once this many are
+# pending or after this many seconds; beyond the buffer size producers get a retry hint
+LMS_EVENT_FLUSH_SIZE = 1000
+LMS_EVENT_FLUSH_INTERVAL = 1.0
+LMS_EVENT_BUFFER_SIZE = 20000
+
+# Per-student progress versions (ETags of /api/results/) live in the default cache. With
+# several worker processes point it at a shared backend (Redis, Memcached), or a worker
+# may answer 304 for a change made in another one
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'responses': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'lms-responses',
+    },
+}
+
+# Several workers on one host without a shared cache server: keep cached responses (and their
+# generations) in a directory they all use, so a write in one worker invalidates them everywhere
+if os.environ.get('LMS_RESPONSE_CACHE_DIR'):
+    CACHES['responses'] = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ['LMS_RESPONSE_CACHE_DIR'],
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -148,8 +240,12 @@ AUTH_USER_MODEL = 'lms.User'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'lms.authentication.CachedTokenAuthentication',
     ],
 }
 
+# Token -> principal cache used by lms.authentication.CachedTokenAuthentication
+LMS_TOKEN_CACHE_SIZE = 4096  # Max cached tokens per process
+LMS_TOKEN_CACHE_TTL = 60  # Seconds before a cached principal is re-read from the database
+
 